@@ -5,8 +5,10 @@ allowing you to send messages, images, video and documents programmatically usin
 
 
 import os
+import re
 import sys
 import time
+import queue
 import logging
 from typing import Optional
 from pathlib import Path
@@ -22,14 +24,26 @@ from selenium.webdriver.common.by import By
 from selenium.common.exceptions import (
     UnexpectedAlertPresentException,
     NoSuchElementException,
+    TimeoutException,
 )
 from webdriver_manager.chrome import ChromeDriverManager
+from alright.scheduler import RateScheduler
+from alright.compose import set_text
+from alright.navigator import ChatNavigator, OPENED, NOT_ON_WHATSAPP, TIMEOUT
+from alright.acks import AckTracker, FAILED, UNCONFIRMED
+from alright.chats import ChatList
+from alright.inbox import Inbox, INBOX_WAIT
 
 LOGGER = logging.getLogger()
 
+# send_direct_message(): the chat opened but the message could not be handed to it
+SEND_FAILED = "send_failed"
+# seconds get_last_message_received() gives the rows of a chat just opened to show up
+LAST_MESSAGE_WAIT = 5
+
 
 class WhatsApp(object):
-    def __init__(self, browser=None, time_out=600):
+    def __init__(self, browser=None, time_out=600, scheduler=None, account="default", on_ack=None):
         # CJM - 20220419: Added time_out=600 to allow the call with less than 600 sec timeout
         # web.open(f"https://web.whatsapp.com/send?phone={phone_no}&text={quote(message)}")
 
@@ -51,6 +65,18 @@ class WhatsApp(object):
         self.browser = browser
         # CJM - 20220419: Added time_out=600 to allow the call with less than 600 sec timeout
         self.wait = WebDriverWait(self.browser, time_out)
+        # optional RateScheduler pacing the messages of this account
+        self.scheduler = scheduler
+        self.account = account
+        # opens chats inside the loaded app instead of reloading the page for every number
+        self.navigator = ChatNavigator(self.browser, self.BASE_URL, time_out)
+        # watches the ticks of the sent messages in the page, `on_ack` is called with each Ack
+        self.on_ack = on_ack
+        self.acks = AckTracker(self.browser, on_ack=self.acknowledged)
+        # reads the chat list in single calls
+        self.chats = ChatList(self.browser)
+        # incoming messages pushed by an observer in the page, see listen()
+        self.inbox = Inbox(self.browser)
         self.cli()
         self.login()
         self.mobile = ""
@@ -123,28 +149,72 @@ class WhatsApp(object):
         """
         try:
             WebDriverWait(self.browser, seconds).until(EC.alert_is_present())
-            alert = self.browser.switch_to_alert.accept()
+            self.browser.switch_to.alert.accept()
+            if self.scheduler is not None:
+                self.scheduler.warning(self.account, "(alert)")
             return True
         except Exception as e:
             LOGGER.exception(f"An exception occurred: {e}")
             return False
 
-    def find_user(self, mobile) -> None:
+    def pace(self):
+        """pace()
+
+        waits for the scheduler, if any, to allow the next message of this account
+        """
+        if self.scheduler is not None:
+            waited = self.scheduler.acquire(self.account)
+            if waited:
+                LOGGER.info(f"Paced {self.account} for {waited:.1f}s")
+
+    def report(self, ok: bool, started: Optional[float] = None, latency: Optional[float] = None):
+        """report()
+
+        feeds the outcome of a send back to the scheduler, if any
+        """
+        if self.scheduler is None:
+            return
+        if ok:
+            if latency is None and started is not None:
+                latency = time.monotonic() - started
+            self.scheduler.success(self.account, latency)
+        else:
+            self.scheduler.warning(self.account, "(failed send)")
+
+    def acknowledged(self, ack):
+        """acknowledged()
+
+        the first tick (or the failure) of a message paces the scheduler with the real round trip
+        """
+        # an unconfirmed message has no round trip to tell
+        if ack.resolved and ack.state != UNCONFIRMED:
+            self.report(ack.state != FAILED, latency=ack.elapsed)
+        if self.on_ack is not None:
+            self.on_ack(ack)
+
+    def find_user(self, mobile, timeout=20):
         """find_user()
         Makes a user with a given mobile a current target for the wrapper
 
         Args:
             mobile ([type]): [description]
+            timeout (int): seconds to wait for the chat to open
+
+        Returns:
+            NavigationResult: status is "opened", "not_on_whatsapp" or "timeout"
         """
+        # the ticks of the messages of the chat being left are only seen while it is open
+        self.acks.settle()
+        self.mobile = mobile
         try:
-            self.mobile = mobile
-            link = self.get_phone_link(mobile)
-            self.browser.get(link)
-            time.sleep(3)
+            result = self.navigator.open(mobile, timeout)
         except UnexpectedAlertPresentException as bug:
             LOGGER.exception(f"An exception occurred: {bug}")
-            time.sleep(1)
-            self.find_user(mobile)
+            self.catch_alert(1)
+            result = self.navigator.open(mobile, timeout)
+        if result.status != OPENED:
+            LOGGER.info(f"Could not open the chat of {mobile}: {result.status}")
+        return result
 
     def find_by_username(self, username):
         """find_user_by_name ()
@@ -294,81 +364,9 @@ class WhatsApp(object):
     def get_list_of_messages(self):
         """get_list_of_messages()
 
-        gets the list of messages in the page
+        gets the list of messages in the page, read in a single call
         """
-        messages = self.wait.until(
-            EC.presence_of_all_elements_located(
-                (By.XPATH, '//*[@id="pane-side"]/div[2]/div/div/child::div')
-            )
-        )
-
-        clean_messages = []
-        for message in messages:
-            _message = message.text.split("\n")
-            if len(_message) == 2:
-                clean_messages.append(
-                    {
-                        "sender": _message[0],
-                        "time": _message[1],
-                        "message": "",
-                        "unread": False,
-                        "no_of_unread": 0,
-                        "group": False,
-                    }
-                )
-            elif len(_message) == 3:
-                clean_messages.append(
-                    {
-                        "sender": _message[0],
-                        "time": _message[1],
-                        "message": _message[2],
-                        "unread": False,
-                        "no_of_unread": 0,
-                        "group": False,
-                    }
-                )
-            elif len(_message) == 4:
-                clean_messages.append(
-                    {
-                        "sender": _message[0],
-                        "time": _message[1],
-                        "message": _message[2],
-                        "unread": _message[-1].isdigit(),
-                        "no_of_unread": int(_message[-1])
-                        if _message[-1].isdigit()
-                        else 0,
-                        "group": False,
-                    }
-                )
-            elif len(_message) == 5:
-                clean_messages.append(
-                    {
-                        "sender": _message[0],
-                        "time": _message[1],
-                        "message": "",
-                        "unread": _message[-1].isdigit(),
-                        "no_of_unread": int(_message[-1])
-                        if _message[-1].isdigit()
-                        else 0,
-                        "group": True,
-                    }
-                )
-            elif len(_message) == 6:
-                clean_messages.append(
-                    {
-                        "sender": _message[0],
-                        "time": _message[1],
-                        "message": _message[4],
-                        "unread": _message[-1].isdigit(),
-                        "no_of_unread": int(_message[-1])
-                        if _message[-1].isdigit()
-                        else 0,
-                        "group": True,
-                    }
-                )
-            else:
-                LOGGER.info(f"Unknown message format: {_message}")
-        return clean_messages
+        return self.wait.until(lambda _: self.chats.visible() or None)
 
     def check_if_given_chat_has_unread_messages(self, query):
         """check_if_given_chat_has_unread_messages() [nCKbr]
@@ -394,6 +392,25 @@ class WhatsApp(object):
         except Exception as bug:
             LOGGER.exception(f"Exception raised while getting first chat: {bug}")
 
+    def write(self, input_box, message: str):
+        """write()
+
+        puts the whole message into a composer or caption box in one call, typing it
+        line by line only when the page ignores the injected text
+
+        Args:
+            input_box: the editable element
+            message (str): the message, may span several lines
+        """
+        if set_text(self.browser, input_box, message):
+            return
+        LOGGER.info("Injected text was ignored, typing the message line by line")
+        for line in message.split("\n"):
+            input_box.send_keys(line)
+            ActionChains(self.browser).key_down(Keys.SHIFT).key_down(
+                Keys.ENTER
+            ).key_up(Keys.ENTER).key_up(Keys.SHIFT).perform()
+
     def send_message1(self, mobile: str, message: str) -> str:
         # CJM - 20220419:
         #   Send WhatsApp Message With Different URL, NOT using https://wa.me/ to prevent WhatsApp Desktop to open
@@ -404,52 +421,37 @@ class WhatsApp(object):
         #   2 = Number to short
         #   3 = Error or Failure to Send Message
         #   4 = Not a WhatsApp Number
+        msg = f"3 "
         try:
-            # Browse to a "Blank" message state
-            self.browser.get(f"https://web.whatsapp.com/send?phone={mobile}&text")
-
-            # This is the XPath of the message textbox
-            inp_xpath = (
-                '//*[@id="main"]/footer/div[1]/div/span[2]/div/div[2]/div[1]/div/div[2]'
-            )
-            # This is the XPath of the "ok button" if the number was not found
-            nr_not_found_xpath = (
-                '//*[@id="app"]/div/span[2]/div/span/div/div/div/div/div/div[2]/div/div'
-            )
-
-            # If the number is NOT a WhatsApp number then there will be an OK Button, not the Message Textbox
-            # Test for both situations -> find_elements returns a List
-            ctrl_element = self.wait.until(
-                lambda ctrl_self: ctrl_self.find_elements(By.XPATH, nr_not_found_xpath)
-                or ctrl_self.find_elements(By.XPATH, inp_xpath)
-            )
-            # Iterate through the list of elements to test each if they are a textBox or a Button
-            for i in ctrl_element:
-                if i.aria_role == "textbox":
-                    # This is a WhatsApp Number -> Send Message
-
-                    for line in message.split("\n"):
-                        i.send_keys(line)
-                        ActionChains(self.browser).key_down(Keys.SHIFT).key_down(
-                            Keys.ENTER
-                        ).key_up(Keys.ENTER).key_up(Keys.SHIFT).perform()
-                    i.send_keys(Keys.ENTER)
-
-                    msg = f"1 "  # Message was sent successfully
-                    # Found alert issues when we send messages too fast, so I called the below line to catch any alerts
-                    self.catch_alert()
-
-                elif i.aria_role == "button":
-                    # Did not find the Message Text box
-                    # BUT we possibly found the XPath of the error "Phone number shared via url is invalid."
-                    if i.text == "OK":
-                        # This is NOT a WhatsApp Number -> Press enter and continue
-                        i.send_keys(Keys.ENTER)
-                        msg = f"4 "  # Not a WhatsApp Number
+            self.pace()
+            # Open the chat inside the running app, no page reload
+            result = self.find_user(mobile)
+            if result.status == NOT_ON_WHATSAPP:
+                msg = f"4 "  # Not a WhatsApp Number
+            elif result.status == TIMEOUT:
+                self.report(False)
+            else:
+                # This is a WhatsApp Number -> Send Message
+                input_box = self.browser.find_element(
+                    By.CSS_SELECTOR, '#main footer div[contenteditable="true"]'
+                )
+                self.write(input_box, message)
+                key = self.acks.expect(mobile)
+                try:
+                    input_box.send_keys(Keys.ENTER)
+                except Exception:
+                    self.acks.discard(key)
+                    raise
+
+                msg = f"1 "  # Message was handed to WhatsApp, its ticks are reported through on_ack
+                # Found alert issues when we send messages too fast, so I called the below line to catch any alerts
+                self.catch_alert()
+                self.acks.poll()
 
         except (NoSuchElementException, Exception) as bug:
             LOGGER.exception(f"An exception occurred: {bug}")
             msg = f"3 "
+            self.report(False)
 
         finally:
             LOGGER.info(f"{msg}")
@@ -461,6 +463,9 @@ class WhatsApp(object):
 
         Args:
             message ([type]): [description]
+
+        Returns:
+            bool: True when the message was handed to the chat, its ticks are reported through on_ack
         """
         try:
             inp_xpath = (
@@ -469,25 +474,45 @@ class WhatsApp(object):
             input_box = self.wait.until(
                 EC.presence_of_element_located((By.XPATH, inp_xpath))
             )
-            for line in message.split("\n"):
-                input_box.send_keys(line)
-                ActionChains(self.browser).key_down(Keys.SHIFT).key_down(
-                    Keys.ENTER
-                ).key_up(Keys.ENTER).key_up(Keys.SHIFT).perform()
+            self.write(input_box, message)
             if timeout:
                 time.sleep(timeout)
-            input_box.send_keys(Keys.ENTER)
-            LOGGER.info(f"Message sent successfuly to {self.mobile}")
+            key = self.acks.expect(self.mobile)
+            try:
+                input_box.send_keys(Keys.ENTER)
+            except Exception:
+                self.acks.discard(key)
+                raise
+            LOGGER.info(f"Message handed to the chat of {self.mobile}")
+            # the ticks of the earlier messages, the scheduler hears of this one once it has its own
+            self.acks.poll()
+            return True
         except (NoSuchElementException, Exception) as bug:
             LOGGER.exception(f"Failed to send a message to {self.mobile} - {bug}")
             LOGGER.info("send_message() finished running!")
+            self.report(False)
+            return False
 
     def send_direct_message(self, mobile: str, message: str, saved: bool = True):
+        """send_direct_message()
+
+        Returns:
+            str: "opened" when the message was handed to the chat, "send_failed" when the chat
+            opened but the message could not be sent, otherwise the navigation status
+            ("not_on_whatsapp" or "timeout")
+        """
+        self.pace()
         if saved:
             self.find_by_username(mobile)
         else:
-            self.find_user(mobile)
-        self.send_message(message)
+            status = self.find_user(mobile).status
+            if status != OPENED:
+                if status == TIMEOUT:
+                    self.report(False)
+                return status
+        if not self.send_message(message):
+            return SEND_FAILED
+        return OPENED
 
     def find_attachment(self):
         clipButton = self.wait.until(
@@ -510,20 +535,9 @@ class WhatsApp(object):
         input_box = self.wait.until(
             EC.presence_of_element_located((By.XPATH, inp_xpath))
         )
-        for line in message.split("\n"):
-            input_box.send_keys(line)
-            ActionChains(self.browser).key_down(Keys.SHIFT).key_down(Keys.ENTER).key_up(
-                Keys.ENTER
-            ).key_up(Keys.SHIFT).perform()
+        self.write(input_box, message)
 
     def send_attachment(self):
-        # Waiting for the pending clock icon to disappear
-        self.wait.until_not(
-            EC.presence_of_element_located(
-                (By.XPATH, '//*[@id="main"]//*[@data-icon="msg-time"]')
-            )
-        )
-
         sendButton = self.wait.until(
             EC.presence_of_element_located(
                 (
@@ -532,15 +546,14 @@ class WhatsApp(object):
                 )
             )
         )
-        sendButton.click()
-
-        # Waiting for the pending clock icon to disappear again - workaround for large files or loading videos.
-        # Appropriate solution for the presented issue. [nCKbr]
-        self.wait.until_not(
-            EC.presence_of_element_located(
-                (By.XPATH, '//*[@id="main"]//*[@data-icon="msg-time"]')
-            )
-        )
+        key = self.acks.expect(self.mobile)
+        try:
+            sendButton.click()
+        except Exception:
+            self.acks.discard(key)
+            raise
+        # the upload goes on in the page, its ticks are reported through on_ack
+        self.acks.poll()
 
     def send_picture(self, picture: Path, message: Optional[str] = None):
         """send_picture ()
@@ -667,17 +680,8 @@ class WhatsApp(object):
 
         LOGGER.info("Waiting for message status update to close browser...")
         try:
-            # Waiting for the pending clock icon shows and disappear
-            self.wait.until(
-                EC.presence_of_element_located(
-                    (By.XPATH, '//*[@id="main"]//*[@data-icon="msg-time"]')
-                )
-            )
-            self.wait.until_not(
-                EC.presence_of_element_located(
-                    (By.XPATH, '//*[@id="main"]//*[@data-icon="msg-time"]')
-                )
-            )
+            # every message in flight gets its tick or fails, at most the tracker timeout
+            self.acks.flush()
         except (NoSuchElementException, Exception) as bug:
             LOGGER.exception(f"Failed to send a message to {self.mobile} - {bug}")
         finally:
@@ -694,17 +698,8 @@ class WhatsApp(object):
 
         LOGGER.info("Waiting for message status update to before continuing...")
         try:
-            # Waiting for the pending clock icon shows and disappear
-            self.wait.until(
-                EC.presence_of_element_located(
-                    (By.XPATH, '//*[@id="main"]//*[@data-icon="msg-time"]')
-                )
-            )
-            self.wait.until_not(
-                EC.presence_of_element_located(
-                    (By.XPATH, '//*[@id="main"]//*[@data-icon="msg-time"]')
-                )
-            )
+            # every message in flight gets its tick or fails, at most the tracker timeout
+            return self.acks.flush()
         except (NoSuchElementException, Exception) as bug:
             LOGGER.exception(f"Failed to send a message to {self.mobile} - {bug}")
 
@@ -715,99 +710,75 @@ class WhatsApp(object):
 
         Args:
             query (string): query value to be located in the chat name
+
+        Returns:
+            IncomingMessage: the message, None when the chat has none
         """
         try:
             if self.find_by_username(query):
-                self.wait.until(
-                    EC.presence_of_element_located(
-                        (
-                            By.XPATH,
-                            "/html/body/div[1]/div/div/div[4]/div/div[1]/div/div/div[2]/div/div[1]/p",
-                        )
-                    )
-                )
+                # read in one call as soon as the chat shows an incoming row, instead of sleeping; a
+                # short wait of its own, the driver wait would hold a chat without incoming message
+                try:
+                    msg = WebDriverWait(self.browser, LAST_MESSAGE_WAIT, poll_frequency=0.25).until(
+                        lambda _: self.inbox.last())
+                except TimeoutException:
+                    LOGGER.info(f"No message received in the chat of {query}.")
+                    return None
+                LOGGER.info(f"Message sender: {msg.sender or query}.")
+                LOGGER.info(f"Message text: {msg.text or 'Video, image or other non-text message'}.")
+                LOGGER.info(f"Message time: {msg.time}.")
+                return msg
 
-                time.sleep(
-                    3
-                )  # clueless on why the previous wait is not respected - we need this sleep to load tha list.
+        except Exception as bug:
+            LOGGER.exception(f"Exception raised while getting first chat: {bug}")
 
-                list_of_messages = self.wait.until(
-                    EC.presence_of_all_elements_located(
-                        (
-                            By.XPATH,
-                            '//div[@id="main"]/div[3]/div[1]/div[2]/div[3]/child::div[contains(@class,"message-in")]',
-                        )
-                    )
-                )
+    def listen(self, until=None, timeout=None):
+        """listen()
 
-                if len(list_of_messages) == 0:
-                    LOGGER.exception(
-                        "It was not possible to retrieve the last message - probably it does not exist."
-                    )
-                else:
-                    msg = list_of_messages[-1]
-
-                    is_default_user = self.wait.until(
-                        EC.presence_of_element_located(
-                            (
-                                By.XPATH,
-                                '//div[@id="main"]/header/div[1]/div[1]/div[1]/span',
-                            )
-                        )
-                    ).get_attribute("data-testid")
-                    if is_default_user == "default-user":
-                        msg_sender = query
-                    else:
-                        msg_sender = msg.text.split("\n")[0]
-
-                    if len(msg.text.split("\n")) > 1:
-                        when = msg.text.split("\n")[-1]
-                        msg = (
-                            msg.text.split("\n")
-                            if "media-play" not in msg.get_attribute("innerHTML")
-                            else "Video or Image"
-                        )
-                    else:
-                        when = msg.text.split("\n")[0]
-                        msg = "Non-text message (maybe emoji?)"
-
-                    header_group = self.wait.until(
-                        EC.presence_of_element_located(
-                            (
-                                By.XPATH,
-                                '//div[@id="main"]/header/div[1]/div[1]/div[1]/span',
-                            )
-                        )
-                    )
-                    header_text = self.wait.until(
-                        EC.presence_of_element_located(
-                            (By.XPATH, '//div[@id="main"]/header/div[2]/div[2]/span')
-                        )
-                    )
+        yields every incoming message as the page reports it, until `until()` returns True
 
-                    if (
-                        header_group.get_attribute("data-testid") == "default-group"
-                        and msg_sender.strip() in header_text.text
-                    ):
-                        LOGGER.info(f"Message sender: {msg_sender}.")
-                    elif (
-                        msg_sender.strip() != msg[0].strip()
-                    ):  # it is not a messages combo
-                        LOGGER.info(f"Message sender: {msg_sender}.")
-                    else:
-                        LOGGER.info(
-                            f"Message sender: retrievable from previous messages."
-                        )
+        Args:
+            until: callable checked between two waits, None to listen forever
+            timeout (int): seconds of a single wait in the page [default = INBOX_WAIT]
+        """
+        timeout = INBOX_WAIT if timeout is None else timeout
+        self.inbox.install()
+        while until is None or not until():
+            self.inbox.wait(timeout)
+            while True:
+                try:
+                    message = self.inbox.messages.get_nowait()
+                except queue.Empty:
+                    break
+                yield message
 
-                    # DISCLAIMER: messages answering other messages carry the previous ones in the text.
-                    # Example: Message text: ['John', 'Mary', 'Hi, John!', 'Hi, Mary! How are you?', '14:01']
-                    # TODO: Implement 'filter_answer' boolean paramenter to sanitize this text based on previous messages search.
+    def reply(self, message, text: str) -> bool:
+        """reply()
 
-                    LOGGER.info(f"Message text: {msg}.")
-                    LOGGER.info(f"Message time: {when}.")
+        opens the chat of an IncomingMessage and sends `text` to it
 
-        except Exception as bug:
-            LOGGER.exception(f"Exception raised while getting first chat: {bug}")
+        Returns:
+            bool: True when the text was handed to the chat
+        """
+        chat = message.chat
+        if chat.endswith("@c.us"):
+            number = chat.split("@")[0]
+        elif "@" not in chat and re.fullmatch(r"\+?[\d\s()-]+", chat):
+            # a chat list title that is a phone number
+            number = re.sub(r"\D", "", chat)
+        else:
+            number = ""
+        self.pace()
+        if number:
+            opened = self.find_user(number).status == OPENED
+        elif chat.endswith("@g.us"):
+            LOGGER.info(f"Group {chat} is not answered")
+            return False
+        else:
+            opened = self.find_by_username(message.sender if "@" in chat else chat)
+        if not opened:
+            return False
+        return self.send_message(text)
 
     def fetch_all_unread_chats(self, limit=True, top=50):
         """fetch_all_unread_chats()  [nCKbr]
@@ -824,54 +795,14 @@ class WhatsApp(object):
 
         """
         try:
-            counter = 0
-            pane = self.wait.until(
-                EC.presence_of_element_located(
-                    (By.XPATH, '//div[@id="pane-side"]/div[2]')
-                )
-            )
-            list_of_messages = self.get_list_of_messages()
-            read_names = []
-            names = []
-            names_data = []
-
-            while True:
-                last_counter = counter
-                for item in list_of_messages:
-                    name = item["sender"]
-                    if name not in read_names:
-                        read_names.append(name)
-                        counter += 1
-                    if item["unread"]:
-                        if name not in names:
-                            names.append(name)
-                            names_data.append(item)
-
-                pane.send_keys(Keys.PAGE_DOWN)
-                pane.send_keys(Keys.PAGE_DOWN)
-
-                list_of_messages = self.get_list_of_messages()
-                if (
-                    last_counter == counter
-                    and counter
-                    >= int(
-                        self.wait.until(
-                            EC.presence_of_element_located(
-                                (By.XPATH, '//div[@id="pane-side"]/div[2]')
-                            )
-                        ).get_attribute("aria-rowcount")
-                    )
-                    * 0.9
-                ):
-                    break
-                if limit and counter >= top:
-                    break
-
-                LOGGER.info(f"The counter value at this chunk is: {counter}.")
+            # the page scrolls the chat list and collects every row once, keyed by chat id
+            chats = self.chats.scan(top if limit else None)
+            names_data = [chat for chat in chats if chat["unread"]]
+            names = [chat["sender"] for chat in names_data]
 
             if limit:
                 LOGGER.info(
-                    f"The list of unread chats, considering the first {counter} messages, is: {names}."
+                    f"The list of unread chats, considering the first {len(chats)} messages, is: {names}."
                 )
             else:
                 LOGGER.info(f"The list of all unread chats is: {names}.")
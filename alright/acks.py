@@ -0,0 +1,297 @@
+"""
+Non-blocking tracking of the acknowledgements of sent messages.
+
+Waiting for the `msg-time` clock of every message to show up and go away holds the sender for the
+whole round trip to the server, up to the 600 s of `WhatsApp.wait`. Here an observer installed in
+the page does the watching: `expect()` is called right before a message is sent, the observer ties
+the newest outgoing row (`data-id="true_<jid>_..."`) that shows up below the rows already there, in
+the same chat, to that token and records its tick changes (clock, one tick, two ticks, error) with
+the time they happened. `poll()`, one cheap call made whenever convenient, hands the changes
+collected meanwhile to a callback. The page only sees the ticks of the open chat, so `settle()`
+gives the messages of a chat a few seconds to leave the clock before the next chat is opened,
+usually none as the first tick comes within a second. A message still on the clock in the open
+chat after `timeout` seconds is reported failed, one whose chat was left before its first tick
+(a slow upload) is reported unconfirmed: it went out, its tick could not be seen. `flush()` waits
+for the messages still in flight at the end of a run.
+"""
+
+import re
+import json
+import logging
+from collections import namedtuple
+
+LOGGER = logging.getLogger()
+
+PENDING = "pending"
+SENT = "sent"
+DELIVERED = "delivered"
+FAILED = "failed"
+UNCONFIRMED = "unconfirmed"
+ACK_TIMEOUT = 60
+# longest wait for the messages of a chat to leave the clock before another chat is opened
+SETTLE_TIMEOUT = 5
+
+# token: what was given to expect(); resolved: True on the first sent, delivered, failed or
+# unconfirmed state of the message, the one a sender counts
+Ack = namedtuple("Ack", ["token", "state", "elapsed", "resolved"])
+
+ACK_JS = """
+if (!window.waAcks) {
+    var acks = window.waAcks = {tracked: {}, waiting: [], changes: [], timeout: arguments[0], scheduled: false};
+    acks.outgoing = function () {
+        var main = document.querySelector('#main');
+        return main === null ? [] : Array.prototype.slice.call(main.querySelectorAll('[data-id^="true_"]'));
+    };
+    acks.stateOf = function (row) {
+        var icon = row.querySelector('[data-icon^="msg-"], [data-icon*="error"], [data-icon*="alert"]');
+        var name = icon === null ? '' : icon.getAttribute('data-icon');
+        if (name.indexOf('error') !== -1 || name.indexOf('alert') !== -1) return 'failed';
+        if (name === 'msg-time') return 'pending';
+        if (name === 'msg-check') return 'sent';
+        if (name.indexOf('msg-dblcheck') === 0) return 'delivered';
+        return '';
+    };
+    acks.change = function (entry, state) {
+        entry.state = state;
+        acks.changes.push({key: entry.key, state: state, elapsed: (Date.now() - entry.at) / 1000});
+    };
+    // true_<jid>_<message>: a phone jid must be the number the message was sent to, other jids
+    // (groups, lids) are only known by the chat the message was typed in
+    acks.ofChat = function (wait, id) {
+        var jid = id.split('_')[1] || '';
+        return wait.chat === '' || jid.slice(-5) !== '@c.us' || jid.split('@')[0] === wait.chat;
+    };
+    acks.bind = function (rows) {
+        var main = document.querySelector('#main');
+        // newest key first: each takes the newest row it did not see, below every row it saw, so
+        // older rows rendered late and rows of another chat are never taken for a new message
+        for (var w = acks.waiting.length - 1; w >= 0; w--) {
+            var wait = acks.waiting[w];
+            if (main === null || main !== wait.main) continue;
+            var last = -1;
+            for (var i = 0; i < rows.length; i++) {
+                if (wait.known[rows[i].getAttribute('data-id')] === true) last = i;
+            }
+            for (var i = rows.length - 1; i > last; i--) {
+                var id = rows[i].getAttribute('data-id');
+                if (acks.tracked[id] === undefined && acks.ofChat(wait, id)) {
+                    acks.tracked[id] = {key: wait.key, at: wait.at, state: '', row: rows[i]};
+                    acks.waiting.splice(w, 1);
+                    break;
+                }
+            }
+        }
+    };
+    acks.scan = function () {
+        acks.scheduled = false;
+        var rows = acks.outgoing();
+        acks.bind(rows);
+        for (var i = 0; i < rows.length; i++) {
+            var entry = acks.tracked[rows[i].getAttribute('data-id')];
+            if (entry === undefined) continue;
+            var state = acks.stateOf(rows[i]);
+            if (state !== '' && state !== entry.state && entry.state !== 'delivered' && entry.state !== 'failed') {
+                acks.change(entry, state);
+            }
+        }
+        acks.expire();
+    };
+    acks.expire = function () {
+        var now = Date.now(), main = document.querySelector('#main');
+        acks.waiting = acks.waiting.filter(function (wait) {
+            if (now - wait.at < acks.timeout) return true;
+            // no row in the chat still open is a failure, a chat left before the row showed says nothing
+            acks.change(wait, main !== null && wait.main === main ? 'failed' : 'unconfirmed');
+            return false;
+        });
+        for (var id in acks.tracked) {
+            var entry = acks.tracked[id];
+            if (entry.state === 'delivered' || entry.state === 'failed') {
+                delete acks.tracked[id];
+            } else if (now - entry.at >= acks.timeout) {
+                // a message still on the clock in sight has failed, one with a tick is done being watched
+                if (entry.state === 'pending' || entry.state === '') {
+                    acks.change(entry, document.body.contains(entry.row) ? 'failed' : 'unconfirmed');
+                }
+                delete acks.tracked[id];
+            }
+        }
+    };
+    acks.discard = function (key) {
+        acks.waiting = acks.waiting.filter(function (wait) { return wait.key !== key; });
+        for (var id in acks.tracked) {
+            if (acks.tracked[id].key === key) delete acks.tracked[id];
+        }
+    };
+    acks.expect = function (key, chat) {
+        var known = {};
+        acks.outgoing().forEach(function (row) { known[row.getAttribute('data-id')] = true; });
+        acks.waiting.push({key: key, chat: chat, main: document.querySelector('#main'), known: known,
+                           at: Date.now(), state: ''});
+    };
+    // messages of the open chat still without a tick, the ones a chat change would lose sight of
+    acks.inFlight = function () {
+        var main = document.querySelector('#main'), count = 0;
+        acks.waiting.forEach(function (wait) { if (main !== null && wait.main === main) count++; });
+        for (var id in acks.tracked) {
+            var entry = acks.tracked[id];
+            if ((entry.state === 'pending' || entry.state === '') && document.body.contains(entry.row)) count++;
+        }
+        return count;
+    };
+    acks.drain = function () {
+        acks.scan();
+        var changes = acks.changes;
+        acks.changes = [];
+        return JSON.stringify(changes);
+    };
+    new MutationObserver(function () {
+        if (!acks.scheduled) {
+            acks.scheduled = true;
+            setTimeout(acks.scan, 0);
+        }
+    }).observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ['data-icon']});
+    setInterval(acks.expire, 1000);
+}
+"""
+
+EXPECT_JS = ACK_JS + """
+window.waAcks.expect(arguments[1], arguments[2]);
+"""
+
+DISCARD_JS = """
+if (window.waAcks) window.waAcks.discard(arguments[0]);
+"""
+
+DRAIN_JS = """
+return window.waAcks ? window.waAcks.drain() : '[]';
+"""
+
+# resolves once no message of the open chat is left without a tick, or after the timeout
+FLUSH_JS = """
+var done = arguments[arguments.length - 1], until = Date.now() + arguments[0];
+if (!window.waAcks) { done('[]'); return; }
+(function check() {
+    window.waAcks.scan();
+    if (window.waAcks.inFlight() === 0 || Date.now() >= until) {
+        done(window.waAcks.drain());
+    } else {
+        setTimeout(check, 250);
+    }
+})();
+"""
+
+
+class AckTracker(object):
+    def __init__(self, browser, timeout=ACK_TIMEOUT, on_ack=None):
+        """AckTracker()
+
+        Args:
+            browser: the selenium driver showing WhatsApp Web
+            timeout (int): seconds after which a message still on the clock is failed
+            on_ack: called with an Ack for every change of state, from poll() and flush()
+        """
+        self.browser = browser
+        self.timeout = timeout
+        self.on_ack = on_ack
+        # the token of every message expected and not resolved yet, by message key
+        self.unresolved = {}
+        self.tokens = {}
+        self.sequence = 0
+
+    def expect(self, token):
+        """expect()
+
+        ties the next message sent in the open chat to `token`; call it right before sending, and
+        `discard()` the key returned when the send fails
+        """
+        self.sequence += 1
+        key = f"{self.sequence}"
+        self.unresolved[key] = self.tokens[key] = f"{token}"
+        self.browser.execute_script(EXPECT_JS, int(self.timeout * 1000), key, re.sub(r"\D", "", f"{token}"))
+        return key
+
+    def discard(self, key):
+        """discard()
+
+        forgets the message expected under `key`, it was not sent and is reported by the sender
+        """
+        self.unresolved.pop(key, None)
+        self.tokens.pop(key, None)
+        try:
+            self.browser.execute_script(DISCARD_JS, key)
+        except Exception:
+            LOGGER.exception(f"Discarding acknowledgement {key}")
+
+    def dispatch(self, changes):
+        acks = []
+        for change in json.loads(changes or "[]"):
+            key, state = change["key"], change["state"]
+            token = self.tokens.get(key, key)
+            resolved = state != PENDING and key in self.unresolved
+            if resolved:
+                del self.unresolved[key]
+            if state in (DELIVERED, FAILED, UNCONFIRMED):
+                # nothing is reported after these
+                self.tokens.pop(key, None)
+            ack = Ack(token, state, change["elapsed"], resolved)
+            acks.append(ack)
+            if self.on_ack is not None:
+                try:
+                    self.on_ack(ack)
+                except Exception:
+                    LOGGER.exception(f"Acknowledgement of {token}")
+        return acks
+
+    def poll(self):
+        """poll()
+
+        hands the changes recorded by the page since the last call to `on_ack`, without waiting
+
+        Returns:
+            list: the Ack of every change
+        """
+        try:
+            changes = self.browser.execute_script(DRAIN_JS)
+        except Exception:
+            # the page could not be read (it is loading), the changes stay there for the next call
+            LOGGER.exception("Polling acknowledgements")
+            return []
+        return self.dispatch(changes)
+
+    def flush(self, timeout=None):
+        """flush()
+
+        waits, in the page, until every message of the open chat has a tick or failed, at most
+        `timeout` seconds (the tracker timeout by default); the others are reported unconfirmed
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.browser.set_script_timeout(timeout + 5)
+        acks = self.dispatch(self.browser.execute_async_script(FLUSH_JS, int(timeout * 1000)))
+        # messages out of sight (their chat was left, the page was reloaded) went out without a tick seen
+        lost = [{"key": key, "state": UNCONFIRMED, "elapsed": timeout} for key in self.unresolved]
+        if lost:
+            acks.extend(self.dispatch(json.dumps(lost)))
+        return acks
+
+    def settle(self, timeout=SETTLE_TIMEOUT):
+        """settle()
+
+        waits, at most `timeout` seconds, for the messages of the open chat to get their first tick;
+        call it before opening another chat, the page cannot see the ticks of a chat no longer open
+        """
+        if not self.unresolved:
+            return []
+        self.browser.set_script_timeout(timeout + 5)
+        return self.dispatch(self.browser.execute_async_script(FLUSH_JS, int(timeout * 1000)))
+
+    def pending(self, token) -> int:
+        """pending()
+
+        messages of `token` still waiting for their first tick
+        """
+        token = f"{token}"
+        return sum(1 for waiting in self.unresolved.values() if waiting == token)
+
+    def in_flight(self) -> int:
+        return len(self.unresolved)
@@ -0,0 +1,144 @@
+"""
+Reading the chat list of WhatsApp Web in single calls.
+
+Reading `.text` from every row of the side pane costs one WebDriver round trip per row, and paging
+through the pane with PAGE_DOWN re-reads the whole list on every page. Here the rows are read in
+the page: `visible()` returns the rows on screen as JSON in one `execute_script`, and `scan()` runs
+one asynchronous script that scrolls the pane by itself and collects every row it meets, keyed by
+chat id, so the virtualized list is read once whatever its length.
+"""
+
+import json
+import logging
+
+LOGGER = logging.getLogger()
+
+# pause between two scroll steps of scan(), for the pane to render the next rows
+SCROLL_PAUSE = 0.05
+SCAN_TIMEOUT = 300
+
+CHATS_JS = """
+window.waChats = window.waChats || {};
+window.waChats.pane = function () {
+    return document.querySelector('#pane-side');
+};
+window.waChats.rows = function () {
+    var found = document.evaluate('//*[@id="pane-side"]/div[2]/div/div/child::div', document, null,
+                                  XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var pane = window.waChats.pane();
+    // rows are placed by offset inside the scrolled list, `top` does not move with the scroll
+    var origin = pane === null ? 0 : pane.getBoundingClientRect().top - pane.scrollTop;
+    var rows = [];
+    for (var i = 0; i < found.snapshotLength; i++) {
+        var row = found.snapshotItem(i);
+        var lines = (row.innerText || '').split('\\n').filter(function (line) { return line.trim() !== ''; });
+        var inner = row.querySelector('[data-id]');
+        var title = row.querySelector('span[title]');
+        var id = inner !== null ? inner.getAttribute('data-id') : (title !== null ? title.getAttribute('title') : lines[0]);
+        if (id) rows.push({id: id, lines: lines, top: row.getBoundingClientRect().top - origin});
+    }
+    return rows;
+};
+"""
+
+VISIBLE_JS = CHATS_JS + """
+return JSON.stringify(window.waChats.rows());
+"""
+
+# scrolls the pane from the top until it stops moving or `limit` chats are collected, then puts it back
+SCAN_JS = CHATS_JS + """
+var done = arguments[arguments.length - 1], limit = arguments[0], pause = arguments[1];
+var pane = window.waChats.pane();
+if (pane === null) { done('[]'); return; }
+var seen = {}, count = 0, stalled = 0, start = pane.scrollTop;
+pane.scrollTop = 0;
+function finish() {
+    pane.scrollTop = start;
+    var rows = Object.keys(seen).map(function (id) { return seen[id]; });
+    rows.sort(function (a, b) { return a.top - b.top; });
+    done(JSON.stringify(rows));
+}
+(function step() {
+    window.waChats.rows().forEach(function (row) {
+        if (!seen.hasOwnProperty(row.id)) count++;
+        seen[row.id] = row;
+    });
+    if (limit && count >= limit) return finish();
+    var before = pane.scrollTop;
+    pane.scrollTop = before + Math.max(pane.clientHeight, 1);
+    // at the bottom the list may still be loading older chats, give it a few pauses
+    if (pane.scrollTop === before) {
+        if (++stalled >= 5) return finish();
+    } else {
+        stalled = 0;
+    }
+    setTimeout(step, pause);
+})();
+"""
+
+
+def chat_entry(chat_id, lines):
+    """chat_entry()
+
+    the chat described by the text `lines` of a row of the chat list, None for an unknown layout
+    """
+    entry = {
+        "id": chat_id,
+        "sender": lines[0] if lines else "",
+        "time": lines[1] if len(lines) > 1 else "",
+        "message": "",
+        "unread": False,
+        "no_of_unread": 0,
+        "group": len(lines) in (5, 6),
+    }
+    if len(lines) in (3, 4):
+        entry["message"] = lines[2]
+    elif len(lines) == 6:
+        entry["message"] = lines[4]
+    elif len(lines) != 2 and len(lines) != 5:
+        LOGGER.info(f"Unknown message format: {lines}")
+        return None
+    if len(lines) >= 4 and lines[-1].isdigit():
+        entry["unread"] = True
+        entry["no_of_unread"] = int(lines[-1])
+    return entry
+
+
+class ChatList(object):
+    def __init__(self, browser, pause=SCROLL_PAUSE, timeout=SCAN_TIMEOUT):
+        """ChatList()
+
+        Args:
+            browser: the selenium driver showing WhatsApp Web
+            pause (float): seconds between two scroll steps of scan()
+            timeout (int): seconds after which scan() gives up
+        """
+        self.browser = browser
+        self.pause = pause
+        self.timeout = timeout
+
+    def entries(self, rows):
+        entries = []
+        for row in json.loads(rows or "[]"):
+            entry = chat_entry(row["id"], row["lines"])
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    def visible(self):
+        """visible()
+
+        the chats of the rows rendered in the side pane, top first, in one call
+        """
+        return self.entries(self.browser.execute_script(VISIBLE_JS))
+
+    def scan(self, limit=None):
+        """scan()
+
+        every chat of the list, top first, read while the page scrolls the pane by itself
+
+        Args:
+            limit (int): stop once about this many chats are collected, None for all of them
+        """
+        self.browser.set_script_timeout(self.timeout)
+        return self.entries(self.browser.execute_async_script(SCAN_JS, limit or 0, int(self.pause * 1000)))
@@ -0,0 +1,37 @@
+"""
+Clipboard-free text entry for the WhatsApp composer and caption boxes.
+
+The whole message is handed to the page in one call and inserted through a synthetic paste event,
+which the editor handles like a real paste: newlines become line breaks, emoji and other non-BMP
+characters survive (chromedriver's send_keys cannot type them) and the system clipboard is never
+touched, so several browsers can type at the same time.
+"""
+
+PASTE_TEXT_JS = """
+var box = arguments[0], text = arguments[1];
+box.focus();
+var data = new DataTransfer();
+data.setData('text/plain', text);
+box.dispatchEvent(new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true}));
+if (box.textContent === '' && text !== '') {
+    // editors that ignore synthetic paste events still accept insertText
+    document.execCommand('insertText', false, text);
+}
+return box.textContent !== '' || text === '';
+"""
+
+
+def set_text(browser, element, text: str) -> bool:
+    """set_text()
+
+    puts `text` into the editable `element` in a single call
+
+    Args:
+        browser: the selenium driver owning `element`
+        element: the composer or caption box
+        text (str): the message, may span several lines
+
+    Returns:
+        bool: True when the box holds text afterwards
+    """
+    return bool(browser.execute_script(PASTE_TEXT_JS, element, text))
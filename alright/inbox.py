@@ -0,0 +1,218 @@
+"""
+Push delivery of incoming messages.
+
+Reading replies used to mean searching a chat, sleeping and scraping it, or scraping the chat list
+again and again. Here an observer installed in the page watches two places: the open chat, where
+every new incoming row (`data-id="false_..."`) is read whole, and the chat list, where a chat whose
+unread counter goes up stands for a message in a chat that is not open. The page keeps the events
+until Python asks: `poll()` takes them in one cheap call, `wait()` is an asynchronous script that
+returns the moment the observer records something, so a listener hears of a message within a
+mutation of its arrival. Every message is put in the `messages` queue and handed to the
+subscribers.
+"""
+
+import json
+import queue
+import logging
+from collections import namedtuple
+
+from alright.chats import CHATS_JS, chat_entry
+
+LOGGER = logging.getLogger()
+
+CHAT = "chat"
+LIST = "list"
+# rows of a chat that shows up (history loading) during this many seconds are not new messages
+INBOX_SETTLE = 1.5
+INBOX_WAIT = 30
+# events kept by the page while nobody reads them
+INBOX_LIMIT = 1000
+
+# source: CHAT for a message read in the open chat, LIST for an unread counter going up in the
+# chat list, where `text` is the preview and `unread` the counter
+IncomingMessage = namedtuple("IncomingMessage", ["id", "chat", "sender", "text", "time", "source", "unread"])
+
+INBOX_JS = CHATS_JS + """
+if (!window.waInbox) {
+    var inbox = window.waInbox = {seen: {}, chats: {}, main: null, settleUntil: 0, events: [], waiters: [],
+                                  settle: arguments[0], limit: arguments[1], ready: false, scheduled: false};
+    inbox.push = function (event) {
+        inbox.events.push(event);
+        if (inbox.events.length > inbox.limit) inbox.events.shift();
+    };
+    inbox.read = function (row) {
+        // false_<chat>_<message>[_<participant>], the pre-plain-text is "[time, date] sender: "
+        var id = row.getAttribute('data-id');
+        var copyable = row.querySelector('[data-pre-plain-text]');
+        var meta = copyable === null ? null : /^\\[([^\\]]*)\\]\\s*([^:]*):/.exec(copyable.getAttribute('data-pre-plain-text'));
+        var text = row.querySelector('span.selectable-text');
+        return {id: id, chat: id.split('_')[1] || '', sender: meta ? meta[2].trim() : '', time: meta ? meta[1] : '',
+                text: text !== null ? text.innerText : (copyable !== null ? copyable.innerText : ''), source: 'chat'};
+    };
+    inbox.incoming = function () {
+        var main = document.querySelector('#main');
+        return main === null ? [] : Array.prototype.slice.call(main.querySelectorAll('[data-id^="false_"]'));
+    };
+    inbox.scanChat = function () {
+        var main = document.querySelector('#main'), now = Date.now();
+        if (main === null) return;
+        if (main !== inbox.main) {
+            inbox.main = main;
+            inbox.settleUntil = now + inbox.settle;
+        }
+        var rows = inbox.incoming(), last = -1;
+        for (var i = 0; i < rows.length; i++) {
+            if (inbox.seen[rows[i].getAttribute('data-id')] === true) last = i;
+        }
+        for (var i = 0; i < rows.length; i++) {
+            var id = rows[i].getAttribute('data-id');
+            if (inbox.seen[id] === true) continue;
+            inbox.seen[id] = true;
+            // older messages loaded above the known ones are history
+            if (inbox.ready && now >= inbox.settleUntil && i > last) inbox.push(inbox.read(rows[i]));
+        }
+    };
+    inbox.scanList = function () {
+        window.waChats.rows().forEach(function (row) {
+            var lines = row.lines, tail = lines[lines.length - 1] || '';
+            var unread = lines.length >= 4 && /^\\d+$/.test(tail) ? parseInt(tail, 10) : 0;
+            var known = inbox.chats[row.id];
+            inbox.chats[row.id] = unread;
+            // a chat scrolled into view is not news, one that jumps to the top with unread messages is
+            if (inbox.ready && unread > 0 && (known === undefined ? row.top < 1 : unread > known)) {
+                inbox.push({id: row.id + '#' + unread, chat: row.id, lines: lines, source: 'list', unread: unread});
+            }
+        });
+    };
+    inbox.scan = function () {
+        inbox.scheduled = false;
+        inbox.scanChat();
+        inbox.scanList();
+        inbox.ready = true;
+        if (inbox.events.length && inbox.waiters.length) {
+            var waiters = inbox.waiters;
+            inbox.waiters = [];
+            var events = inbox.drain();
+            waiters.forEach(function (waiter) { clearTimeout(waiter.timer); waiter.done(events); });
+        }
+    };
+    inbox.drain = function () {
+        var events = inbox.events;
+        inbox.events = [];
+        return JSON.stringify(events);
+    };
+    inbox.wait = function (timeout, done) {
+        inbox.scan();
+        if (inbox.events.length) {
+            done(inbox.drain());
+            return;
+        }
+        var waiter = {done: done};
+        waiter.timer = setTimeout(function () {
+            inbox.waiters = inbox.waiters.filter(function (other) { return other !== waiter; });
+            done('[]');
+        }, timeout);
+        inbox.waiters.push(waiter);
+    };
+    new MutationObserver(function () {
+        if (!inbox.scheduled) {
+            inbox.scheduled = true;
+            setTimeout(inbox.scan, 0);
+        }
+    }).observe(document.body, {childList: true, subtree: true, characterData: true});
+    inbox.scan();
+}
+"""
+
+POLL_JS = INBOX_JS + """
+window.waInbox.scan();
+return window.waInbox.drain();
+"""
+
+WAIT_JS = INBOX_JS + """
+window.waInbox.wait(arguments[2], arguments[arguments.length - 1]);
+"""
+
+# the last incoming message of the open chat, history included
+LAST_JS = INBOX_JS + """
+var rows = window.waInbox.incoming();
+return rows.length ? JSON.stringify([window.waInbox.read(rows[rows.length - 1])]) : null;
+"""
+
+
+class Inbox(object):
+    def __init__(self, browser, settle=INBOX_SETTLE, limit=INBOX_LIMIT):
+        """Inbox()
+
+        Args:
+            browser: the selenium driver showing WhatsApp Web
+            settle (float): seconds during which the rows of a chat just opened are history
+            limit (int): events the page keeps while they are not read, the oldest are dropped
+        """
+        self.browser = browser
+        self.settle = settle
+        self.limit = limit
+        self.messages = queue.Queue()
+        self.handlers = []
+
+    def arguments(self):
+        return int(self.settle * 1000), self.limit
+
+    def subscribe(self, handler):
+        """subscribe()
+
+        calls `handler` with every IncomingMessage from now on
+        """
+        self.handlers.append(handler)
+        return handler
+
+    def parse(self, event):
+        if event["source"] == LIST:
+            entry = chat_entry(event["chat"], event["lines"]) or {}
+            return IncomingMessage(event["id"], event["chat"], entry.get("sender", event["chat"]),
+                                   entry.get("message", ""), entry.get("time", ""), LIST, event["unread"])
+        return IncomingMessage(event["id"], event["chat"], event["sender"], event["text"], event["time"], CHAT, 0)
+
+    def dispatch(self, events):
+        messages = [self.parse(event) for event in json.loads(events or "[]")]
+        for message in messages:
+            self.messages.put(message)
+            for handler in self.handlers:
+                try:
+                    handler(message)
+                except Exception:
+                    LOGGER.exception(f"Incoming message {message.id}")
+        return messages
+
+    def install(self):
+        """install()
+
+        starts watching the page; what is on screen at that time is not reported
+        """
+        self.browser.execute_script(INBOX_JS, *self.arguments())
+
+    def poll(self):
+        """poll()
+
+        the messages recorded since the last call, without waiting
+        """
+        return self.dispatch(self.browser.execute_script(POLL_JS, *self.arguments()))
+
+    def wait(self, timeout=INBOX_WAIT):
+        """wait()
+
+        the messages recorded since the last call, waiting in the page at most `timeout` seconds
+        for the first one; the driver is busy meanwhile
+        """
+        self.browser.set_script_timeout(timeout + 5)
+        return self.dispatch(self.browser.execute_async_script(WAIT_JS, *self.arguments(), int(timeout * 1000)))
+
+    def last(self):
+        """last()
+
+        the last incoming message of the open chat, None when it has none
+        """
+        found = self.browser.execute_script(LAST_JS, *self.arguments())
+        if not found:
+            return None
+        return self.parse(json.loads(found)[0])
@@ -0,0 +1,225 @@
+"""
+In-app navigation between chats of an already loaded WhatsApp Web page.
+
+Opening a chat through `browser.get(".../send?phone=...")` reloads the whole application every
+time. Here a `wa.me` link is clicked inside the page instead, which the single page app routes
+itself, and a MutationObserver reports as soon as the chat or the "invalid number" dialog shows
+up. Verdicts are cached per phone number so a number known not to be on WhatsApp is not looked
+up again, and the chat already on screen is not opened twice.
+"""
+
+import time
+import logging
+from collections import namedtuple
+
+LOGGER = logging.getLogger()
+
+OPENED = "opened"
+NOT_ON_WHATSAPP = "not_on_whatsapp"
+TIMEOUT = "timeout"
+
+NavigationResult = namedtuple("NavigationResult", ["status", "mobile", "elapsed"])
+
+# In-page state detection: `waState.wait` resolves as soon as one of the wanted states shows up in the DOM
+# (checked again on every mutation) instead of sleeping and scanning `page_source`.
+STATE_JS = """
+window.waState = window.waState || {};
+window.waState.dialogs = function () {
+    return Array.prototype.slice.call(document.querySelectorAll('[role="dialog"], [data-animate-modal-popup="true"]'));
+};
+window.waState.invalidDialog = function (stale) {
+    var dialogs = window.waState.dialogs();
+    for (var i = 0; i < dialogs.length; i++) {
+        if (stale.dialogs.indexOf(dialogs[i]) === -1 &&
+            dialogs[i].textContent.indexOf('Phone number shared via url is invalid') !== -1) {
+            return dialogs[i];
+        }
+    }
+    return null;
+};
+window.waState.composer = function () {
+    return document.querySelector('#main footer div[contenteditable="true"]');
+};
+// opening the chat already on screen (a duplicate number, the first number of a reused session)
+// keeps the same #main: it is the wanted chat when its rows or its header carry the number
+window.waState.shows = function (main, num) {
+    if (!num) return false;
+    if (main.querySelector('[data-id*="_' + num + '@c.us"]') !== null) return true;
+    var header = main.querySelector('header');
+    return header !== null && (header.textContent || '').replace(/\\D/g, '').indexOf(num) !== -1;
+};
+window.waState.detect = function (states, stale) {
+    for (var i = 0; i < states.length; i++) {
+        var state = states[i];
+        if (state === 'login') {
+            if (document.querySelector('*[data-icon=new-chat-outline]') !== null) return state;
+        } else if (state === 'invalid') {
+            if (window.waState.invalidDialog(stale) !== null) return state;
+        } else if (state === 'chat') {
+            var main = document.querySelector('#main');
+            if (main !== null && window.waState.composer() !== null &&
+                (main !== stale.main || window.waState.shows(main, stale.num))) return state;
+        } else if (state === 'typed' || state === 'sent') {
+            var composer = window.waState.composer();
+            if (composer !== null && (composer.textContent !== '') === (state === 'typed')) return state;
+        } else if (state === 'attach') {
+            if (document.querySelector('input[accept="image/*,video/mp4,video/3gpp,video/quicktime"]') !== null) {
+                return state;
+            }
+        } else if (state === 'preview') {
+            var icons = document.querySelectorAll('[data-icon="send"], [data-icon="wds-ic-send-filled"]');
+            for (var n = 0; n < icons.length; n++) {
+                if (icons[n].closest('#main footer') === null) return state;
+            }
+        }
+    }
+    return '';
+};
+window.waState.wait = function (states, timeout, stale, done) {
+    stale = stale || {};
+    stale.dialogs = stale.dialogs || [];
+    var found = window.waState.detect(states, stale);
+    if (found !== '') {
+        done(found);
+        return;
+    }
+    var timer = null;
+    var observer = new MutationObserver(function () {
+        var found = window.waState.detect(states, stale);
+        if (found !== '') {
+            observer.disconnect();
+            clearTimeout(timer);
+            done(found);
+        }
+    });
+    observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+    timer = setTimeout(function () {
+        observer.disconnect();
+        done('');
+    }, timeout);
+};
+// Click the hidden wa.me link (the app opens the chat without reloading) and wait for the chat or the
+// "invalid number" dialog, which is dismissed so the next number starts from a clean page.
+window.waState.open = function (num, timeout, done) {
+    var link = document.getElementById('wa-sender-link');
+    if (link === null) {
+        link = document.createElement('a');
+        link.id = 'wa-sender-link';
+        link.appendChild(document.createTextNode('hiding'));
+        document.head.appendChild(link);
+    }
+    var stale = {main: document.querySelector('#main'), dialogs: window.waState.dialogs(),
+                 num: String(num).replace(/\\D/g, '')};
+    link.setAttribute('href', 'https://wa.me/' + num);
+    link.click();
+    window.waState.wait(['invalid', 'chat'], timeout, stale, function (state) {
+        if (state === 'invalid') {
+            var button = window.waState.invalidDialog(stale).querySelector('button, [role="button"]');
+            if (button !== null) button.click();
+        }
+        done(state);
+    });
+};
+"""
+
+WAIT_STATE_JS = STATE_JS + """
+window.waState.wait(arguments[0], arguments[1], {}, arguments[arguments.length - 1]);
+"""
+
+OPEN_CHAT_JS = STATE_JS + """
+window.waState.open(arguments[0], arguments[1], arguments[arguments.length - 1]);
+"""
+
+COMPOSER_JS = STATE_JS + """
+return window.waState.composer() !== null;
+"""
+
+
+class ChatNavigator(object):
+    def __init__(self, browser, base_url="https://web.whatsapp.com/", login_timeout=600, ttl=7 * 24 * 3600):
+        """ChatNavigator()
+
+        Args:
+            browser: the selenium driver showing WhatsApp Web
+            base_url (str): loaded once when the browser is not on WhatsApp Web yet
+            login_timeout (int): seconds to wait for the chat list after a page load
+            ttl (int): seconds a "not on WhatsApp" verdict is trusted
+        """
+        self.browser = browser
+        self.base_url = base_url
+        self.login_timeout = login_timeout
+        self.ttl = ttl
+        self.cache = {}
+        self.current = None
+
+    def wait(self, states, timeout):
+        """wait()
+
+        returns the first of `states` shown by the page, "" after `timeout` seconds
+        """
+        self.browser.set_script_timeout(timeout + 5)
+        return self.browser.execute_async_script(WAIT_STATE_JS, states, int(timeout * 1000))
+
+    def ready(self) -> bool:
+        """ready()
+
+        loads WhatsApp Web if needed and waits for the chat list
+        """
+        if not self.browser.current_url.startswith(self.base_url):
+            self.browser.get(self.base_url)
+            self.current = None
+        return self.wait(["login"], self.login_timeout) == "login"
+
+    def known(self, mobile):
+        """known()
+
+        returns the cached verdict for `mobile`, None when it has to be looked up
+        """
+        entry = self.cache.get(mobile)
+        if entry is None:
+            return None
+        status, stamp = entry
+        if time.time() - stamp > self.ttl:
+            del self.cache[mobile]
+            return None
+        return status
+
+    def forget(self, mobile):
+        self.cache.pop(mobile, None)
+        if self.current == mobile:
+            self.current = None
+
+    def open(self, mobile, timeout=20) -> NavigationResult:
+        """open()
+
+        makes the chat of `mobile` the current one without reloading the page
+
+        Args:
+            mobile (str): phone number with country code
+            timeout (int): seconds to wait for the chat or the "invalid number" dialog
+
+        Returns:
+            NavigationResult: status is OPENED, NOT_ON_WHATSAPP or TIMEOUT
+        """
+        started = time.monotonic()
+        mobile = f"{mobile}".strip().lstrip("+")
+        if self.known(mobile) == NOT_ON_WHATSAPP:
+            return NavigationResult(NOT_ON_WHATSAPP, mobile, 0.0)
+        if self.current == mobile and self.browser.execute_script(COMPOSER_JS):
+            return NavigationResult(OPENED, mobile, 0.0)
+        if not self.ready():
+            self.current = None
+            return NavigationResult(TIMEOUT, mobile, time.monotonic() - started)
+        self.browser.set_script_timeout(timeout + 5)
+        state = self.browser.execute_async_script(OPEN_CHAT_JS, mobile, int(timeout * 1000))
+        elapsed = time.monotonic() - started
+        if state == "chat":
+            self.current = mobile
+            self.cache[mobile] = (OPENED, time.time())
+            return NavigationResult(OPENED, mobile, elapsed)
+        self.current = None
+        if state == "invalid":
+            self.cache[mobile] = (NOT_ON_WHATSAPP, time.time())
+            return NavigationResult(NOT_ON_WHATSAPP, mobile, elapsed)
+        LOGGER.info(f"Chat of {mobile} did not open within {timeout}s")
+        return NavigationResult(TIMEOUT, mobile, elapsed)
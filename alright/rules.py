@@ -0,0 +1,131 @@
+"""
+Keyword auto-replies and routing for incoming messages.
+
+A Rule matches a message by keywords (whole words, case and accents ignored, so "odeme" matches
+"Ödeme") or by a regular expression, a rule with neither matches everything. A matching rule can
+answer in the chat, hand the message to a route (any callable: a queue's put, a logger, a CRM
+hook) or both. Rules are tried in order and the first matching rule with `stop` ends the search.
+A chat is answered at most once per `cooldown`, so two bots cannot talk to each other forever.
+"""
+
+import re
+import time
+import logging
+import unicodedata
+
+LOGGER = logging.getLogger()
+
+REPLY_COOLDOWN = 3600
+
+
+def normalize(text: str) -> str:
+    """normalize()
+
+    `text` folded for matching: lower case, accents and dots removed (İ, ı, ö, ş ... become i, o, s)
+    """
+    folded = unicodedata.normalize("NFKD", (text or "").casefold())
+    return "".join(ch for ch in folded if not unicodedata.combining(ch)).replace("ı", "i")
+
+
+class Rule(object):
+    def __init__(self, keywords=(), pattern=None, reply=None, route=None, stop=True, name=None):
+        """Rule()
+
+        Args:
+            keywords (list): words or phrases, any of them matches
+            pattern (str): regular expression searched in the normalized text
+            reply: text sent back, formatted with {sender}, {text} and {chat}, or a callable taking
+                the IncomingMessage and returning the text (None to stay silent)
+            route: callable given the IncomingMessage
+            stop (bool): rules after this one are not tried once it matched
+            name (str): shown in the logs
+        """
+        self.keywords = [normalize(keyword) for keyword in keywords]
+        words = "|".join(re.escape(keyword) for keyword in self.keywords)
+        self.words = re.compile(rf"\b(?:{words})\b") if words else None
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.reply = reply
+        self.route = route
+        self.stop = stop
+        self.name = name or (", ".join(self.keywords) if self.keywords else f"{pattern or '*'}")
+
+    def matches(self, message) -> bool:
+        text = normalize(message.text)
+        if self.words is None and self.pattern is None:
+            return True
+        return (self.words is not None and self.words.search(text) is not None) or (
+            self.pattern is not None and self.pattern.search(text) is not None
+        )
+
+    def answer(self, message):
+        if callable(self.reply):
+            return self.reply(message)
+        if self.reply:
+            return self.reply.format(sender=message.sender, text=message.text, chat=message.chat)
+        return None
+
+
+class ReplyRules(object):
+    def __init__(self, whatsapp, rules=(), cooldown=REPLY_COOLDOWN):
+        """ReplyRules()
+
+        Args:
+            whatsapp (WhatsApp): sends the replies
+            rules (list): Rule objects, tried in order
+            cooldown (float): seconds before the same chat is answered again
+        """
+        self.whatsapp = whatsapp
+        self.rules = list(rules)
+        self.cooldown = cooldown
+        self.replied = {}
+
+    def add(self, *args, **kwargs):
+        """add()
+
+        appends a Rule built from the arguments and returns it
+        """
+        rule = Rule(*args, **kwargs)
+        self.rules.append(rule)
+        return rule
+
+    def handle(self, message):
+        """handle()
+
+        applies the rules to an IncomingMessage
+
+        Returns:
+            list: the names of the rules that matched
+        """
+        matched = []
+        for rule in self.rules:
+            if not rule.matches(message):
+                continue
+            matched.append(rule.name)
+            if rule.route is not None:
+                try:
+                    rule.route(message)
+                except Exception:
+                    LOGGER.exception(f"Route of rule {rule.name}")
+            text = rule.answer(message)
+            if text:
+                self.send(message, text, rule)
+            if rule.stop:
+                break
+        return matched
+
+    def send(self, message, text, rule):
+        now = time.monotonic()
+        if now - self.replied.get(message.chat, -self.cooldown) < self.cooldown:
+            LOGGER.info(f"Rule {rule.name}: {message.chat} was answered less than {self.cooldown}s ago")
+            return
+        if self.whatsapp.reply(message, text):
+            self.replied[message.chat] = now
+            LOGGER.info(f"Rule {rule.name}: replied to {message.chat}")
+
+    def run(self, until=None, timeout=None):
+        """run()
+
+        answers the incoming messages as they arrive, until `until()` returns True
+        """
+        for message in self.whatsapp.listen(until=until, timeout=timeout):
+            self.handle(message)
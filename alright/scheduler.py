@@ -0,0 +1,161 @@
+"""
+Per-account pacing for outgoing messages.
+
+Each account gets a token bucket whose refill rate follows an AIMD loop: every healthy send adds
+a little to the rate, every warning signal (an alert, a failed or slow acknowledgement) cuts it
+by a factor and pauses the account for a while. Hourly and daily quotas cap the total on top of
+the bucket. The same scheduler paces `alright.WhatsApp` and the GUI `browserCtrl.Web` workers.
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+LOGGER = logging.getLogger()
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class AccountPace(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.sent = deque()
+
+
+class RateScheduler(object):
+    def __init__(
+        self,
+        rate=1 / 5,
+        min_rate=1 / 60,
+        max_rate=1 / 2,
+        burst=1,
+        increase=1 / 600,
+        decrease=0.5,
+        cooldown=60,
+        slow_ack=15,
+        hourly=None,
+        daily=None,
+        jitter=0.3,
+    ):
+        """RateScheduler()
+
+        Args:
+            rate (float): starting rate in messages per second
+            min_rate, max_rate (float): bounds of the rate the feedback loop can reach
+            burst (int): bucket size, how many messages may leave back to back
+            increase (float): rate added after every healthy send
+            decrease (float): factor applied to the rate on a warning signal
+            cooldown (float): seconds an account rests after a warning signal
+            slow_ack (float): acknowledgement latency, in seconds, counted as a warning
+            hourly, daily (int): optional quotas per account
+            jitter (float): relative random spread applied to every wait
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.slow_ack = slow_ack
+        self.hourly = hourly
+        self.daily = daily
+        self.jitter = jitter
+        self.accounts = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_interval(cls, low, high, **kwargs):
+        """from_interval()
+
+        build a scheduler from the "sleep between low and high seconds" settings of the GUI
+        """
+        low = max(float(low), 1.0)
+        high = max(float(high), low)
+        return cls(
+            rate=2 / (low + high), min_rate=1 / (4 * high), max_rate=1 / low, **kwargs
+        )
+
+    def account(self, name):
+        pace = self.accounts.get(name)
+        if pace is None:
+            pace = self.accounts[name] = AccountPace(self.rate, self.burst)
+        return pace
+
+    def _delay(self, pace, now):
+        """seconds until `pace` may send again, 0 when it may send now"""
+        pace.tokens = min(self.burst, pace.tokens + (now - pace.updated) * pace.rate)
+        pace.updated = now
+        while pace.sent and pace.sent[0] <= now - DAY:
+            pace.sent.popleft()
+        delays = [pace.paused_until - now]
+        if pace.tokens < 1:
+            delays.append((1 - pace.tokens) / pace.rate)
+        for window, quota in ((HOUR, self.hourly), (DAY, self.daily)):
+            if quota is None:
+                continue
+            in_window = [stamp for stamp in pace.sent if stamp > now - window]
+            if len(in_window) >= quota:
+                delays.append(in_window[-quota] + window - now)
+        return max(delays + [0.0])
+
+    def acquire(self, name="default"):
+        """acquire()
+
+        blocks until `name` may send its next message, returns the seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                pace = self.account(name)
+                now = time.monotonic()
+                delay = self._delay(pace, now)
+                if delay <= 0:
+                    pace.tokens -= 1
+                    pace.sent.append(now)
+                    return waited
+            delay *= random.uniform(1, 1 + self.jitter)
+            time.sleep(delay)
+            waited += delay
+
+    def success(self, name="default", latency=None):
+        """success()
+
+        additive increase after a healthy send, a slow acknowledgement counts as a warning
+        """
+        if latency is not None and latency > self.slow_ack:
+            self.warning(name, f"slow acknowledgement ({latency:.1f}s)")
+            return
+        with self.lock:
+            pace = self.account(name)
+            pace.rate = min(self.max_rate, pace.rate + self.increase)
+
+    def warning(self, name="default", reason=""):
+        """warning()
+
+        multiplicative decrease and a cooldown when WhatsApp shows signs of throttling
+        """
+        with self.lock:
+            pace = self.account(name)
+            pace.rate = max(self.min_rate, pace.rate * self.decrease)
+            pace.tokens = min(pace.tokens, 0)
+            pace.paused_until = time.monotonic() + self.cooldown
+        LOGGER.warning(
+            f"Slowing down {name} to one message every {1 / pace.rate:.0f}s {reason}"
+        )
+
+    def stats(self, name="default"):
+        with self.lock:
+            pace = self.account(name)
+            now = time.monotonic()
+            return {
+                "rate": pace.rate,
+                "last_hour": sum(1 for stamp in pace.sent if stamp > now - HOUR),
+                "last_day": sum(1 for stamp in pace.sent if stamp > now - DAY),
+            }
@@ -1,12 +1,15 @@
-from PyQt5.QtCore import pyqtSignal, QThread
+from PyQt5.QtCore import pyqtSignal, QThread, QObject
 from selenium import webdriver
 import json
 import os
+import hashlib
+import struct
+import zlib
 import platform
 import time
 import random
-import pyperclip
-import subprocess
+import threading
+from itertools import islice
 from selenium.common.exceptions import WebDriverException
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
@@ -17,15 +20,196 @@ from selenium.webdriver.chrome.service import Service
 from subprocess import CREATE_NO_WINDOW
 import chromedriver_autoinstaller
 from appLog import log
+from alright.scheduler import RateScheduler
+from alright.compose import set_text
+from alright.navigator import STATE_JS, WAIT_STATE_JS, OPEN_CHAT_JS
+from alright.acks import AckTracker, FAILED as ACK_FAILED, UNCONFIRMED as ACK_UNCONFIRMED
+from messageTemplate import compile_template
+from campaignQueue import Job, DONE, FAILED
+from resultWriter import Result
 
 
-try:
-    log.info("browserCTRL start to dl")
-    chromedriver_autoinstaller.install()
-except:
-    log.exception("")
 CHROME = 1
 FIREFOX = 2
+STATE_TIMEOUT = 20
+BATCH_SIZE = 50
+# marks of the numbers list for each step: analysed, message sent, image sent
+STEP_STATUS = {'A': '✓', 'M': '✓✓', 'I': '✓✓✓'}
+
+# Check a whole chunk of numbers in one WebDriver call and answer with a JSON array of verdicts.
+CHECK_NUMBERS_JS = STATE_JS + """
+var numbers = arguments[0], timeout = arguments[1], done = arguments[arguments.length - 1];
+var verdicts = [];
+function next(index) {
+    if (index >= numbers.length) {
+        done(JSON.stringify(verdicts));
+        return;
+    }
+    window.waState.open(numbers[index], timeout, function (state) {
+        verdicts.push({num: numbers[index], state: state});
+        next(index + 1);
+    });
+}
+next(0);
+"""
+
+
+class SessionManager(object):
+    """
+    Keep one logged-in driver per account alive between operations, so Analyze, Send Text and
+    Send Image reuse the same browser instead of starting Chrome and restoring the session again.
+    """
+
+    def __init__(self):
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def checkout(self, account):
+        """
+        take the idle driver of `account` for exclusive use, None when there is no live one
+        """
+        with self.lock:
+            driver = self.idle.pop(account, None)
+        if driver is None:
+            return None
+        try:
+            driver.window_handles
+            return driver
+        except WebDriverException:
+            log.debug(f"session {account} was closed")
+            return None
+
+    def release(self, account, driver):
+        with self.lock:
+            previous = self.idle.get(account)
+            self.idle[account] = driver
+        if previous is not None and previous is not driver:
+            self.close(previous)
+
+    def close(self, driver):
+        try:
+            driver.quit()
+        except:
+            pass
+
+    def closeAll(self):
+        with self.lock:
+            drivers = list(self.idle.values())
+            self.idle.clear()
+        for driver in drivers:
+            self.close(driver)
+
+
+sessions = SessionManager()
+
+
+# Session snapshots: magic, format version, body length and sha256 of the body, then the zlib-compressed compact
+# JSON of the IndexedDB `user` store. Files written before this format (plain JSON) are still readable.
+SNAPSHOT_MAGIC = b'WASNAP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('>6sBI32s')
+SNAPSHOT_TEMP = '.tmp'
+
+GET_SESSION_JS = """
+var done = arguments[arguments.length - 1];
+var request = indexedDB.open('wawc');
+request.onerror = function () { done(null); };
+request.onsuccess = function (event) {
+    var db = event.target.result;
+    var getAll = db.transaction('user').objectStore('user').getAll();
+    getAll.onsuccess = function () { db.close(); done(getAll.result); };
+    getAll.onerror = function () { db.close(); done(null); };
+};
+"""
+
+# Replace the whole `user` store in a single transaction and answer when it is committed ('' on success).
+RESTORE_SESSION_JS = """
+var records = arguments[0], done = arguments[arguments.length - 1];
+var request = indexedDB.open('wawc');
+request.onerror = function () { done('cannot open wawc: ' + request.error); };
+request.onsuccess = function (event) {
+    var db = event.target.result;
+    var transaction = db.transaction('user', 'readwrite');
+    var store = transaction.objectStore('user');
+    store.clear();
+    for (var i = 0; i < records.length; i++) {
+        store.put(records[i]);
+    }
+    transaction.oncomplete = function () { db.close(); done(''); };
+    transaction.onerror = transaction.onabort = function () {
+        db.close();
+        done('restore failed: ' + transaction.error);
+    };
+};
+"""
+
+
+_driverInstalled = False
+
+
+def installDriver():
+    """
+    download the chromedriver of the installed Chrome, once, when the first browser is set up;
+    not at import time, the pool processes of the list importer re-import the modules of main
+    """
+    global _driverInstalled
+    if _driverInstalled:
+        return
+    _driverInstalled = True
+    try:
+        log.info("browserCTRL start to dl")
+        chromedriver_autoinstaller.install()
+    except:
+        log.exception("")
+
+
+def writeSnapshot(records, file_path):
+    body = zlib.compress(json.dumps(records, separators=(',', ':')).encode('utf8'), 6)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(body), hashlib.sha256(body).digest())
+    # written next to the cache directory, not in it: a file left by a crash is never listed as an account
+    folder, name = os.path.split(os.path.abspath(file_path))
+    temp_path = os.path.join(os.path.dirname(folder), f"{name}{SNAPSHOT_TEMP}")
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(header)
+            file.write(body)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def cachedAccounts():
+    """
+    the accounts with a saved session in temp/cache/, without the snapshots left half written
+    """
+    if not os.path.exists('./temp/cache'):
+        return []
+    return sorted(name for name in os.listdir('temp/cache/') if not name.endswith(SNAPSHOT_TEMP))
+
+
+def readSnapshot(file_path):
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        return json.loads(data.decode('utf8'))
+    magic, version, length, digest = SNAPSHOT_HEADER.unpack_from(data)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f'Unsupported session snapshot version {version}.')
+    body = data[SNAPSHOT_HEADER.size:]
+    if len(body) != length or hashlib.sha256(body).digest() != digest:
+        raise ValueError('The session snapshot is damaged (checksum mismatch).')
+    return json.loads(zlib.decompress(body).decode('utf8'))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 class Web(QThread):
@@ -40,9 +224,26 @@ class Web(QThread):
     EndWork = pyqtSignal(str)
 
     def __init__(self, parent=None, counter_start=0, step='A', numList=None, sleepMin=3, sleepMax=6, text='', path='',
-                 Remember=False, browser=1):
+                 Remember=False, browser=1, account=None, batchSize=BATCH_SIZE, queue=None, scheduler=None,
+                 writer=None, cache=None):
         super(Web, self).__init__(parent)
+        self.queue = queue
+        # RegistrationCache consulted before opening a number in the browser
+        self.cache = cache
+        # ResultWriter persisting the outcomes off the GUI thread
+        self.writer = writer
+        # job id and start time of the numbers in flight
+        self.jobs = {}
+        # queue payloads of the numbers in flight, used to personalize the text
+        self.contacts = {}
+        # AckTracker of the sending steps, see startAcks
+        self.acks = None
+        if scheduler is None:
+            scheduler = RateScheduler.from_interval(sleepMin, sleepMax)
+        self.scheduler = scheduler
+        self.batchSize = batchSize
         self.counter_start = counter_start
+        self.account = account
         self.Numbers = numList
         self.step = step
         self.sleepMin = sleepMin
@@ -65,6 +266,7 @@ class Web(QThread):
         self.__browser_options = None
         self.__browser_user_dir = None
         self.__driver = None
+        installDriver()
         self.service = Service()
         self.service.creation_flags = CREATE_NO_WINDOW
         if browser == 1:
@@ -101,284 +303,411 @@ class Web(QThread):
         except:
             pass
 
+    def openSession(self):
+        """
+        take the live session of the account from `sessions` when there is one, otherwise restore the saved
+        session of `self.account` (first one in temp/cache/ if not set), or open a fresh login page
+        """
+        if self.remember and self.account is None:
+            cacheList = cachedAccounts()
+            if len(cacheList) != 0:
+                self.account = cacheList[0]
+        driver = sessions.checkout(self.accountName())
+        if driver is not None:
+            self.__driver = driver
+            log.debug(f"reuse session {self.accountName()}")
+            return
+        if self.remember and self.account is not None:
+            log.debug("remember")
+            self.access_by_file(f"./temp/cache/{self.account}")
+            log.debug('recover')
+            return
+        log.debug("! remember !")
+        self.driverBk()
+        self.__driver.get(self.__URL)
+
+    def waitLogin(self):
+        """
+        wait for the chat list of the opened session, a QR code login may take a while
+        """
+        while self.isRunning:
+            try:
+                self.waitState(['login'], timeout=60)
+                log.debug("login")
+                self.LogBox.emit("Login Success")
+                return True
+            except TimeoutException:
+                log.debug("Login Check")
+            except WebDriverException:
+                # the page is reloading after a session restore
+                time.sleep(1)
+        return False
+
+    def release(self):
+        """
+        hand the logged-in driver back to `sessions` for the next operation instead of closing it
+        """
+        self.isRunning = False
+        driver = self.__driver
+        self.__driver = None
+        if driver is not None:
+            sessions.release(self.accountName(), driver)
+
+    def numbers(self):
+        """
+        numbers to work on, streamed from the campaign queue when there is one
+        """
+        if self.queue is None:
+            return (self.track(Job(None, num, None, 0)) for num in self.Numbers)
+        return (self.track(job) for job in self.queue.stream())
+
+    def track(self, job):
+        """
+        note the job id, start time and payload of a number about to be worked on
+        """
+        self.jobs[f"{job.key}"] = (job.id, time.time())
+        if isinstance(job.payload, dict):
+            self.contacts[f"{job.key}"] = job.payload
+        return job.key
+
+    def messageFor(self, num):
+        """
+        the text or caption for `num`, with `{num}` and the fields of its queue payload filled in
+        """
+        template = compile_template(self.text)
+        if not template.personalized:
+            return self.text
+        contact = dict(self.contacts.pop(f"{num}", None) or {}, num=num)
+        return template.render(contact)
+
+    def settle(self, num, result, failed=False, cached=False):
+        """
+        record the outcome of `num` so a rerun does not repeat it: through the result writer when
+        there is one, which also marks the numbers list, otherwise straight in the campaign queue;
+        `cached` outcomes came from the registration cache
+        """
+        job, started = self.jobs.pop(f"{num}", (None, None))
+        if self.writer is not None:
+            status, res = '', ''
+            if not failed:
+                status = STEP_STATUS.get(self.step, '')
+                res = '☒' if result == 'invalid' else '☑'
+            self.writer.put(Result(job, num, self.step, status, res, FAILED if failed else DONE, result, started,
+                                   time.time(), cached))
+            # the writer settles the queue jobs by id, a queue without ids (a RangeQueue) is settled here
+            if job is not None or self.queue is None:
+                return
+        if self.queue is None:
+            return
+        try:
+            if failed:
+                self.queue.failed(num, result)
+            else:
+                self.queue.done(num, result)
+        except:
+            log.exception("queue settle")
+
+    def knownInvalid(self, num):
+        """
+        True when the cache says `num` is not on WhatsApp, so it is not opened again
+        """
+        return self.cache is not None and self.cache.lookup(num) is False
+
+    def recordVerdicts(self, verdicts):
+        """
+        keep the 'chat' / 'invalid' verdicts of the browser in the cache, with the account that checked them
+        """
+        if self.cache is None:
+            return
+        try:
+            self.cache.record_many(((verdict['num'], verdict['state'] == 'chat') for verdict in verdicts
+                                    if verdict['state'] in ('chat', 'invalid')), account=self.accountName())
+        except:
+            log.exception("registration cache")
+
+    def startAcks(self):
+        """
+        watch the ticks of the messages sent in this session, so the sender does not wait for them
+        """
+        self.sent = 0
+        self.acks = AckTracker(self.__driver, on_ack=self.acknowledged)
+
+    def acknowledged(self, ack):
+        """
+        settle a sent number on its first tick, or as an error when it failed or timed out; one whose
+        chat was left before its first tick showed is sent, unconfirmed, and not sent again
+        """
+        if not ack.resolved:
+            return
+        num = ack.token
+        if ack.state == ACK_UNCONFIRMED:
+            log.debug(f"no tick seen for {num}, its chat was left")
+            self.sent += 1
+            self.lcdNumber_wa.emit(self.sent)
+            self.wa.emit(f"{num}")
+            self.settle(num, 'unconfirmed')
+            self.LogBox.emit(f"Number::{num} => Sent (unconfirmed).")
+            return
+        if ack.state == ACK_FAILED:
+            log.debug(f"no tick for {num}")
+            self.settle(num, 'error', failed=True)
+            self.scheduler.warning(self.accountName(), f"(no tick for {num})")
+            self.LogBox.emit(f"Error To Number = {num} ")
+            return
+        self.scheduler.success(self.accountName(), ack.elapsed)
+        self.sent += 1
+        self.lcdNumber_wa.emit(self.sent)
+        self.wa.emit(f"{num}")
+        self.settle(num, 'sent')
+        self.LogBox.emit(f"Number::{num} => Sent.")
+
+    def flushAcks(self):
+        """
+        wait for the messages still without a tick before the run ends
+        """
+        if self.acks is None:
+            return
+        try:
+            self.acks.flush()
+        except:
+            log.exception("acks flush")
+
+    def accountName(self):
+        return self.account if self.account is not None else 'default'
+
     def is_logged_in(self):
         status = self.__driver.execute_script(
             "if (document.querySelector('*[data-icon=new-chat-outline]') !== null) { return true } else { return false }"
         )
         return status
 
-    def copyToClipboard(self, text):
-        try:  # Copy Text To clipboard
-            try:
-                subprocess.run("pbcopy", universal_newlines=True, input=text)
-            except Exception:
-                pyperclip.copy(text)
-        except Exception:
-            subprocess.run("pbcopy", universal_newlines=True, input=text)
-        finally:
-            pyperclip.copy(text)
+    def waitState(self, states, timeout=STATE_TIMEOUT):
+        """
+        wait until the page reaches one of `states` ('login', 'chat', 'invalid', 'typed', 'sent', 'attach',
+        'preview') and return it
+        """
+        self.__driver.set_script_timeout(timeout + 5)
+        state = self.__driver.execute_async_script(WAIT_STATE_JS, states, timeout * 1000)
+        if state == '':
+            raise TimeoutException(f"page did not reach {states}")
+        return state
+
+    def openChat(self, num, timeout=STATE_TIMEOUT):
+        """
+        open the chat of `num` inside the running app, return 'chat' or 'invalid'
+        """
+        if self.acks is not None:
+            # the ticks of the messages of the chat being left are only seen while it is open
+            self.acks.settle()
+        self.__driver.set_script_timeout(timeout + 5)
+        state = self.__driver.execute_async_script(OPEN_CHAT_JS, f"{num}", timeout * 1000)
+        if state == '':
+            raise TimeoutException(f"chat of {num} did not open")
+        return state
+
+    def checkNumbers(self, numbers, timeout=STATE_TIMEOUT):
+        """
+        resolve a chunk of numbers inside the page in a single call,
+        return a list of {'num': ..., 'state': 'chat' | 'invalid' | ''}
+        """
+        self.__driver.set_script_timeout(len(numbers) * (timeout + 1) + 5)
+        verdicts = self.__driver.execute_async_script(CHECK_NUMBERS_JS, [f"{num}" for num in numbers],
+                                                      timeout * 1000)
+        return json.loads(verdicts)
+
+    def typeText(self, box, text):
+        """
+        put the whole text into `box` in one in-page call, without the system clipboard
+        """
+        if not set_text(self.__driver, box, text):
+            raise WebDriverException("text box did not accept the message")
 
     def ANALYZ(self):
         try:
             log.debug("analyz")
-            if self.remember:
-                log.debug("remember")
-                cacheList = os.listdir('temp/cache/')
-                if len(cacheList) != 0:
-                    self.access_by_file(f"./temp/cache/{cacheList[0]}")
-                    log.debug('recover')
-                else:
-                    self.driverBk()
-                    self.__driver.get(self.__URL)
-            else:
-                log.debug("! remember !")
-                self.driverBk()
-                self.__driver.get(self.__URL)
+            self.openSession()
 
-            while True:
-                log.debug("Login Check")
-                time.sleep(1)
-                if self.is_logged_in():
-                    log.debug("login")
-                    logtxt = "Login Success"
-                    self.LogBox.emit(logtxt)
-                    break
+            self.waitLogin()
             log.debug("thread:", self.counter_start)
             i = 0
             f = 0
             nf = 0
-            for num in self.Numbers:
-                logtxt = ""
-                try:
-                    time.sleep(3)
-                    if i == 0:
-                        execu = f"""
-                                var a = document.createElement('a');
-                                var link = document.createTextNode("hiding");
-                                a.appendChild(link);
-                                a.href = "https://wa.me/{num}";
-                                document.head.appendChild(a);
-                                """
-                        try:
-                            self.__driver.execute_script(execu)
-                        except:
-                            log.exception("error")
-                    else:
-                        element = self.__driver.find_element(By.XPATH, '/html/head/a')
-                        self.__driver.execute_script(f"arguments[0].setAttribute('href','https://wa.me/{num}');",
-                                                     element)
-                    user = self.__driver.find_element(By.XPATH, '/html/head/a')
-                    self.__driver.execute_script("arguments[0].click();", user)
-                    time.sleep(2)
-                    sourceWeb = self.__driver.page_source
-                    if "Phone number shared via url is invalid" in sourceWeb:
+            for chunk in chunked(self.numbers(), self.batchSize):
+                if not self.isRunning:
+                    break
+                # numbers checked within the cache TTL are answered without the browser
+                known = self.cache.lookup_many(chunk) if self.cache is not None else {}
+                verdicts = [{'num': f"{num}", 'state': 'chat' if known[num] else 'invalid', 'cached': True}
+                            for num in chunk if num in known]
+                todo = [num for num in chunk if num not in known]
+                if todo:
+                    try:
+                        checked = self.checkNumbers(todo)
+                        self.recordVerdicts(checked)
+                    except:
+                        log.exception("check numbers")
+                        checked = [{'num': f"{num}", 'state': ''} for num in todo]
+                    verdicts.extend(checked)
+                for verdict in verdicts:
+                    num = verdict['num']
+                    if verdict['state'] == 'invalid':
                         log.debug(f"Not Found {num}")
                         nf += 1
                         self.lcdNumber_nwa.emit(nf)
                         logtxt = f"Number::{num} => Not Find!"
                         self.nwa.emit(f"{num}")
-                    else:
+                        self.settle(num, 'invalid', cached=verdict.get('cached', False))
+                    elif verdict['state'] == 'chat':
                         log.debug("find", num)
                         f += 1
                         self.lcdNumber_wa.emit(f)
                         logtxt = f"Number::{num} => Find."
                         self.wa.emit(f"{num}")
-                except:
-                    logtxt = f"Number::{num} Error !"
-                    continue
-                finally:
+                        self.settle(num, 'chat', cached=verdict.get('cached', False))
+                    elif self.isRunning:
+                        logtxt = f"Number::{num} Error !"
+                        self.settle(num, 'error', failed=True)
+                    else:
+                        logtxt = f"Number::{num} Error !"
                     i += 1
                     log.debug(i)
                     self.lcdNumber_reviewed.emit(i)
-                    self.LogBox.emit(logtxt)
-            time.sleep(2)
+                    self.LogBox.emit(f"{logtxt} (cache)" if verdict.get('cached') else logtxt)
             log.debug("end")
-            self.EndWork.emit("-- analysis completed --")
-            self.isRunning = False
-            self.__driver.quit()
         except:
             log.exception("Analyz ->:")
+        finally:
+            # the pool waits for EndWork of every worker, whatever ended the run
+            self.EndWork.emit("-- analysis completed --")
+            self.release()
 
     def SendTEXT(self):
         log.debug("sent text")
-        if self.remember:
-            cacheList = os.listdir('temp/cache/')
-            if len(cacheList) != 0:
-                self.access_by_file(f"./temp/cache/{cacheList[0]}")
-                log.debug('recover')
-            else:
-                self.driverBk()
-                self.__driver.get(self.__URL)
-        else:
-            self.driverBk()
-            self.__driver.get(self.__URL)
-        time.sleep(2)
-        while True:
-            time.sleep(1)
-            if self.is_logged_in():
-                log.debug("login")
-                logtxt = "Login Success"
-                self.LogBox.emit(logtxt)
-                break
-        i = 0
-        f = 0
-        nf = 0
-        from random import randint
-        log.debug(self.Numbers)
-        for num in self.Numbers:
-            logtxt = ""
-            try:
-                time.sleep(3)
-                if i == 0:
-                    execu = f"""
-                            var a = document.createElement('a');
-                            var link = document.createTextNode("hiding");
-                            a.appendChild(link);
-                            a.href = "https://wa.me/{num}";
-                            document.head.appendChild(a);
-                            """
-                    try:
-                        self.__driver.execute_script(execu)
-                    except:
-                        log.exception("error")
-                        logtxt = "ERROR !"
-                        break
-                else:
-                    element = self.__driver.find_element(By.XPATH, '/html/head/a')
-                    self.__driver.execute_script(
-                        f"arguments[0].setAttribute('href','https://wa.me/{num}');", element)
-                user = self.__driver.find_element(By.XPATH, '/html/head/a')
-                self.__driver.execute_script("arguments[0].click();", user)
-                time.sleep(2)
-                sourceWeb = self.__driver.page_source
-                if "Phone number shared via url is invalid" in sourceWeb:
-                    log.debug(f"Not Found {num}")
-                    nf += 1
-                    self.lcdNumber_nwa.emit(nf)
-                    logtxt = f"Number::{num} => No Send!"
-                    self.nwa.emit(f"{num}")
-                else:
-                    log.debug("find", num)
-                    time.sleep(2)
-                    textBox = self.__driver.find_element(By.XPATH, '//div[@title="Type a message"]')
-                    time.sleep(1)
-                    self.copyToClipboard(self.text)
-                    textBox.send_keys(Keys.CONTROL, 'v')
-                    time.sleep(1)
-                    try:
-                        textBox.send_keys(Keys.RETURN)
-                    except Exception:
-                        textBox.send_keys(Keys.ENTER)
-                    time.sleep(1)
-                    f += 1
-                    self.lcdNumber_wa.emit(f)
-                    logtxt = f"Number::{num} => Sent."
-                    self.wa.emit(f"{num}")
-                time.sleep(randint(self.sleepMin, self.sleepMax))
-            except:
-                logtxt = f"Error To Number = {num} "
-                continue
-            finally:
-                i += 1
-                self.lcdNumber_reviewed.emit(i)
-                self.LogBox.emit(logtxt)
-        log.debug("end msg")
-        self.EndWork.emit("-- Send Message completed --")
-        self.stop()
-        self.isRunning = False
+        try:
+            self.openSession()
+            self.waitLogin()
+            self.startAcks()
+            i = 0
+            nf = 0
+            for num in self.numbers():
+                if not self.isRunning:
+                    break
+                logtxt = ""
+                try:
+                    if self.knownInvalid(num):
+                        state = 'invalid'
+                    else:
+                        self.scheduler.acquire(self.accountName())
+                        state = self.openChat(num)
+                        self.recordVerdicts([{'num': num, 'state': state}])
+                    if state == 'invalid':
+                        log.debug(f"Not Found {num}")
+                        nf += 1
+                        self.lcdNumber_nwa.emit(nf)
+                        logtxt = f"Number::{num} => No Send!"
+                        self.nwa.emit(f"{num}")
+                        self.settle(num, 'invalid')
+                    else:
+                        log.debug("find", num)
+                        textBox = self.__driver.find_element(By.CSS_SELECTOR, '#main footer div[contenteditable="true"]')
+                        self.typeText(textBox, self.messageFor(num))
+                        key = self.acks.expect(num)
+                        try:
+                            try:
+                                textBox.send_keys(Keys.RETURN)
+                            except Exception:
+                                textBox.send_keys(Keys.ENTER)
+                        except Exception:
+                            # not sent, settled once below and not again by its acknowledgement
+                            self.acks.discard(key)
+                            raise
+                        logtxt = f"Number::{num} => Sending..."
+                        self.acks.poll()
+                except:
+                    logtxt = f"Error To Number = {num} "
+                    if self.isRunning:
+                        self.settle(num, 'error', failed=True)
+                        self.scheduler.warning(self.accountName(), f"(error on {num})")
+                    continue
+                finally:
+                    i += 1
+                    self.lcdNumber_reviewed.emit(i)
+                    self.LogBox.emit(logtxt)
+            log.debug("end msg")
+        except:
+            log.exception("Send Message ->:")
+        finally:
+            self.flushAcks()
+            self.EndWork.emit("-- Send Message completed --")
+            self.release()
 
     def SendIMG(self):
         log.debug("sent img")
-        if self.remember:
-            cacheList = os.listdir('temp/cache/')
-            if len(cacheList) != 0:
-                self.access_by_file(f"./temp/cache/{cacheList[0]}")
-                log.debug('recover')
-            else:
-                self.driverBk()
-                self.__driver.get(self.__URL)
-        else:
-            self.driverBk()
-            self.__driver.get(self.__URL)
-        time.sleep(2)
-        while True:
-            time.sleep(1)
-            if self.is_logged_in():
-                log.debug("login")
-                logtxt = "Login Success"
-                self.LogBox.emit(logtxt)
-                break
-        i = 0
-        f = 0
-        nf = 0
-        from random import randint
-        log.debug(self.Numbers)
-        for num in self.Numbers:
-            logtxt = ""
-            try:
-                time.sleep(3)
-                if i == 0:
-                    execu = f"""
-                            var a = document.createElement('a');
-                            var link = document.createTextNode("hiding");
-                            a.appendChild(link);
-                            a.href = "https://wa.me/{num}";
-                            document.head.appendChild(a);
-                            """
-                    try:
-                        self.__driver.execute_script(execu)
-                    except:
-                        log.exception("error img")
-                        logtxt = "ERROR !"
-                        break
-                else:
-                    element = self.__driver.find_element(By.XPATH, '/html/head/a')
-                    self.__driver.execute_script(f"arguments[0].setAttribute('href','https://wa.me/{num}');", element)
-                user = self.__driver.find_element(By.XPATH, '/html/head/a')
-                self.__driver.execute_script("arguments[0].click();", user)
-                time.sleep(2)
-                sourceWeb = self.__driver.page_source
-                if "Phone number shared via url is invalid" in sourceWeb:
-                    log.debug(f"Not Found {num}")
-                    nf += 1
-                    self.lcdNumber_nwa.emit(nf)
-                    logtxt = f"Number::{num} => No Send"
-                    self.nwa.emit(f"{num}")
-                else:
-                    log.debug("find", num)
-                    time.sleep(2)
-                    self.__driver.find_element(By.XPATH, '//span[@data-icon="attach-menu-plus"]').click()
-                    time.sleep(2)
-                    attch = self.__driver.find_element(By.XPATH,
-                                                       '//input[@accept="image/*,video/mp4,video/3gpp,video/quicktime"]')
-                    attch.send_keys(self.path)
-                    time.sleep(2)
-                    caption = self.__driver.find_element(
-                        By.XPATH, '//div[@role="textbox"]')
-                    if self.text != '' or self.text != ' ':
-                        self.copyToClipboard(self.text)
-                        caption.send_keys(Keys.CONTROL, 'v')
-                        time.sleep(1)
-                    try:
-                        caption.send_keys(Keys.RETURN)
-                    except Exception:
-                        caption.send_keys(Keys.ENTER)
-                    f += 1
-                    self.lcdNumber_wa.emit(f)
-                    logtxt = f"Number::{num} => Sent"
-                    self.wa.emit(f"{num}")
-                time.sleep(randint(self.sleepMin, self.sleepMax))
-            except:
-                logtxt = f"Error To Number = {num} "
-                log.exception("Error sendIMG")
-                continue
-            finally:
-                i += 1
-                self.lcdNumber_reviewed.emit(i)
-                self.LogBox.emit(logtxt)
-        self.EndWork.emit("-- Send Image completed --")
-        self.stop()
-        self.isRunning = False
+        try:
+            self.openSession()
+            self.waitLogin()
+            self.startAcks()
+            i = 0
+            nf = 0
+            for num in self.numbers():
+                if not self.isRunning:
+                    break
+                logtxt = ""
+                try:
+                    if self.knownInvalid(num):
+                        state = 'invalid'
+                    else:
+                        self.scheduler.acquire(self.accountName())
+                        state = self.openChat(num)
+                        self.recordVerdicts([{'num': num, 'state': state}])
+                    if state == 'invalid':
+                        log.debug(f"Not Found {num}")
+                        nf += 1
+                        self.lcdNumber_nwa.emit(nf)
+                        logtxt = f"Number::{num} => No Send"
+                        self.nwa.emit(f"{num}")
+                        self.settle(num, 'invalid')
+                    else:
+                        log.debug("find", num)
+                        self.__driver.find_element(By.XPATH, '//span[@data-icon="attach-menu-plus"]').click()
+                        self.waitState(['attach'])
+                        attch = self.__driver.find_element(By.XPATH,
+                                                           '//input[@accept="image/*,video/mp4,video/3gpp,video/quicktime"]')
+                        attch.send_keys(self.path)
+                        self.waitState(['preview'])
+                        caption = self.__driver.find_element(
+                            By.XPATH, '//div[@role="textbox"]')
+                        if self.text != '' or self.text != ' ':
+                            self.typeText(caption, self.messageFor(num))
+                        key = self.acks.expect(num)
+                        try:
+                            try:
+                                caption.send_keys(Keys.RETURN)
+                            except Exception:
+                                caption.send_keys(Keys.ENTER)
+                        except Exception:
+                            # not sent, settled once below and not again by its acknowledgement
+                            self.acks.discard(key)
+                            raise
+                        logtxt = f"Number::{num} => Sending..."
+                        self.acks.poll()
+                except:
+                    logtxt = f"Error To Number = {num} "
+                    if self.isRunning:
+                        self.settle(num, 'error', failed=True)
+                        self.scheduler.warning(self.accountName(), f"(error on {num})")
+                    log.exception("Error sendIMG")
+                    continue
+                finally:
+                    i += 1
+                    self.lcdNumber_reviewed.emit(i)
+                    self.LogBox.emit(logtxt)
+        except:
+            log.exception("Send Image ->:")
+        finally:
+            self.flushAcks()
+            self.EndWork.emit("-- Send Image completed --")
+            self.release()
 
     def addAcc(self):
         try:
@@ -391,10 +720,11 @@ class Web(QThread):
                                   f"./temp/cache/{self.path}")
                 log.debug('File saved.')
             log.debug("thread:", self.counter_start)
-            self.EndWork.emit("-- Add Account completed --")
-            self.isRunning = False
         except:
             log.exception("Add Account ->:")
+        finally:
+            self.EndWork.emit("-- Add Account completed --")
+            self.isRunning = False
 
     def run(self):
         while self.isRunning == True:
@@ -410,8 +740,11 @@ class Web(QThread):
     def stop(self):
         self.isRunning = False
         log.debug('stopping thread...')
+        # quitting is the only way to break a running WebDriver call, the session is lost with it
+        driver = self.__driver
+        self.__driver = None
         try:
-            self.__driver.quit()
+            driver.quit()
         except:
             pass
         # self.terminate()
@@ -458,33 +791,10 @@ class Web(QThread):
                         self.__browser_profile_list.append(profile_dir)
 
     def __get_indexed_db(self):
-        self.__driver.execute_script('window.waScript = {};'
-                                     'window.waScript.waSession = undefined;'
-                                     'function getAllObjects() {'
-                                     'window.waScript.dbName = "wawc";'
-                                     'window.waScript.osName = "user";'
-                                     'window.waScript.db = undefined;'
-                                     'window.waScript.transaction = undefined;'
-                                     'window.waScript.objectStore = undefined;'
-                                     'window.waScript.getAllRequest = undefined;'
-                                     'window.waScript.request = indexedDB.open(window.waScript.dbName);'
-                                     'window.waScript.request.onsuccess = function(event) {'
-                                     'window.waScript.db = event.target.result;'
-                                     'window.waScript.transaction = window.waScript.db.transaction('
-                                     'window.waScript.osName);'
-                                     'window.waScript.objectStore = window.waScript.transaction.objectStore('
-                                     'window.waScript.osName);'
-                                     'window.waScript.getAllRequest = window.waScript.objectStore.getAll();'
-                                     'window.waScript.getAllRequest.onsuccess = function(getAllEvent) {'
-                                     'window.waScript.waSession = getAllEvent.target.result;'
-                                     '};'
-                                     '};'
-                                     '}'
-                                     'getAllObjects();')
-        while not self.__driver.execute_script('return window.waScript.waSession != undefined;'):
-            time.sleep(1)
-        wa_session_list = self.__driver.execute_script(
-            'return window.waScript.waSession;')
+        self.__driver.set_script_timeout(60)
+        wa_session_list = self.__driver.execute_async_script(GET_SESSION_JS)
+        if wa_session_list is None:
+            raise WebDriverException('Could not read the WhatsApp session from IndexedDB.')
         return wa_session_list
 
     def __get_profile_storage(self, profile_name=None):
@@ -614,43 +924,10 @@ class Web(QThread):
                 'This is not a valid profile list. Make sure you only pass one session to this method.')
 
         self.__start_visible_session(wait_for_login=False)
-        self.__driver.execute_script('window.waScript = {};'
-                                     'window.waScript.insertDone = 0;'
-                                     'window.waScript.jsonObj = undefined;'
-                                     'window.waScript.setAllObjects = function (_jsonObj) {'
-                                     'window.waScript.jsonObj = _jsonObj;'
-                                     'window.waScript.dbName = "wawc";'
-                                     'window.waScript.osName = "user";'
-                                     'window.waScript.db;'
-                                     'window.waScript.transaction;'
-                                     'window.waScript.objectStore;'
-                                     'window.waScript.clearRequest;'
-                                     'window.waScript.addRequest;'
-                                     'window.waScript.request = indexedDB.open(window.waScript.dbName);'
-                                     'window.waScript.request.onsuccess = function(event) {'
-                                     'window.waScript.db = event.target.result;'
-                                     'window.waScript.transaction = window.waScript.db.transaction('
-                                     'window.waScript.osName, "readwrite");'
-                                     'window.waScript.objectStore = window.waScript.transaction.objectStore('
-                                     'window.waScript.osName);'
-                                     'window.waScript.clearRequest = window.waScript.objectStore.clear();'
-                                     'window.waScript.clearRequest.onsuccess = function(clearEvent) {'
-                                     'for (var i=0; i<window.waScript.jsonObj.length; i++) {'
-                                     'window.waScript.addRequest = window.waScript.objectStore.add('
-                                     'window.waScript.jsonObj[i]);'
-                                     'window.waScript.addRequest.onsuccess = function(addEvent) {'
-                                     'window.waScript.insertDone++;'
-                                     '};'
-                                     '}'
-                                     '};'
-                                     '};'
-                                     '}')
-        self.__driver.execute_script(
-            'window.waScript.setAllObjects(arguments[0]);', wa_profile_list)
-
-        while not self.__driver.execute_script(
-                'return (window.waScript.insertDone == window.waScript.jsonObj.length);'):
-            time.sleep(1)
+        self.__driver.set_script_timeout(60)
+        error = self.__driver.execute_async_script(RESTORE_SESSION_JS, wa_profile_list)
+        if error:
+            raise WebDriverException(error)
 
         self.__driver.refresh()
 
@@ -665,8 +942,7 @@ class Web(QThread):
         profile_file = os.path.normpath(profile_file)
 
         if os.path.isfile(profile_file):
-            with open(profile_file, 'r') as file:
-                wa_profile_list = json.load(file)
+            wa_profile_list = readSnapshot(profile_file)
 
             verified_wa_profile_list = False
             for object_store_obj in wa_profile_list:
@@ -692,8 +968,7 @@ class Web(QThread):
                     verified_wa_profile_list = True
                     break
         if verified_wa_profile_list:
-            with open(file_path, 'w') as file:
-                json.dump(wa_profile_list, file, indent=4)
+            writeSnapshot(wa_profile_list, file_path)
         else:
             saved_profiles = 0
             for profile_name in wa_profile_list.keys():
@@ -715,3 +990,78 @@ class Web(QThread):
             else:
                 raise ValueError(
                     'Could not find any profiles in the list. Make sure to specified file path is correct.')
+
+
+class WebPool(QObject):
+    """
+    Run one `Web` worker per saved account of temp/cache/ and merge their signals,
+    so the GUI can treat the pool exactly like a single `Web` thread.
+    Workers share the campaign queue when one is given.
+    """
+    lcdNumber_reviewed = pyqtSignal(int)
+    lcdNumber_nwa = pyqtSignal(int)
+    lcdNumber_wa = pyqtSignal(int)
+    LogBox = pyqtSignal(str)
+    wa = pyqtSignal(str)
+    nwa = pyqtSignal(str)
+    EndWork = pyqtSignal(str)
+
+    def __init__(self, parent=None, step='A', numList=None, accounts=None, queue=None, **kwargs):
+        super(WebPool, self).__init__(parent)
+        if accounts is None:
+            accounts = self.savedAccounts()
+        if len(accounts) == 0:
+            raise ValueError('There is no saved account in temp/cache/ to start a pool.')
+        numList = list(numList or [])
+        self.workers = []
+        for shard, account in enumerate(accounts):
+            # with a campaign queue every worker pulls the next pending rows itself, otherwise stripe the list
+            numbers = None
+            if queue is None:
+                numbers = numList[shard::len(accounts)]
+                if len(numbers) == 0:
+                    continue
+            worker = Web(step=step, numList=numbers, Remember=True, account=account, queue=queue, **kwargs)
+            self.workers.append(worker)
+        self.reviewed = [0] * len(self.workers)
+        self.found = [0] * len(self.workers)
+        self.notFound = [0] * len(self.workers)
+        self.running = len(self.workers)
+        for i, worker in enumerate(self.workers):
+            worker.lcdNumber_reviewed.connect(lambda value, i=i: self.mergeCounter(self.reviewed, i, value,
+                                                                                 self.lcdNumber_reviewed))
+            worker.lcdNumber_wa.connect(lambda value, i=i: self.mergeCounter(self.found, i, value, self.lcdNumber_wa))
+            worker.lcdNumber_nwa.connect(lambda value, i=i: self.mergeCounter(self.notFound, i, value,
+                                                                            self.lcdNumber_nwa))
+            worker.LogBox.connect(lambda text, account=worker.account: self.LogBox.emit(f"[{account}] {text}"))
+            worker.wa.connect(self.wa.emit)
+            worker.nwa.connect(self.nwa.emit)
+            worker.EndWork.connect(self.workerEnd)
+
+    @staticmethod
+    def savedAccounts():
+        return cachedAccounts()
+
+    def mergeCounter(self, counters, index, value, signal):
+        counters[index] = value
+        signal.emit(sum(counters))
+
+    def workerEnd(self, msg):
+        self.running -= 1
+        log.debug(f"pool worker end, {self.running} running")
+        if self.running <= 0:
+            self.EndWork.emit(msg)
+
+    def start(self):
+        log.debug(f"pool start with {len(self.workers)} workers")
+        if len(self.workers) == 0:
+            self.EndWork.emit('')
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers:
+            try:
+                worker.stop()
+            except:
+                log.exception("pool stop")
@@ -0,0 +1,149 @@
+"""
+Durable job queue for campaigns, shared by the GUI engine (browserCtrl.Web) and envoie.py.
+
+Every job is identified by an idempotency key inside its campaign (the phone number), so enqueueing
+the same campaign twice adds nothing and a job that is `done` is never handed out again. Workers
+stream jobs through a keyset cursor, a few rows at a time, and a crashed or stopped run resumes
+where it stopped after `recover()`; `retry_failed()` gives the failed jobs another try.
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+QUEUE_PATH = r"./temp/temporary.data"
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+# a failed job is handed out again by a resumed run until it was tried this many times
+MAX_ATTEMPTS = 3
+
+Job = namedtuple('Job', ['id', 'key', 'payload', 'attempts'])
+
+
+class CampaignQueue(object):
+    def __init__(self, campaign, path=QUEUE_PATH):
+        self.campaign = campaign
+        self.path = path
+        self._local = threading.local()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.create()
+
+    def connect(self):
+        """
+        one connection per thread, so the pool workers can share a queue
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def create(self):
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, campaign TEXT NOT NULL, "
+                     "key TEXT NOT NULL, payload TEXT, state TEXT NOT NULL DEFAULT 'pending', "
+                     "attempts INT NOT NULL DEFAULT 0, result TEXT, updated REAL, UNIQUE (campaign, key))")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (campaign, state, id)")
+
+    def extend(self, items):
+        """
+        enqueue (key, payload) pairs, keys already known for this campaign are ignored,
+        return the number of new jobs
+        """
+        conn = self.connect()
+        rows = ((self.campaign, f"{key}", json.dumps(payload, ensure_ascii=False), time.time())
+                for key, payload in items)
+        before = conn.total_changes
+        conn.execute("BEGIN")
+        conn.executemany("INSERT OR IGNORE INTO jobs (campaign, key, payload, updated) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("COMMIT")
+        return conn.total_changes - before
+
+    def extend_from(self, select, params=()):
+        """
+        enqueue the rows of `select`, which must name its columns `key` and `payload`,
+        without loading them in Python
+        """
+        conn = self.connect()
+        before = conn.total_changes
+        conn.execute(fr"INSERT OR IGNORE INTO jobs (campaign, key, payload, updated) "
+                     fr"SELECT ?, CAST(src.key AS TEXT), src.payload, ? FROM ({select}) AS src",
+                     (self.campaign, time.time()) + tuple(params))
+        return conn.total_changes - before
+
+    def recover(self):
+        """
+        hand the jobs claimed by a crashed or stopped run out again
+        """
+        conn = self.connect()
+        conn.execute("UPDATE jobs SET state = ? WHERE campaign = ? AND state = ?", (PENDING, self.campaign, CLAIMED))
+
+    def claim(self, size):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT id, key, payload, attempts FROM jobs WHERE campaign = ? AND state = ? "
+                                "ORDER BY id LIMIT ?", (self.campaign, PENDING, size)).fetchall()
+            conn.executemany("UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                             ((CLAIMED, time.time(), row[0]) for row in rows))
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        return [Job(row[0], row[1], json.loads(row[2]) if row[2] is not None else None, row[3] + 1) for row in rows]
+
+    def stream(self, size=20):
+        """
+        yield pending jobs a few at a time until the campaign is drained
+        """
+        while True:
+            jobs = self.claim(size)
+            if not jobs:
+                return
+            for job in jobs:
+                yield job
+
+    def settle(self, key, state, result=None):
+        conn = self.connect()
+        conn.execute("UPDATE jobs SET state = ?, result = ?, updated = ? WHERE campaign = ? AND key = ?",
+                     (state, result, time.time(), self.campaign, f"{key}"))
+
+    def done(self, key, result=None):
+        self.settle(key, DONE, result)
+
+    def failed(self, key, result=None):
+        self.settle(key, FAILED, result)
+
+    def retry_failed(self, max_attempts=MAX_ATTEMPTS):
+        """
+        hand the failed jobs out again, but those already tried `max_attempts` times (None for no
+        limit), return how many
+        """
+        conn = self.connect()
+        before = conn.total_changes
+        if max_attempts is None:
+            conn.execute("UPDATE jobs SET state = ? WHERE campaign = ? AND state = ?",
+                         (PENDING, self.campaign, FAILED))
+        else:
+            conn.execute("UPDATE jobs SET state = ? WHERE campaign = ? AND state = ? AND attempts < ?",
+                         (PENDING, self.campaign, FAILED, max_attempts))
+        return conn.total_changes - before
+
+    def counts(self):
+        conn = self.connect()
+        rows = conn.execute("SELECT state, count(*) FROM jobs WHERE campaign = ? GROUP BY state", (self.campaign,))
+        return dict(rows.fetchall())
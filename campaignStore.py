@@ -0,0 +1,181 @@
+"""
+Campaign schema of the GUI database (temp/temporary.data).
+
+Every import is a row of `campaigns` instead of a table of its own, so earlier lists can be
+reopened and queried together:
+
+    campaigns  one row per imported list
+    numbers    the numbers of each campaign with their list marks, keyed by (campaign, num)
+    results    the latest outcome of each number for each step (analysis, message, image)
+    attempts   every try, with its start and end time
+    prefixes   hit and miss counts of the analysis per number prefix (prefixIndex)
+
+"pending rows of campaign X" is a lookup on numbers (campaign, status) and "numbers that failed
+last month" one on results (state, updated). The schema version is kept in `user_version` and
+`connect` brings an older file up to date, moving the tables of the old one-table-per-import
+layout into `numbers`.
+"""
+import re
+import sqlite3
+import threading
+import time
+
+from appLog import log
+
+LEGACY_TABLE = re.compile(r"^\d{14}$")
+
+# one list of statements per schema version, applied in order
+MIGRATIONS = [
+    [
+        "CREATE TABLE IF NOT EXISTS campaigns (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, "
+        "source TEXT, created REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS numbers (campaign INTEGER NOT NULL REFERENCES campaigns (id) ON DELETE CASCADE, "
+        "num INTEGER NOT NULL, status TEXT NOT NULL DEFAULT '', res TEXT, updated REAL, "
+        "PRIMARY KEY (campaign, num)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS numbers_status ON numbers (campaign, status)",
+        "CREATE INDEX IF NOT EXISTS numbers_num ON numbers (num)",
+        "CREATE TABLE IF NOT EXISTS results (campaign INTEGER NOT NULL REFERENCES campaigns (id) ON DELETE CASCADE, "
+        "num INTEGER NOT NULL, step TEXT NOT NULL, state TEXT NOT NULL, outcome TEXT, "
+        "attempts INTEGER NOT NULL DEFAULT 1, updated REAL NOT NULL, PRIMARY KEY (campaign, num, step)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS results_state ON results (state, updated)",
+        "CREATE INDEX IF NOT EXISTS results_updated ON results (campaign, updated)",
+        "CREATE INDEX IF NOT EXISTS results_num ON results (num)",
+        "CREATE TABLE IF NOT EXISTS attempts (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "campaign INTEGER NOT NULL REFERENCES campaigns (id) ON DELETE CASCADE, num INTEGER NOT NULL, "
+        "step TEXT NOT NULL, outcome TEXT, started REAL, finished REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS attempts_num ON attempts (num, finished)",
+        "CREATE INDEX IF NOT EXISTS attempts_campaign ON attempts (campaign, finished)",
+        # last result written by the incremental export of each campaign
+        "CREATE TABLE IF NOT EXISTS exports (name TEXT PRIMARY KEY, watermark REAL NOT NULL)",
+    ],
+    [
+        # hits and misses of the analysis under each number prefix, see prefixIndex
+        "CREATE TABLE IF NOT EXISTS prefixes (prefix TEXT PRIMARY KEY, hits INTEGER NOT NULL DEFAULT 0, "
+        "misses INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID",
+    ] + [
+        # counted from the analysis results already recorded, one prefix length at a time
+        "INSERT INTO prefixes (prefix, hits, misses) "
+        f"SELECT substr(CAST(num AS TEXT), 1, {depth}), sum(outcome = 'chat'), sum(outcome = 'invalid') "
+        "FROM results WHERE step = 'A' AND state = 'done' AND outcome IN ('chat', 'invalid') "
+        f"AND length(CAST(num AS TEXT)) - {depth} >= 3 GROUP BY 1 "
+        "ON CONFLICT (prefix) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses"
+        for depth in range(16)
+    ],
+    [
+        # order of commit of the results of each campaign, the watermark of the incremental export
+        "ALTER TABLE results ADD COLUMN seq INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS results_seq ON results (campaign, seq)",
+        "DROP INDEX IF EXISTS results_updated",
+    ],
+]
+VERSION = len(MIGRATIONS)
+
+_migrated = set()
+_lock = threading.Lock()
+
+
+def moveLegacyTables(conn):
+    """
+    turn every table of the one-table-per-import layout into a campaign
+    """
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+              if LEGACY_TABLE.match(row[0])]
+    for table in sorted(tables):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info(`{table}`)")]
+        if columns[:3] != ['num', 'status', 'res']:
+            continue
+        campaign = createCampaign(conn, table, source='')
+        conn.execute(f"INSERT OR IGNORE INTO numbers (campaign, num, status, res) "
+                     f"SELECT ?, CAST(num AS INTEGER), COALESCE(status, ''), res FROM `{table}`", (campaign,))
+        conn.execute(f"DROP TABLE `{table}`")
+        log.info(f"list {table} moved to campaign {campaign}")
+
+
+def sequenceResults(conn):
+    """
+    number the results recorded before `seq` in the order of their time, and turn the time
+    watermark of every export into the sequence of the last result it wrote
+    """
+    for (campaign,) in conn.execute("SELECT DISTINCT campaign FROM results").fetchall():
+        keys = conn.execute("SELECT num, step FROM results WHERE campaign = ? ORDER BY updated, num, step",
+                            (campaign,)).fetchall()
+        conn.executemany("UPDATE results SET seq = ? WHERE campaign = ? AND num = ? AND step = ?",
+                         ((seq, campaign, num, step) for seq, (num, step) in enumerate(keys, start=1)))
+    conn.execute("UPDATE exports SET watermark = (SELECT coalesce(max(r.seq), 0) FROM results AS r "
+                 "JOIN campaigns AS c ON c.id = r.campaign WHERE c.name = exports.name "
+                 "AND r.updated <= exports.watermark)")
+
+
+def migrate(conn):
+    """
+    bring the schema of `conn` to VERSION, one transaction per version
+    """
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version in range(current, VERSION):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            if version == 0:
+                moveLegacyTables(conn)
+            elif version == 2:
+                sequenceResults(conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def connect(dbPath, **kwargs):
+    """
+    sqlite connection to `dbPath` in WAL mode with an up to date schema
+    """
+    kwargs.setdefault('timeout', 30)
+    conn = sqlite3.connect(dbPath, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    with _lock:
+        if dbPath not in _migrated:
+            level, conn.isolation_level = conn.isolation_level, None
+            try:
+                migrate(conn)
+            finally:
+                conn.isolation_level = level
+            _migrated.add(dbPath)
+    return conn
+
+
+def createCampaign(conn, name, source=''):
+    """
+    id of the campaign `name`, created when it does not exist yet
+    """
+    conn.execute("INSERT OR IGNORE INTO campaigns (name, source, created) VALUES (?, ?, ?)",
+                 (name, f"{source}", time.time()))
+    return campaignId(conn, name)
+
+
+def campaignId(conn, name):
+    row = conn.execute("SELECT id FROM campaigns WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def campaigns(conn):
+    """
+    (name, source, created, numbers) of every campaign, newest first
+    """
+    return conn.execute("SELECT c.name, c.source, c.created, "
+                        "(SELECT count(*) FROM numbers AS n WHERE n.campaign = c.id) "
+                        "FROM campaigns AS c ORDER BY c.id DESC").fetchall()
+
+
+def failedSince(conn, since, step=None):
+    """
+    numbers whose latest outcome is a failure settled after `since`, over all campaigns
+    """
+    if step is None:
+        return conn.execute("SELECT DISTINCT num FROM results WHERE state = 'failed' AND updated >= ?",
+                            (since,)).fetchall()
+    return conn.execute("SELECT DISTINCT num FROM results WHERE state = 'failed' AND updated >= ? AND step = ?",
+                        (since, step)).fetchall()
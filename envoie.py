@@ -1,11 +1,27 @@
+import os
 import random
 import json
 import logging
 import time
-from alright import WhatsApp
+from alright import WhatsApp, RateScheduler, SEND_FAILED
+from alright.acks import FAILED, UNCONFIRMED
+from alright.rules import ReplyRules
+from alright.navigator import OPENED, NOT_ON_WHATSAPP
+from campaignQueue import CampaignQueue, QUEUE_PATH
+from registrationCache import RegistrationCache
+from messageTemplate import compile_template
+
+# Champs des contacts utilisés dans les modèles de wamessage.json, une ligne dont le champ est vide est supprimée
+CHAMPS_MONTANT = (
+    'KDV', 'STOPAJ', 'KDV 2', 'GEÇİCİ VERGİ', 'GELİR V.', 'MTV', 'T. CEZASI', 'VERGİ YAP.', 'SGK', 'BAĞ-KUR',
+    'SGK YAPILANDIRMA', 'SMM KDV Sİ', 'E DÖNÜŞÜM', 'DEFTER TASTİK', 'E. KALAN TUTAR', 'MUHASEBE ÜC.', 'TOPLAM',
+    'FAZLA ALINAN', 'KALAN',
+)
+CHAMPS = ('SIRA', 'MÜKELLEF') + CHAMPS_MONTANT + ('SON ÖDEME', 'İBAN')
 
 class WhatsAppMessenger:
-    def __init__(self, message_file='wamessage.json', contact_file='wacontact.json', log_file='whatsapp_log.txt'):
+    def __init__(self, message_file='wamessage.json', contact_file='wacontact.json', log_file='whatsapp_log.txt',
+                 campaign=None, queue_file=QUEUE_PATH, scheduler=None, cache=None):
         """Initialisation du WhatsApp Messenger avec des fichiers JSON et configuration des logs."""
         self.message_file = message_file
         self.contact_file = contact_file
@@ -22,8 +38,26 @@ class WhatsAppMessenger:
         self.messages = self._load_json(self.message_file, "messages")
         self.contacts = self._load_json(self.contact_file, "contacts")
 
-        # Initialiser l'objet WhatsApp
-        self.messenger = WhatsApp()
+        # File d'attente durable : une campagne par fichier de contacts et par mois, reprise là où elle s'est arrêtée
+        if campaign is None:
+            campaign = f"{os.path.basename(contact_file)}-{time.strftime('%Y-%m')}"
+        self.queue = CampaignQueue(campaign, path=queue_file)
+
+        # Cache des numéros déjà vérifiés : un numéro connu comme absent de WhatsApp n'est pas rouvert
+        if cache is None:
+            cache = RegistrationCache(path=queue_file)
+        self.cache = cache
+
+        # Cadence adaptative : ralentit dès que WhatsApp montre des signes de limitation, accélère sinon
+        if scheduler is None:
+            scheduler = RateScheduler(rate=1 / 4, max_rate=1 / 2, hourly=300, daily=1500)
+        self.scheduler = scheduler
+
+        # Initialiser l'objet WhatsApp, les coches des messages envoyés arrivent dans _accuse
+        self.messenger = WhatsApp(scheduler=self.scheduler, on_ack=self._accuse)
+
+        # Contacts dont les messages attendent encore leur première coche, par numéro
+        self.en_attente = {}
 
         # Compteurs pour les statistiques
         self.messages_envoyes = 0
@@ -66,10 +100,27 @@ class WhatsAppMessenger:
 
             logging.debug(f"Message sélectionné : {message_text}")
 
-            # Envoyer le message texte
+            if self.cache.lookup(contact['phone']) is False:
+                logging.warning(f"{contact['phone']} n'est pas sur WhatsApp (cache), contact ignoré.")
+                return False
+
+            # Ouvrir la discussion dans l'application déjà chargée et envoyer le message texte
             if message_text:
                 logging.info(f"Envoi du message texte à {contact['phone']} : {message_text}")
-                self.messenger.send_direct_message(contact['phone'], message_text)
+                statut = self.messenger.send_direct_message(contact['phone'], message_text, saved=False)
+            else:
+                statut = self.messenger.find_user(contact['phone']).status
+            if statut in (OPENED, SEND_FAILED, NOT_ON_WHATSAPP):
+                self.cache.record(contact['phone'], statut != NOT_ON_WHATSAPP)
+            if statut == NOT_ON_WHATSAPP:
+                logging.warning(f"{contact['phone']} n'est pas sur WhatsApp, contact ignoré.")
+                return False
+            if statut == SEND_FAILED:
+                logging.error(f"Le message n'a pas pu être envoyé à {contact['phone']}.")
+                return False
+            if statut != OPENED:
+                logging.error(f"La discussion de {contact['phone']} ne s'est pas ouverte ({statut}).")
+                return False
 
             # Envoyer une image (si disponible)
             if message.get('image'):
@@ -93,60 +144,10 @@ class WhatsAppMessenger:
             return False  # Envoi échoué
 
     def _replace_placeholders(self, message_text, contact):
-        """Remplace les placeholders dans le message texte en fonction des données du contact."""
-        placeholders = {
-            "{SIRA}": contact.get('SIRA', ''),
-            "{MÜKELLEF}": contact.get('MÜKELLEF', ''),
-            "{KDV}": self._format_money(contact.get('KDV', '')),  # Formater en argent
-            "{STOPAJ}": self._format_money(contact.get('STOPAJ', '')),  # Formater en argent
-            "{KDV 2}": self._format_money(contact.get('KDV 2', '')),  # Formater en argent
-            "{GEÇİCİ VERGİ}": self._format_money(contact.get('GEÇİCİ VERGİ', '')),  # Formater en argent
-            "{GELİR V.}": self._format_money(contact.get('GELİR V.', '')),  # Formater en argent
-            "{MTV}": self._format_money(contact.get('MTV', '')),  # Formater en argent
-            "{T. CEZASI}": self._format_money(contact.get('T. CEZASI', '')),  # Formater en argent
-            "{VERGİ YAP.}": self._format_money(contact.get('VERGİ YAP.', '')),  # Formater en argent
-            "{SGK}": self._format_money(contact.get('SGK', '')),  # Formater en argent
-            "{BAĞ-KUR}": self._format_money(contact.get('BAĞ-KUR', '')),  # Formater en argent
-            "{SGK YAPILANDIRMA}": self._format_money(contact.get('SGK YAPILANDIRMA', '')),  # Formater en argent
-            "{SMM KDV Sİ}": self._format_money(contact.get('SMM KDV Sİ', '')),  # Formater en argent
-            "{E DÖNÜŞÜM}": self._format_money(contact.get('E DÖNÜŞÜM', '')),  # Formater en argent
-            "{DEFTER TASTİK}": self._format_money(contact.get('DEFTER TASTİK', '')),  # Formater en argent
-            "{E. KALAN TUTAR}": self._format_money(contact.get('E. KALAN TUTAR', '')),  # Formater en argent
-            "{MUHASEBE ÜC.}": self._format_money(contact.get('MUHASEBE ÜC.', '')),  # Formater en argent
-            "{TOPLAM}": self._format_money(contact.get('TOPLAM', '')),  # Formater en argent
-            "{FAZLA ALINAN}": self._format_money(contact.get('FAZLA ALINAN', '')),  # Formater en argent
-            "{KALAN}": self._format_money(contact.get('KALAN', '')),  # Formater en argent
-            "{SON ÖDEME}": contact.get('SON ÖDEME', ''),
-            "{İBAN}": contact.get('İBAN', ''),
-        }
-
-        # Remplacer les placeholders dans le message
-        for placeholder, value in placeholders.items():
-            if value:  # Si la valeur n'est pas vide
-                message_text = message_text.replace(placeholder, str(value))
-            else:  # Si la valeur est vide, supprimer la ligne correspondante
-                message_text = self._remove_line_with_placeholder(message_text, placeholder)
-
-        return message_text
-    def _format_money(self, amount):
-        """Formate un montant numérique en format monétaire (ex: 12823.0 -> '12 823,00')."""
-        try:
-            # Convertir en float pour s'assurer que c'est un nombre
-            amount = float(amount)
-            # Formater avec des espaces comme séparateurs de milliers et une virgule pour les décimales
-            formatted_amount = "{:,.2f}".format(amount).replace(",", " ").replace(".", ",")
-            return formatted_amount
-        except (ValueError, TypeError):
-            logging.error(f"Erreur de formatage du montant : {amount}")
-            return str(amount)  # Retourner la valeur originale en cas d'erreur
-        
-
-
-    def _remove_line_with_placeholder(self, message_text, placeholder):
-        """Supprime la ligne contenant le placeholder si la valeur est vide."""
-        lines = message_text.split('\n')
-        lines = [line for line in lines if placeholder not in line]
-        return '\n'.join(lines)
+        """Remplace les placeholders dans le message texte en fonction des données du contact.
+
+        Le modèle est compilé une seule fois, les lignes dont un champ est vide sont supprimées."""
+        return compile_template(message_text, CHAMPS, CHAMPS_MONTANT).render(contact)
 
     def send_messages_to_all_contacts(self):
         """Envoie des messages à tous les contacts de manière séquentielle."""
@@ -156,24 +157,77 @@ class WhatsAppMessenger:
             logging.error("Les messages ou contacts ne sont pas chargés.")
             return
 
-        for index, contact in enumerate(self.contacts, start=1):
-            logging.debug(f"Traitement du contact {index}/{len(self.contacts)} : {contact}")
+        # Les contacts déjà connus de la campagne sont ignorés, ceux déjà envoyés ne seront pas renvoyés
+        self.queue.recover()
+        # Les contacts en échec sont retentés, jusqu'à MAX_ATTEMPTS essais
+        self.queue.retry_failed()
+        nouveaux = self.queue.extend((contact.get('phone'), contact) for contact in self.contacts if contact.get('phone'))
+        logging.info(f"Campagne {self.queue.campaign} : {nouveaux} nouveaux contacts, état {self.queue.counts()}")
 
-            # Envoi du message personnalisé et enregistrement du succès ou de l'échec
+        for index, job in enumerate(self.queue.stream(), start=1):
+            contact = job.payload
+            logging.debug(f"Traitement du contact {index} : {contact}")
+
+            # Envoi du message personnalisé, le succès n'est enregistré qu'à la première coche de chaque message
+            attente = self.en_attente[contact['phone']] = {'job': job, 'envoye': False, 'echec': False}
             if self.send_personalized_message(contact):
-                logging.info(f"Message envoyé avec succès à {contact['MÜKELLEF']} ({contact['phone']}).")
-                self.messages_envoyes += 1
+                attente['envoye'] = True
+                if self.messenger.acks.pending(contact['phone']) == 0:
+                    self._terminer(contact['phone'])
             else:
+                del self.en_attente[contact['phone']]
                 logging.warning(f"Échec de l'envoi à {contact['MÜKELLEF']} ({contact['phone']}).")
                 self.messages_echoues += 1
+                self.queue.failed(job.key)
 
-            # Pause pour éviter d'envoyer trop rapidement (optionnel)
-            logging.debug(f"Pause après l'envoi au contact {contact['MÜKELLEF']}.")
-            time.sleep(2)  # 2 secondes de pause entre chaque envoi
+        # Attendre les coches des derniers messages avant le résumé
+        self.messenger.acks.flush()
+        for phone in list(self.en_attente):
+            self._terminer(phone)
 
         # Résumé final des envois
         self._log_summary()
 
+    def _accuse(self, accuse):
+        """Reçoit les changements de coche des messages envoyés et termine les contacts dont tous les messages
+        sont partis."""
+        attente = self.en_attente.get(accuse.token)
+        if attente is None or not accuse.resolved:
+            return
+        if accuse.state == FAILED:
+            logging.warning(f"Pas de coche pour un message à {accuse.token} après {accuse.elapsed:.0f} s.")
+            attente['echec'] = True
+        elif accuse.state == UNCONFIRMED:
+            # la discussion a été quittée avant la première coche : le message est parti, il n'est pas renvoyé
+            logging.info(f"Message à {accuse.token} envoyé, sans coche vue.")
+        if attente['envoye'] and self.messenger.acks.pending(accuse.token) == 0:
+            self._terminer(accuse.token)
+
+    def _terminer(self, phone):
+        """Enregistre le succès ou l'échec d'un contact dont les messages ont tous une coche ou ont échoué."""
+        attente = self.en_attente.pop(phone)
+        contact = attente['job'].payload
+        if attente['echec'] or not attente['envoye']:
+            logging.warning(f"Échec de l'envoi à {contact['MÜKELLEF']} ({phone}).")
+            self.messages_echoues += 1
+            self.queue.failed(attente['job'].key)
+        else:
+            logging.info(f"Message envoyé avec succès à {contact['MÜKELLEF']} ({phone}).")
+            self.messages_envoyes += 1
+            self.queue.done(attente['job'].key)
+
+    def ecouter_reponses(self, regles=(), duree=None):
+        """Écoute les réponses des clients, poussées par la page dès leur arrivée, et applique les règles
+        de réponse automatique (alright.rules.Rule). `duree` en secondes limite l'écoute, None pour ne pas
+        s'arrêter."""
+        reponses = ReplyRules(self.messenger, regles)
+        fin = None if duree is None else time.monotonic() + duree
+        for message in self.messenger.listen(until=None if fin is None else lambda: time.monotonic() >= fin):
+            logging.info(f"Réponse de {message.sender or message.chat} : {message.text}")
+            regles_appliquees = reponses.handle(message)
+            if regles_appliquees:
+                logging.info(f"Règles appliquées à {message.chat} : {regles_appliquees}")
+
     def _log_summary(self):
         """Enregistre un résumé des envois."""
         logging.info("Résumé des envois :")
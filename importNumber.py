@@ -108,6 +108,35 @@ class Ui_Form(object):
 "}")
         self.btn_importFile.setObjectName("btn_importFile")
         self.gridLayout.addWidget(self.btn_importFile, 1, 0, 1, 1)
+        self.btn_importFolder = QtWidgets.QPushButton(self.frame_file)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.btn_importFolder.sizePolicy().hasHeightForWidth())
+        self.btn_importFolder.setSizePolicy(sizePolicy)
+        self.btn_importFolder.setMinimumSize(QtCore.QSize(100, 25))
+        self.btn_importFolder.setMaximumSize(QtCore.QSize(16777215, 16777215))
+        font = QtGui.QFont()
+        font.setFamily("Arial")
+        font.setPointSize(14)
+        font.setBold(False)
+        font.setItalic(False)
+        font.setWeight(50)
+        self.btn_importFolder.setFont(font)
+        self.btn_importFolder.setStyleSheet("QPushButton:hover:!pressed\n"
+"{\n"
+"  border: 2px solid rgb(0, 209, 255);\n"
+"    background-color: rgb(129, 125, 255);\n"
+"    color: rgb(85, 255, 255);\n"
+"}\n"
+"QPushButton{\n"
+"background-color: rgb(0, 92, 67);\n"
+"color: rgb(255, 204, 0);\n"
+"border: 1px solid  rgb(234, 0, 255);;\n"
+"border-radius: 10px;\n"
+"}")
+        self.btn_importFolder.setObjectName("btn_importFolder")
+        self.gridLayout.addWidget(self.btn_importFolder, 2, 0, 1, 1)
         self.gridLayout_3.addWidget(self.frame_file, 0, 0, 1, 1)
         self.frame_manul = QtWidgets.QFrame(self.frame_import)
         self.frame_manul.setStyleSheet("QFrame {\n"
@@ -203,6 +232,8 @@ class Ui_Form(object):
         self.label.setText(_translate("Form", "Loading the phone number from the file"))
         self.btn_importFile.setToolTip(_translate("Form", "File Select to load"))
         self.btn_importFile.setText(_translate("Form", "Select File"))
+        self.btn_importFolder.setToolTip(_translate("Form", "Folder Select to load every list in it"))
+        self.btn_importFolder.setText(_translate("Form", "Select Folder"))
         self.label_2.setText(_translate("Form", "Imported manually phone numbers"))
         self.btn_importManual.setToolTip(_translate("Form", "Loading the numbers entered"))
         self.btn_importManual.setText(_translate("Form", "Loading"))
@@ -0,0 +1,218 @@
+"""
+Readers of number list files, for the importer and its pool processes.
+
+Kept apart from numberLoader and free of Qt, Selenium and the application logging setup: the
+process pool of `numberLoader.ingestMany` imports this module in every child process (spawned,
+on Windows), so a child loads only what parsing a file needs. csv files are scanned through a
+memory map, xlsx sheets parsed as a stream from their archive, xls sheets read row by row.
+"""
+import csv
+import glob
+import logging
+import mmap
+import os
+import re
+import zipfile
+from array import array
+from xml.etree import ElementTree
+
+import xlrd
+
+# the logger of appLog, configured by the application and left alone in the pool processes
+log = logging.getLogger('appLog')
+
+DIGITS = re.compile(r"\d{9,}")
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+PROGRESS_ROWS = 1000
+LIST_TYPES = ('csv', 'xls', 'xlsx')
+
+
+def normalizer(areaCode):
+    """
+    returns a function turning a cell into a full number with `areaCode`, or None when the cell
+    is not a phone number (not only digits, or shorter than 9 digits)
+    """
+    areaCode = f"{areaCode}"
+    fullmatch = DIGITS.fullmatch
+
+    def normalize(cell):
+        if isinstance(cell, float):
+            if not cell.is_integer():
+                return None
+            cell = f"{int(cell)}"
+        else:
+            cell = f"{cell}".strip()
+        if fullmatch(cell) is None:
+            return None
+        if cell.startswith(areaCode):
+            return int(cell)
+        if cell.startswith('0'):
+            return int(areaCode + cell[1:])
+        return int(areaCode + cell)
+    return normalize
+
+
+def csvCells(path, progress):
+    """
+    cells of a csv file, scanned line by line through a memory map
+    """
+    with open(path, 'rb') as raw:
+        if os.fstat(raw.fileno()).st_size == 0:
+            return
+        with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            lines = (line.decode('utf-8-sig', 'replace') for line in iter(mm.readline, b''))
+            for i, row in enumerate(csv.reader(lines), start=1):
+                yield from row
+                if i % PROGRESS_ROWS == 0:
+                    progress(mm.tell() / size)
+
+
+def xlsCells(path, progress):
+    """
+    cells of the first sheet of an xls workbook, row by row
+    """
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        for r in range(sheet.nrows):
+            yield from sheet.row_values(r)
+            if r % PROGRESS_ROWS == 0:
+                progress(r / sheet.nrows)
+    finally:
+        book.release_resources()
+
+
+class CountingReader(object):
+    """
+    file wrapper counting the bytes read, to report how far a zip member has been parsed
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def xlsxCells(path, progress):
+    """
+    cells of the first sheet of an xlsx workbook, parsed as a stream from the archive so memory
+    does not grow with the number of rows: each row read is removed from the tree, not only
+    cleared
+    """
+    with zipfile.ZipFile(path) as book:
+        names = book.namelist()
+        sheet = 'xl/worksheets/sheet1.xml'
+        if sheet not in names:
+            sheet = sorted(name for name in names if name.startswith('xl/worksheets/sheet'))[0]
+        strings = []
+        if 'xl/sharedStrings.xml' in names:
+            with book.open('xl/sharedStrings.xml') as shared:
+                root = None
+                for event, element in ElementTree.iterparse(shared, events=('start', 'end')):
+                    if root is None:
+                        root = element
+                    elif event == 'end' and element.tag == XLSX_NS + 'si':
+                        strings.append(''.join(text.text or '' for text in element.iter(XLSX_NS + 't')))
+                        root.remove(element)
+        size = book.getinfo(sheet).file_size or 1
+        with book.open(sheet) as member:
+            stream = CountingReader(member)
+            rows = 0
+            sheetData = None
+            for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == XLSX_NS + 'sheetData':
+                        sheetData = element
+                elif element.tag == XLSX_NS + 'c':
+                    kind = element.get('t')
+                    if kind == 'inlineStr':
+                        yield ''.join(text.text or '' for text in element.iter(XLSX_NS + 't'))
+                    else:
+                        value = element.findtext(XLSX_NS + 'v')
+                        if value is None:
+                            pass
+                        elif kind == 's':
+                            yield strings[int(value)]
+                        elif kind in ('str', 'e', 'b'):
+                            yield value
+                        else:
+                            try:
+                                yield float(value)
+                            except ValueError:
+                                yield value
+                elif element.tag == XLSX_NS + 'row':
+                    # the rows before were removed, this one is the first child: removed in constant time
+                    if sheetData is not None:
+                        sheetData.remove(element)
+                    else:
+                        element.clear()
+                    rows += 1
+                    if rows % PROGRESS_ROWS == 0:
+                        progress(stream.count / size)
+
+
+def cells(path, progress=None):
+    """
+    every cell of a csv, xls or xlsx file, read as a stream
+    """
+    progress = progress or (lambda fraction: None)
+    kind = path.split('.')[-1].lower()
+    if kind == 'csv':
+        yield from csvCells(path, progress)
+    elif kind == 'xls':
+        yield from xlsCells(path, progress)
+    elif kind == 'xlsx':
+        yield from xlsxCells(path, progress)
+    else:
+        log.debug(f"unsupported list type {kind}")
+
+
+def listFiles(source):
+    """
+    the list files named by `source`: a file, a directory (searched recursively), a glob pattern
+    or a list of those
+    """
+    if isinstance(source, (list, tuple)):
+        found = []
+        for item in source:
+            found.extend(path for path in listFiles(item) if path not in found)
+        return found
+    if os.path.isdir(source):
+        found = []
+        for folder, _, names in os.walk(source):
+            found.extend(os.path.join(folder, name) for name in names)
+    elif os.path.isfile(source):
+        return [source]
+    else:
+        found = glob.glob(source, recursive=True)
+    return sorted(path for path in found
+                  if path.split('.')[-1].lower() in LIST_TYPES and not os.path.basename(path).startswith('~$'))
+
+
+def parseFile(path, areaCode):
+    """
+    runs in a pool process: the distinct numbers of one file, sorted in a compact array, and the
+    number of cells read
+    """
+    normalize = normalizer(areaCode)
+    numbers = set()
+    read = 0
+    for read, cell in enumerate(cells(path), start=1):
+        num = normalize(cell)
+        if num is not None:
+            numbers.add(num)
+    return read, array('q', sorted(numbers))
+
+
+def readNumbers(path, areaCode):
+    """
+    the distinct numbers of the file at `path`
+    """
+    normalize = normalizer(areaCode)
+    numbers = set(map(normalize, cells(path)))
+    numbers.discard(None)
+    return numbers
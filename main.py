@@ -1,21 +1,38 @@
-import csv
+import multiprocessing
+
+if __name__ == '__main__':
+    # a pool process of the frozen Windows build (the list importer) runs its task and exits here,
+    # before the Qt and browser modules below are imported
+    multiprocessing.freeze_support()
+
+import hashlib
 import os
-import sys
-import re
 import sqlite3
-import xlrd
+import sys
 import requests
 import time
 import json
-from PyQt5.QtGui import QBrush, QTextCursor, QColor, QRegExpValidator, QIcon, QPixmap, QFontDatabase, QFont
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QPoint, QRegExp, QAbstractTableModel
-from PyQt5.QtSql import QSqlDatabase, QSqlQueryModel, QSqlQuery
+from array import array
+from bisect import bisect_left
+from PyQt5.QtGui import QBrush, QColor, QRegExpValidator, QIcon, QPixmap, QFontDatabase, QFont
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QPoint, QRegExp, QAbstractTableModel, QModelIndex
+from PyQt5.QtSql import QSqlDatabase
 from pytz import timezone
 from jdatetime import datetime as dt
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox, QDialog, QDesktopWidget
 from wasender import Ui_MainWindow
 import icons_rc
-from browserCtrl import Web
+from browserCtrl import Web, WebPool, cachedAccounts, sessions
+import campaignStore
+from campaignQueue import CampaignQueue
+from registrationCache import RegistrationCache
+from numberGenerator import ListGenerator, RangeSpace, parseSpec, MAX_GENERATED
+from numberLoader import ListImporter, normalizer, storeNumbers
+from resultWriter import ResultWriter
+from progressAggregator import ProgressAggregator
+from prefixIndex import PrefixIndex, BLOCK, MAX_BLOCKS, MAX_BUCKET
+from rangeStore import RangeStore, RangeQueue, RangeSyncer, rangeFolder, RANGE_MIN, RANGE_MAX, PENDING, REGISTERED
+from resultExport import ResultExporter, desktopDir
 from src import dpi
 from appLog import log
 
@@ -51,7 +68,6 @@ class Main():
         if not os.path.exists('temp'):
             os.mkdir('temp')
         self.dbPath = r"./temp/temporary.data"
-        self.reviewedCount = 0
         self.MainWindow.setWindowFlags(self.MainWindow.windowFlags() | Qt.FramelessWindowHint)
         self.MainWindow.setAttribute(Qt.WA_TranslucentBackground)
         self.ui.btn_close.clicked.connect(self.MainWindow.close)
@@ -86,9 +102,18 @@ class Main():
         self.ui.btn_stop.clicked.connect(self.stop_progress)
         self.ui.LogBox.setReadOnly(True)
         self.ui.LogBox.setTextInteractionFlags(Qt.NoTextInteraction)  # non-selectable Text in QPlainTextEdit
+        # WhatsApp registrations already checked, shared by every run: Analyze and Send only browse
+        # the numbers missing from it or older than its TTL
+        self.registrations = RegistrationCache(path=self.dbPath)
+        # RangeStore of the current campaign when it is a generated sweep kept as bitmaps
+        self.ranges = None
+        self.progress = ProgressAggregator(lcdReviewed=self.ui.lcdNumber_reviewed, lcdWa=self.ui.lcdNumber_wa,
+                                           lcdNwa=self.ui.lcdNumber_nwa, logBox=self.ui.LogBox)
         self.ui.langs.currentIndexChanged.connect(self.languageSet)
         self.languageSet()
+        self.reopenCampaign()
 
+        app.aboutToQuit.connect(sessions.closeAll)
         self.MainWindow.show()
         sys.exit(app.exec_())
 
@@ -170,6 +195,8 @@ class Main():
             self.fi.label.setText(self.ln["fi_label"][self.cln])
             self.fi.btn_importFile.setText(self.ln["fi_btn_importFile"][self.cln])
             self.fi.btn_importFile.setToolTip(self.ln["fi_btn_importFile_ttp"][self.cln])
+            self.fi.btn_importFolder.setText(self.ln["fi_btn_importFolder"][self.cln])
+            self.fi.btn_importFolder.setToolTip(self.ln["fi_btn_importFolder_ttp"][self.cln])
             self.fi.label_2.setText(self.ln["fi_label_2"][self.cln])
             self.fi.btn_importManual.setText(self.ln["fi_btn_importManual"][self.cln])
             self.fi.btn_importManual.setToolTip(self.ln["fi_btn_import_cancel_ttp"][self.cln])
@@ -234,41 +261,23 @@ class Main():
             self.MainWindow.setWindowState(Qt.WindowNoState)
             self.ui.btn_maxmin.setText('类')
 
-    def showNumberList(self, commandSQL, focus=0):
+    def showNumberList(self, name):
         try:
-            # QApplication.processEvents()
             global db
-            db = QSqlDatabase.addDatabase("QSQLITE")
-            db.setDatabaseName(self.dbPath)
+            if not QSqlDatabase.contains():
+                db = QSqlDatabase.addDatabase("QSQLITE")
+                db.setDatabaseName(self.dbPath)
             db.open()
-            # projectModel = QSqlQueryModel()
-            self.projectModel = ColorfullSqlQueryModel()
-            self.projectModel.setQuery(commandSQL, db)
             tel = self.ln["tb_header_tel"][self.cln]
             st = self.ln["tb_header_st"][self.cln]
             ress = self.ln["tb_header_ress"][self.cln]
-            self.projectModel.setHeaderData(0, Qt.Horizontal, tel)
-            self.projectModel.setHeaderData(1, Qt.Horizontal, st)
-            self.projectModel.setHeaderData(2, Qt.Horizontal, ress)
+            try:
+                self.projectModel.close()
+            except AttributeError:
+                pass
+            self.projectModel = NumberTableModel(self.dbPath, name, headers=(tel, st, ress))
+            self.projectModel.fetchMore()
             self.ui.tableview_numbers.setModel(self.projectModel)
-            self.rowCount = self.projectModel.rowCount()
-            # self.tableResult = projectModel
-            red = []
-            green = []
-            for i in range(self.rowCount):
-                res = self.projectModel.record(i).value("res")
-                if res == '☑':
-                    green.append(i)
-                elif res == '☒':
-                    red.append(i)
-            self.projectModel.setRowsToBeColored(red=red, green=green)
-            if focus != 0:
-                self.index = self.projectModel.index(focus, 2)
-                if (self.index.isValid()):
-                    self.ui.tableview_numbers.scrollTo(self.index)
-                    self.ui.tableview_numbers.selectRow(focus)
-                    log.debug("scroll")
-            # QApplication.processEvents()
         except Exception as e:
             if hasattr(e, 'message'):
                 log.exception(fr"{e.message}")
@@ -286,116 +295,106 @@ class Main():
         return timeZ
 
     def ListLoader(self, path):
-        self.ui.btn_export.setEnabled(False)
-        if path:
-            NUMBERS = []
-            type = path.split('.')[-1]
-            if type == 'csv':
-                with open(path, 'r+') as csvF:
-                    numbers = csv.reader(csvF)
-                    for number in numbers:
-                        for num in number:
-                            try:
-                                self.areaCode = int(self.ui.areaCode.text())
-                            except:
-                                pass
-                            try:
-                                n = int(num)
-                                if len(str(num)) >= 9:
-                                    s98 = re.compile(fr"^{self.areaCode}", re.I)
-                                    s0 = re.compile('^0', re.I)
-                                    if s98.search(num):
-                                        pass
-                                    elif s0.search(num):
-                                        num = re.sub('^0', fr"{self.areaCode}", num)
-                                    else:
-                                        num = fr"{self.areaCode}{num}"
-                                    n = int(num)
-                                    NUMBERS.append(n)
-                            except:
-                                continue
-            elif type == 'xlsx' or type == 'xls':
-                try:
-                    xlrd.xlsx.ensure_elementtree_imported(False, None)
-                    xlrd.xlsx.Element_has_iter = True
-                except:
-                    pass
-                wb = xlrd.open_workbook(path)
-                sheet = wb.sheet_by_index(0)
-                for c in range(sheet.ncols):
-                    for r in range(sheet.nrows):
-                        nume = sheet.cell_value(r, c)
-                        try:
-                            self.areaCode = int(self.ui.areaCode.text())
-                        except:
-                            pass
-                        try:
-                            num = str(int(nume))
-                            if len(str(num)) >= 9:
-                                s98 = re.compile(fr"^{self.areaCode}", re.I)
-                                s0 = re.compile('^0', re.I)
-                                if s98.search(num):
-                                    pass
-                                elif s0.search(num):
-                                    num = re.sub('^0', fr"{self.areaCode}", num)
-                                else:
-                                    num = fr"{self.areaCode}{num}"
-                                n = int(num)
-                                NUMBERS.append(n)
-                        except:
-                            continue
-            NUMBERS = set(NUMBERS)
-            self.ui.lcdNumber_allCount.display(len(NUMBERS))
-            try:
-                global TableNow
-                try:
-                    with sqlite3.connect(fr"{self.dbPath}") as dbi:
-                        log.debug("Connected to Database")
-                        TableNow = self.Time()
-                        table = fr"CREATE TABLE IF NOT EXISTS `{TableNow}` (num INT PRIMARY KEY NOT NULL, status VARCHAR(50), res VARCHAR(12))"
-                        dbi.execute(table)
-                        log.debug("Table OK")
-                        i = 1
-                        for num in NUMBERS:
-                            insert = fr"INSERT INTO `{TableNow}` (num,status) VALUES ('{num}','')"
-                            dbi.execute(insert)
-                            i += 1
-                        dbi.commit()
-                except:
-                    try:
-                        db.close()
-                    except:
-                        log.debug("error db")
-                    try:
-                        dbi.close()
-                    except:
-                        log.debug("error dbi", exc_info=True)
-                    os.remove(self.dbPath)
-                    with sqlite3.connect(fr"{self.dbPath}") as dbi:
-                        log.debug("Connected to Database")
-                        TableNow = self.Time()
-                        table = fr"CREATE TABLE IF NOT EXISTS `{TableNow}` (num INT PRIMARY KEY NOT NULL, status VARCHAR(50), res VARCHAR(12))"
-                        dbi.execute(table)
-                        log.debug("Table OK")
-                        i = 1
-                        for num in NUMBERS:
-                            insert = fr"INSERT INTO `{TableNow}` (num,status) VALUES ('{num}','')"
-                            dbi.execute(insert)
-                            i += 1
-                        dbi.commit()
-                self.ui.LogBox.clear()
-                self.ui.LogBox.appendPlainText("--- Numbers entered successfully ---")
-                self.showNumberList(commandSQL=fr"select * from `{TableNow}`")
-                self.ui.btn_clear.setEnabled(True)
-            except:
+        if not path:
+            log.debug("Not Selected File!")
+            return
+        try:
+            if self.ListThread.isRunning():
                 self.msgError(self.ln["listloader_err"][self.cln])
-            try:
-                dbi.close()
-            except:
-                pass
+                return
+        except AttributeError:
+            pass
+        self.ui.btn_export.setEnabled(False)
+        try:
+            self.areaCode = int(self.ui.areaCode.text())
+        except:
+            pass
+        self.startImport(ListImporter(path=path, name=self.Time(), areaCode=self.areaCode, dbPath=self.dbPath))
+
+    def startImport(self, thread):
+        '''
+        run a ListImporter (or a ListGenerator) filling a new campaign
+        '''
+        self.ui.LogBox.clear()
+        self.ui.lcdNumber_allCount.display(0)
+        self.ListThread = thread
+        self.ListThread.count.connect(self.ui.lcdNumber_allCount.display)
+        self.ListThread.progress.connect(self.listProgress)
+        self.ListThread.fileDone.connect(self.listFileDone)
+        self.ListThread.loaded.connect(self.listLoaded)
+        self.ListThread.failed.connect(lambda error: self.msgError(self.ln["listloader_err"][self.cln]))
+        self.ListThread.cancelled.connect(lambda name: self.ui.LogBox.appendPlainText("--- Import cancelled ---"))
+        # the folder is walked by the importer, one without any list file leaves no campaign behind
+        self.ListThread.empty.connect(lambda path: self.msgError(self.ln["nolist_err"][self.cln]))
+        self.ListThread.start()
+
+    def listProgress(self, percent):
+        if percent % 10 == 0:
+            self.ui.LogBox.appendPlainText(f"--- Importing numbers {percent}% ---")
+
+    def listFileDone(self, path, cells, numbers, added, error):
+        name = os.path.basename(path)
+        if error:
+            self.ui.LogBox.appendPlainText(f"{name} => {error}")
         else:
-            log.debug("Not Selected File!")
+            self.ui.LogBox.appendPlainText(f"{name} => {numbers} numbers, {added} new")
+
+    def listLoaded(self, name, count):
+        log.debug("Campaign OK")
+        self.ui.lcdNumber_allCount.display(count)
+        self.ui.LogBox.appendPlainText("--- Numbers entered successfully ---")
+        self.openCampaign(name)
+
+    def openCampaign(self, name):
+        global CampaignNow
+        CampaignNow = name
+        if RangeStore.exists(rangeFolder(name)):
+            # the list of a sweep holds its settled numbers, copied from the blocks first
+            self.syncList(name)
+        else:
+            self.showNumberList(CampaignNow)
+        self.ui.btn_clear.setEnabled(True)
+
+    def syncList(self, name):
+        '''
+        copy the numbers of the range campaign `name` settled since the last sync into its list, off the
+        GUI thread, then show it
+        '''
+        try:
+            if self.SyncThread.isRunning():
+                # the running sync may have missed the latest numbers, another one follows it
+                self.SyncThread.finished.connect(lambda: self.syncList(name))
+                return
+        except AttributeError:
             pass
+        self.SyncThread = RangeSyncer(dbPath=self.dbPath, name=name)
+        self.SyncThread.synced.connect(self.listSynced)
+        self.SyncThread.failed.connect(lambda error: self.msgError(self.ln["ldlist_err"][self.cln]))
+        self.SyncThread.start()
+
+    def listSynced(self, name, count):
+        if count:
+            self.ui.LogBox.appendPlainText(f"--- {count} numbers settled ---")
+        if name == CampaignNow:
+            self.showNumberList(name)
+
+    def reopenCampaign(self):
+        """
+        show the last campaign again, its history is kept across restarts
+        """
+        try:
+            conn = campaignStore.connect(self.dbPath)
+            try:
+                history = campaignStore.campaigns(conn)
+            finally:
+                conn.close()
+            if history:
+                name, source, created, count = history[0]
+                self.ui.lcdNumber_allCount.display(count)
+                self.ui.LogBox.appendPlainText(f"--- Campaign {name} reopened ---")
+                self.openCampaign(name)
+        except:
+            log.exception("reopen campaign")
 
     def msgError(self, errorText='مشکلی پیش آمده است !!!', icon='', colorf="#ff0000"):
         box = QMessageBox()
@@ -440,53 +439,21 @@ class Main():
         box.setWindowFlags(box.windowFlags() | Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
         box.exec_()
 
-    def lcdNumber_reviewed(self, counter):
-        self.reviewedCount = counter
-        if not self.stopProgress:
-            self.ui.lcdNumber_reviewed.display(counter)
-
-    def lcdNumber_wa(self, value):
-        if not self.stopProgress:
-            self.ui.lcdNumber_wa.display(value)
-
-    def lcdNumber_nwa(self, value):
-        if not self.stopProgress:
-            self.ui.lcdNumber_nwa.display(value)
-
-    def programLog(self, log):
-        if not self.stopProgress:
-            self.ui.LogBox.appendPlainText(log)
-            self.ui.LogBox.moveCursor(QTextCursor.End)
-
-    def waINS(self, number):
-        log.debug(number)
-        if db.open():
-            query = QSqlQuery()
-            if self.ui.start_tab.currentIndex() == 0:
-                query.exec_(fr"update `{TableNow}` set status = '✓', res = '☑' where num = '{number}'")
-            elif self.ui.start_tab.currentIndex() == 1:
-                query.exec_(fr"update `{TableNow}` set status = '✓✓', res = '☑' where num = '{number}'")
-            elif self.ui.start_tab.currentIndex() == 2:
-                query.exec_(fr"update `{TableNow}` set status = '✓✓✓', res = '☑' where num = '{number}'")
-            self.showNumberList(commandSQL=fr"select * from `{TableNow}`", focus=self.reviewedCount)
-        else:
-            log.debug("wa Db Not Open")
-
-    def nwaINS(self, number):
-        log.debug(number)
-        if db.open():
-            query = QSqlQuery()
-            if self.ui.start_tab.currentIndex() == 0:
-                query.exec_(fr"update `{TableNow}` set status = '✓', res = '☒' where num = '{number}'")
-            elif self.ui.start_tab.currentIndex() == 1:
-                query.exec_(fr"update `{TableNow}` set status = '✓✓', res = '☒' where num = '{number}'")
-            elif self.ui.start_tab.currentIndex() == 2:
-                query.exec_(fr"update `{TableNow}` set status = '✓✓✓', res = '☒' where num = '{number}'")
-            self.showNumberList(commandSQL=fr"select * from `{TableNow}`", focus=self.reviewedCount)
-        else:
-            log.debug("nwa Db Not Open")
+    def showResults(self, rows):
+        """
+        repaint the rows committed by the result writer, rows not fetched yet are read with their new values later
+        """
+        last = -1
+        for num, status, res in rows:
+            row = self.projectModel.setResult(num, status, res)
+            if row >= 0:
+                last = row
+        if last >= 0:
+            self.ui.tableview_numbers.scrollTo(self.projectModel.index(last, 2))
+            self.ui.tableview_numbers.selectRow(last)
 
     def EndWork(self, msg=''):
+        self.progress.stop()
         if not self.stopProgress:
             self.ui.btn_start.setEnabled(True)
             self.ui.btn_stop.setEnabled(False)
@@ -508,6 +475,12 @@ class Main():
 
     def stop_progress(self):
         log.debug("stop")
+        try:
+            if self.ListThread.isRunning():
+                self.ListThread.stop()
+                return
+        except AttributeError:
+            pass
         self.EndWork()
         self.stopProgress = True
         entText = "-- Stop running --"
@@ -528,27 +501,124 @@ class Main():
                 errormsg = e
             self.msgError(fr"{errormsg}")
 
+    def campaignQueue(self, step, where, content=''):
+        '''
+        durable queue of the numbers of the current campaign matching `where` for `step`; the same
+        campaign, step and content resume the same queue, so rows already done are not sent twice
+        '''
+        conn = campaignStore.connect(self.dbPath)
+        try:
+            # the analysis visits the prefixes with the best hit rate first and skips the dead ones
+            index = PrefixIndex(conn) if step == 'A' else None
+            if index is not None and index.verdicts() == 0:
+                index = None
+            ranges = self.rangesOf(CampaignNow)
+            if ranges is not None:
+                # analysis walks the pending numbers, sending the pending and registered ones, as `where` does
+                windows = index.windows(ranges.ranges()) if index is not None else None
+                queue = RangeQueue(ranges, (PENDING,) if step == 'A' else (PENDING, REGISTERED),
+                                   campaign=CampaignNow, windows=windows, step=step)
+                log.debug(fr"ranges {CampaignNow}: {ranges.counts()}")
+                return queue
+            digest = hashlib.sha1(content.encode('utf8')).hexdigest()[:10]
+            queue = CampaignQueue(fr"{CampaignNow}-{step}-{digest}", path=self.dbPath)
+            queue.recover()
+            retried = queue.retry_failed()
+            if retried:
+                self.progress.log(f"--- {retried} failed numbers retried ---")
+            if index is not None:
+                # buckets of numbers sharing a prefix are ranked, the numbers stay in SQLite: the
+                # queue is filled in one statement joining them to the buckets in rank order
+                size = self.bucketSize(conn, where)
+                counts = dict(conn.execute(
+                    fr"select n.num / {size}, count(*) from numbers as n join campaigns as c on c.id = n.campaign "
+                    fr"where c.name = ? and ({where}) group by 1", (CampaignNow,)))
+                buckets, skipped = index.rankBuckets(counts, size)
+                if skipped:
+                    self.progress.log(f"--- {skipped} numbers skipped in dead prefixes ---")
+                added = queue.extend_from("select n.num as key, NULL as payload from json_each(?) as r "
+                                          "cross join numbers as n where n.campaign = "
+                                          "(select id from campaigns where name = ?) "
+                                          fr"and n.num >= r.value * {size} and n.num < (r.value + 1) * {size} "
+                                          fr"and ({where}) order by r.key, n.num",
+                                          (json.dumps(buckets), CampaignNow))
+            else:
+                added = queue.extend_from("select n.num as key, NULL as payload from numbers as n "
+                                          "join campaigns as c on c.id = n.campaign "
+                                          fr"where c.name = ? and ({where}) order by n.num", (CampaignNow,))
+        finally:
+            conn.close()
+        log.debug(fr"campaign {queue.campaign}: {added} new jobs, {queue.counts()}")
+        return queue
+
+    def bucketSize(self, conn, where):
+        '''
+        the smallest power of ten, from prefixIndex.BLOCK, splitting the numbers of the current
+        campaign matching `where` in at most MAX_BLOCKS buckets, counted in a single scan
+        '''
+        sizes = []
+        size = BLOCK
+        while size <= MAX_BUCKET:
+            sizes.append(size)
+            size *= 10
+        counts = conn.execute("select " + ", ".join(fr"count(distinct n.num / {size})" for size in sizes) +
+                              " from numbers as n join campaigns as c on c.id = n.campaign "
+                              fr"where c.name = ? and ({where})", (CampaignNow,)).fetchone()
+        return next((size for size, count in zip(sizes, counts) if count <= MAX_BLOCKS), sizes[-1])
+
+    def rangesOf(self, name):
+        '''
+        the RangeStore of the campaign `name`, None when its numbers are rows
+        '''
+        ranges = self.ranges
+        if ranges is not None and ranges.folder == rangeFolder(name):
+            return ranges
+        if ranges is not None:
+            ranges.close()
+            self.ranges = None
+        if RangeStore.exists(rangeFolder(name)):
+            self.ranges = RangeStore(rangeFolder(name))
+        return self.ranges
+
+    def startWorker(self, step, numList=None, **kwargs):
+        '''
+        start a browser worker for `step`, a pool of one worker per saved account when several accounts are saved
+        '''
+        # results are written off the GUI thread, in batches, with the status of `step`
+        self.writer = ResultWriter(dbPath=self.dbPath, campaign=CampaignNow,
+                                   ranges=isinstance(kwargs.get('queue'), RangeQueue))
+        self.writer.committed.connect(self.showResults)
+        self.writer.start()
+        if self.RememberLogin and len(WebPool.savedAccounts()) > 1:
+            log.debug("pool mode")
+            worker = WebPool(step=step, numList=numList, writer=self.writer, cache=self.registrations, **kwargs)
+        else:
+            worker = Web(counter_start=0, step=step, numList=numList, Remember=self.RememberLogin,
+                         writer=self.writer, cache=self.registrations, **kwargs)
+        # counters and log lines are only recorded here, the aggregator repaints them on its timer
+        worker.lcdNumber_reviewed.connect(self.progress.reviewed)
+        worker.lcdNumber_wa.connect(self.progress.found)
+        worker.lcdNumber_nwa.connect(self.progress.notFound)
+        worker.LogBox.connect(self.progress.log)
+        queue = kwargs.get('queue')
+        self.progress.start(total=queue.counts().get('pending', 0) if queue is not None else len(numList or []))
+        worker.EndWork.connect(self.EndWork)
+        # every result is queued before EndWork, the writer flushes them and ends
+        worker.EndWork.connect(self.writer.stop)
+        if isinstance(kwargs.get('queue'), RangeQueue):
+            # the open list asks for the numbers the run settled, only those are copied
+            self.writer.finished.connect(lambda name=CampaignNow: self.syncList(name))
+        worker.start()
+        return worker
+
     def AnalyzNum(self):
         try:
             if db.open():
                 # QApplication.processEvents()
                 log.debug("Analyz OK")
-                query = QSqlQuery()
-                query.exec_(fr"select * from `{TableNow}` where status = ''")
-                numList = []
-                while query.next():
-                    num = query.value(0)
-                    numList.append(num)
-                self.AnalyzThread = Web(counter_start=0, step='A', numList=numList, Remember=self.RememberLogin)
-                self.AnalyzThread.start()
+                queue = self.campaignQueue('A', "n.status = ''")
+                self.AnalyzThread = self.startWorker(step='A', queue=queue)
                 log.debug("send start command for browser")
-                self.AnalyzThread.lcdNumber_reviewed.connect(self.lcdNumber_reviewed)
-                self.AnalyzThread.lcdNumber_wa.connect(self.lcdNumber_wa)
-                self.AnalyzThread.lcdNumber_nwa.connect(self.lcdNumber_nwa)
-                self.AnalyzThread.LogBox.connect(self.programLog)
-                self.AnalyzThread.wa.connect(self.waINS)
-                self.AnalyzThread.nwa.connect(self.nwaINS)
-                self.AnalyzThread.EndWork.connect(self.EndWork)
                 self.stopProgress = False
         except Exception as e:
             if hasattr(e, 'message'):
@@ -561,12 +631,7 @@ class Main():
         try:
             if db.open():
                 # QApplication.processEvents()
-                query = QSqlQuery()
-                query.exec_(fr"select * from `{TableNow}` where status = '' or res = '☑'")
-                numList = []
-                while query.next():
-                    num = query.value(0)
-                    numList.append(num)
+                queue = self.campaignQueue('M', "n.status = '' or n.res = '☑'", text)
                 sleepMin = self.ui.sleepMin.text()
                 sleepMax = self.ui.sleepMax.text()
                 if sleepMin != '':
@@ -577,16 +642,8 @@ class Main():
                     sleepMax = int(sleepMax)
                 else:
                     sleepMax = 6
-                self.MsgThread = Web(counter_start=0, step='M', numList=numList, sleepMin=sleepMin, sleepMax=sleepMax,
-                                     text=text, Remember=self.RememberLogin)
-                self.MsgThread.start()
-                self.MsgThread.lcdNumber_reviewed.connect(self.lcdNumber_reviewed)
-                self.MsgThread.lcdNumber_wa.connect(self.lcdNumber_wa)
-                self.MsgThread.lcdNumber_nwa.connect(self.lcdNumber_nwa)
-                self.MsgThread.LogBox.connect(self.programLog)
-                self.MsgThread.wa.connect(self.waINS)
-                self.MsgThread.nwa.connect(self.nwaINS)
-                self.MsgThread.EndWork.connect(self.EndWork)
+                self.MsgThread = self.startWorker(step='M', queue=queue, sleepMin=sleepMin, sleepMax=sleepMax,
+                                                  text=text)
                 self.stopProgress = False
         except Exception as e:
             if hasattr(e, 'message'):
@@ -599,12 +656,7 @@ class Main():
         try:
             if db.open():
                 # QApplication.processEvents()
-                query = QSqlQuery()
-                query.exec_(fr"select * from `{TableNow}` where status = '' or res = '☑'")
-                numList = []
-                while query.next():
-                    num = query.value(0)
-                    numList.append(num)
+                queue = self.campaignQueue('I', "n.status = '' or n.res = '☑'", path + caption)
                 sleepMin = self.ui.sleepMin_I.text()
                 sleepMax = self.ui.sleepMax_I.text()
                 if sleepMin != '':
@@ -615,16 +667,8 @@ class Main():
                     sleepMax = int(sleepMax)
                 else:
                     sleepMax = 6
-                self.ImgThread = Web(counter_start=0, step='I', numList=numList, sleepMin=sleepMin, sleepMax=sleepMax,
-                                     text=caption, path=path, Remember=self.RememberLogin)
-                self.ImgThread.start()
-                self.ImgThread.lcdNumber_reviewed.connect(self.lcdNumber_reviewed)
-                self.ImgThread.lcdNumber_wa.connect(self.lcdNumber_wa)
-                self.ImgThread.lcdNumber_nwa.connect(self.lcdNumber_nwa)
-                self.ImgThread.LogBox.connect(self.programLog)
-                self.ImgThread.wa.connect(self.waINS)
-                self.ImgThread.nwa.connect(self.nwaINS)
-                self.ImgThread.EndWork.connect(self.EndWork)
+                self.ImgThread = self.startWorker(step='I', queue=queue, sleepMin=sleepMin, sleepMax=sleepMax,
+                                                  text=caption, path=path)
                 self.stopProgress = False
         except Exception as e:
             if hasattr(e, 'message'):
@@ -724,34 +768,22 @@ class Main():
             self.msgError(self.ln["ldlist_err"][self.cln])
 
     def export(self):
+        try:
+            if self.ExportThread.isRunning():
+                return
+        except AttributeError:
+            pass
         try:
             if db.open():
-                DeskTop = os.path.join(os.path.join(os.environ['USERPROFILE']), 'Desktop')
                 appName = self.ui.label_appName.text()
-                if not os.path.isdir(f'{DeskTop}/{appName}'):
-                    os.mkdir(f'{DeskTop}/{appName}')
-                query = QSqlQuery()
-                query.exec_(fr"select * from `{TableNow}`")
-                while query.next():
-                    number = query.value(0)
-                    status = query.value(1)
-                    res = query.value(2)
-                    FileName = "Export-"
-                    if status == '✓':
-                        FileName = 'Analyz-'
-                    elif status == '✓✓':
-                        FileName = 'SentMSG-'
-                    elif status == '✓✓✓':
-                        FileName = 'SentIMG-'
-                    else:
-                        continue
-                    if res == '☑':
-                        with open(fr"{DeskTop}\{appName}\{FileName}{TableNow}.csv", 'a+', encoding='utf8') as cSv:
-                            writer = csv.writer(cSv, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL,
-                                                lineterminator='\n')
-                            writer.writerow([fr"{number}"])
-                            # cSv.write(fr"{number}\n")
-                self.msgError(errorText=self.ln["export_sucs"][self.cln], icon='Information', colorf="#214917")
+                # only the results settled since the last export of this list are written
+                self.ExportThread = ResultExporter(dbPath=self.dbPath, name=CampaignNow,
+                                                   folder=os.path.join(desktopDir(), appName))
+                self.ExportThread.progress.connect(lambda count: self.ui.LogBox.appendPlainText(
+                    f"--- Exported {count} results ---"))
+                self.ExportThread.exported.connect(self.exported)
+                self.ExportThread.failed.connect(lambda error: self.msgError(self.ln["export_err"][self.cln]))
+                self.ExportThread.start()
         except Exception as e:
             if hasattr(e, 'message'):
                 log.exception(e.message)
@@ -761,6 +793,15 @@ class Main():
                 errormsg = e
             self.msgError(self.ln["export_err"][self.cln])
 
+    def exported(self, paths):
+        # the watermark left no result settled since the last export: no file was written
+        if not paths:
+            self.msgError(errorText=self.ln["export_none"][self.cln], icon='Information', colorf="#0013ff")
+            return
+        for path in paths:
+            self.ui.LogBox.appendPlainText(path)
+        self.msgError(errorText=self.ln["export_sucs"][self.cln], icon='Information', colorf="#214917")
+
     def initGenerate(self):
         log.debug("init Generate")
         from generate import Ui_Form
@@ -773,10 +814,11 @@ class Main():
         icon.addPixmap(QPixmap(":/main/icon.ico"), QIcon.Normal, QIcon.Off)
         self.generateForm.setWindowIcon(icon)
         self.frOM.setupUi(self.generateForm)
-        self.frOM.generate_num.setValidator(self.validator)
-        self.frOM.generate_num.setMaxLength(10)
+        # numbers, masks (90532???????) and ranges (a-b), separated by commas
+        self.frOM.generate_num.setValidator(QRegExpValidator(QRegExp(r"^[0-9?xX ,;-]+$")))
+        self.frOM.generate_num.setMaxLength(200)
         self.frOM.generate_count.setValidator(self.validator)
-        self.frOM.generate_count.setMaxLength(5)
+        self.frOM.generate_count.setMaxLength(9)
         self.frOM.btn_g_ok.setFocus()
         self.frOM.btn_g_cancel.clicked.connect(self.generateForm.close)
         self.frOM.btn_g_ok.clicked.connect(self.importGenerate)
@@ -787,29 +829,48 @@ class Main():
         self.generateForm.show()
 
     def importGenerate(self):
-        firstNumber = self.frOM.generate_num.text()
+        spec = self.frOM.generate_num.text().strip()
         RangeNum = self.frOM.generate_count.text()
-        if RangeNum == '':
-            RangeNum = 10
-        if firstNumber != '':
-            if not len(firstNumber) < 9:
-                path = fr"temp\generate-{self.Time()}.csv"
-                log.debug(firstNumber, path)
-                for i in range(int(RangeNum)):
-                    with open(fr"{path}", 'a+') as g:
-                        writer = csv.writer(g, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL,
-                                            lineterminator='\n')
-                        writer.writerow([fr"{firstNumber}"])
-                    firstNumber = int(firstNumber) + 1
-                    # log.debug(firstNumber)
-                self.generateForm.close()
-                self.ListLoader(path)
-                self.msgError(errorText=self.ln["listcreate_sucs"][self.cln], icon='Information', colorf="#214917")
-                os.remove(path)
-            else:
-                self.msgError(self.ln["num_valid"][self.cln])
-        else:
+        if spec == '':
             self.msgError(self.ln["generate_err"][self.cln])
+            return
+        try:
+            if self.ListThread.isRunning():
+                self.msgError(self.ln["listloader_err"][self.cln])
+                return
+        except AttributeError:
+            pass
+        try:
+            self.areaCode = int(self.ui.areaCode.text())
+        except:
+            pass
+        count = int(RangeNum) if RangeNum != '' else None
+        try:
+            spaces, sample = parseSpec(spec, self.areaCode, count)
+        except ValueError:
+            log.debug(f"generation spec {spec}")
+            self.msgError(self.ln["num_valid"][self.cln])
+            return
+        log.debug(spec)
+        asRanges = sample is None and len(spaces) >= RANGE_MIN and all(isinstance(space, RangeSpace)
+                                                                       for space in spaces.spaces)
+        # a sweep is kept as bitmaps up to RANGE_MAX numbers, anything else becomes rows
+        limit = RANGE_MAX if asRanges else MAX_GENERATED
+        if (len(spaces) if sample is None else min(sample, len(spaces))) > limit:
+            self.msgError(f'{self.ln["generate_max_err"][self.cln]} ({limit:,})')
+            return
+        self.generateForm.close()
+        if asRanges:
+            # a large sweep of whole ranges is kept as status bitmaps, not as rows
+            name = self.Time()
+            RangeStore.create(rangeFolder(name), [(space.start, len(space)) for space in spaces.spaces]).close()
+            storeNumbers(self.dbPath, name, (), source=spec)
+            self.ui.LogBox.clear()
+            self.listLoaded(name, len(spaces))
+            return
+        self.ui.btn_export.setEnabled(False)
+        self.startImport(ListGenerator(spec=spec, count=count, name=self.Time(), areaCode=self.areaCode,
+                                       dbPath=self.dbPath))
 
     def initImport(self):
         if self.cv == 0:
@@ -829,6 +890,7 @@ class Main():
         self.formQImport1.setWindowIcon(icon)
         self.fi.btn_import_cancel.clicked.connect(self.formQImport1.close)
         self.fi.btn_importFile.clicked.connect(self.btn_import)
+        self.fi.btn_importFolder.clicked.connect(self.btn_importFolder)
         self.fi.btn_importManual.clicked.connect(self.importManual)
 
     def importer(self):
@@ -837,9 +899,9 @@ class Main():
 
     def btn_import(self):
         options = QFileDialog.Options()
-        UserDesk = os.path.join(os.path.join(os.environ['USERPROFILE']), 'Desktop')
-        num_path, _ = QFileDialog.getOpenFileName(caption="", directory=UserDesk,
-                                                  filter="Excel Files (*.xlsx | *.xls | *.csv)", options=options)
+        UserDesk = desktopDir()
+        num_path, _ = QFileDialog.getOpenFileNames(caption="", directory=UserDesk,
+                                                   filter="Excel Files (*.xlsx | *.xls | *.csv)", options=options)
         try:
             if num_path:
                 self.formQImport1.close()
@@ -847,26 +909,35 @@ class Main():
             pass
         self.ListLoader(num_path)
 
+    def btn_importFolder(self):
+        folder = QFileDialog.getExistingDirectory(caption="", directory=desktopDir())
+        try:
+            if folder:
+                self.formQImport1.close()
+        except:
+            pass
+        self.ListLoader(folder)
+
     def importManual(self):
         nums = self.fi.manualNumber.toPlainText()
         if nums != '':
             try:
-                numLine = nums.split('\n')
-                numLine = set(numLine)
-                log.debug(numLine)
-                path = fr"temp\manualNumber-{self.Time()}.csv"
-                for num in numLine:
-                    if num == '':
-                        continue
-                    num = int(num)
-                    with open(fr"{path}", 'a+') as g:
-                        writer = csv.writer(g, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL,
-                                            lineterminator='\n')
-                        writer.writerow([fr"{num}"])
+                try:
+                    self.areaCode = int(self.ui.areaCode.text())
+                except:
+                    pass
+                normalize = normalizer(self.areaCode)
+                numbers = set(map(normalize, nums.split('\n')))
+                numbers.discard(None)
+                log.debug(numbers)
+                if not numbers:
+                    raise ValueError("no number")
+                name = self.Time()
+                storeNumbers(self.dbPath, name, numbers)
                 self.formQImport1.close()
-                self.ListLoader(path)
+                self.ui.LogBox.clear()
+                self.listLoaded(name, len(numbers))
                 self.msgError(errorText=self.ln["load_sucs"][self.cln], icon='Information', colorf="#214917")
-                os.remove(path)
             except:
                 self.msgError(self.ln["num_load_err"][self.cln])
         else:
@@ -889,7 +960,7 @@ class Main():
                 os.makedirs('temp/cache/')
         except:
             os.makedirs('./temp/cache/')
-        cacheList = os.listdir('temp/cache/')
+        cacheList = cachedAccounts()
         log.debug(cacheList)
         self.modelAcc = TableModel(cacheList)
         self.fia.accountsTable.setModel(self.modelAcc)
@@ -923,7 +994,7 @@ class Main():
 
     def selectIMG(self):
         options = QFileDialog.Options()
-        UserDesk = os.path.join(os.path.join(os.environ['USERPROFILE']), 'Desktop')
+        UserDesk = desktopDir()
         img_path, _ = QFileDialog.getOpenFileName(caption="", directory=UserDesk,
                                                   filter="Image Files (*.jpg | *.jpeg | *.png)", options=options)
         self.p = img_path
@@ -999,25 +1070,92 @@ class LoadingText(QMessageBox):
         event.accept()
 
 
-class ColorfullSqlQueryModel(QSqlQueryModel):
-    def __init__(self, dbcursor=None):
-        super(ColorfullSqlQueryModel, self).__init__()
-        self.red = []
-        self.green = []
-
-    def setRowsToBeColored(self, red=None, green=None):
-        if red != None:
-            self.red = red
-        if green != None:
-            self.green = green
-
-    def data(self, index, role):
+class NumberTableModel(QAbstractTableModel):
+    """
+    numbers view over one campaign, read in pages ordered by number as the view scrolls.
+    Numbers live in a sorted array and status/result in one byte per row, so finding the row of
+    a result is a binary search and colouring a cell is an index lookup.
+    """
+    STATUS = ('', '✓', '✓✓', '✓✓✓')
+    RESULT = ('', '☑', '☒')
+    CHUNK = 5000
+
+    def __init__(self, dbPath, name, headers=()):
+        super(NumberTableModel, self).__init__()
+        self.name = name
+        self.headers = list(headers)
+        self.conn = campaignStore.connect(dbPath)
+        self.campaign = campaignStore.campaignId(self.conn, name)
+        self.nums = array('q')
+        self.codes = bytearray()
+        self.exhausted = self.campaign is None
+        self.brushes = {1: QBrush(QColor('#AEF77E')), 2: QBrush(QColor('#FC500B'))}
+
+    def close(self):
+        self.conn.close()
+
+    def code(self, status, res):
+        status = self.STATUS.index(status) if status in self.STATUS else 0
+        res = self.RESULT.index(res) if res in self.RESULT else 0
+        return status << 2 | res
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.nums)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 3
+
+    def data(self, index, role=Qt.DisplayRole):
         row = index.row()
-        if role == Qt.BackgroundRole and row in self.red:
-            return QBrush(QColor('#FC500B'))
-        if role == Qt.BackgroundRole and row in self.green:
-            return QBrush(QColor('#AEF77E'))
-        return QSqlQueryModel.data(self, index, role)
+        if role == Qt.DisplayRole:
+            column = index.column()
+            if column == 0:
+                return self.nums[row]
+            if column == 1:
+                return self.STATUS[self.codes[row] >> 2]
+            return self.RESULT[self.codes[row] & 3]
+        if role == Qt.BackgroundRole:
+            return self.brushes.get(self.codes[row] & 3)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section] if section < len(self.headers) else None
+        return section + 1
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        last = self.nums[-1] if self.nums else -1
+        rows = self.conn.execute("select num, status, res from numbers where campaign = ? and num > ? "
+                                 "order by num limit ?", (self.campaign, last, self.CHUNK)).fetchall()
+        if len(rows) < self.CHUNK:
+            self.exhausted = True
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.nums), len(self.nums) + len(rows) - 1)
+        self.nums.extend(row[0] for row in rows)
+        self.codes.extend(self.code(row[1], row[2]) for row in rows)
+        self.endInsertRows()
+
+    def rowOf(self, num):
+        row = bisect_left(self.nums, num)
+        if row < len(self.nums) and self.nums[row] == num:
+            return row
+        return -1
+
+    def setResult(self, num, status, res):
+        """
+        update the row of `num` if it is loaded and return it, -1 otherwise
+        """
+        row = self.rowOf(num)
+        if row >= 0:
+            self.codes[row] = self.code(status, res)
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 2), [Qt.DisplayRole, Qt.BackgroundRole])
+        return row
 
 
 class NetWork(QThread):
@@ -0,0 +1,100 @@
+"""
+Compiled message templates, shared by envoie.py and the GUI text and caption tabs.
+
+A template is parsed once into lines of literal text and `{FIELD}` placeholders, each line knowing
+the fields it depends on. Rendering a contact is then a single pass over those lines: a line whose
+field is empty is dropped, the others are joined from their parts. Money fields go through a cached
+formatter, so the same amount appearing on thousands of statements is formatted once.
+"""
+import re
+import logging
+from functools import lru_cache
+
+log = logging.getLogger()
+
+PLACEHOLDER = re.compile(r"\{([^{}\n]+)\}")
+
+
+@lru_cache(maxsize=65536)
+def _format_money(amount):
+    try:
+        return "{:,.2f}".format(float(amount)).replace(",", " ").replace(".", ",")
+    except (ValueError, TypeError):
+        log.error(f"Erreur de formatage du montant : {amount}")
+        return str(amount)
+
+
+def format_money(amount):
+    """
+    12823.0 -> '12 823,00', values that are not numbers come back as they are
+    """
+    try:
+        return _format_money(amount)
+    except TypeError:
+        # unhashable value, nothing to cache
+        return _format_money.__wrapped__(amount)
+
+
+class Template(object):
+    def __init__(self, text, fields=None, money=()):
+        """
+        `fields` are the placeholders every contact is expected to have, a line using one of them is
+        dropped when the contact leaves it empty or lacks it. Other placeholders are filled when the
+        contact has them and left untouched otherwise. `money` names the fields shown as amounts.
+        """
+        self.text = text
+        self.fields = frozenset(fields or ())
+        self.money = frozenset(money)
+        self.lines = []
+        for line in text.split('\n'):
+            parts = PLACEHOLDER.split(line)
+            # parts alternate literal text and field names: literal, field, literal, ...
+            self.lines.append((tuple(parts), tuple(parts[1::2])))
+        self.used = frozenset(name for _, names in self.lines for name in names)
+
+    @property
+    def personalized(self):
+        return bool(self.used)
+
+    def values(self, contact):
+        """
+        the text of every placeholder of the template for `contact`, None when it stays as it is
+        """
+        values = {}
+        for name in self.used:
+            if name in contact:
+                value = contact[name]
+                if name in self.money:
+                    value = format_money(value)
+                values[name] = f"{value}" if value else ''
+            elif name in self.fields:
+                values[name] = ''
+            else:
+                values[name] = None
+        return values
+
+    def render(self, contact):
+        if not self.used:
+            return self.text
+        values = self.values(contact)
+        out = []
+        for parts, names in self.lines:
+            if any(values[name] == '' for name in names):
+                continue
+            if not names:
+                out.append(parts[0])
+                continue
+            chunks = list(parts)
+            for i in range(1, len(chunks), 2):
+                value = values[chunks[i]]
+                chunks[i] = '{' + chunks[i] + '}' if value is None else value
+            out.append(''.join(chunks))
+        return '\n'.join(out)
+
+
+@lru_cache(maxsize=64)
+def compile_template(text, fields=(), money=()):
+    """
+    compiled `Template` for `text`, parsed once however many contacts use it
+    """
+    return Template(text, fields, money)
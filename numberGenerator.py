@@ -0,0 +1,222 @@
+"""
+Phone number generation for campaigns.
+
+A generation spec is a list of items separated by commas, semicolons or spaces:
+
+    9053212345          one number, the first of a run of `count` consecutive numbers
+    90532???????        a mask, every `?` (or `x`) is any digit
+    905321000000-905321999999
+                        a range, both ends included
+
+Items are turned into number spaces that are never materialized: a space knows its size and its
+i-th number, so a mask of ten billion numbers costs nothing until it is read. Masks and ranges are
+generated whole, or sampled without replacement when a `count` smaller than their size is given:
+the indices are visited through a keyed Feistel permutation, which needs constant memory whatever
+the size of the space. Once analyses have run, the ranges are cut in blocks ranked by the prefix
+hit rates of prefixIndex and the dead ones are left out. Numbers are streamed into
+`numberLoader.ingestNumbers`, no file in between.
+"""
+import random
+import re
+from bisect import bisect_right
+from itertools import accumulate, chain, islice
+
+import campaignStore
+from listReader import DIGITS, PROGRESS_ROWS
+from numberLoader import ListImporter, ingestNumbers
+from prefixIndex import PrefixIndex
+
+ITEM = re.compile(r"^(?P<first>[\d?xX]+)(?:-(?P<last>\d+))?$")
+SEPARATORS = re.compile(r"[\s,;]+")
+WILDCARDS = '?xX'
+DEFAULT_COUNT = 10
+# numbers a single generation writes as rows at most
+MAX_GENERATED = 5000000
+ROUNDS = 4
+
+
+class RangeSpace(object):
+    """
+    the numbers start, start + 1, ..., stop - 1
+    """
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __iter__(self):
+        return iter(range(self.start, self.stop))
+
+    def at(self, index):
+        return self.start + index
+
+
+class MaskSpace(object):
+    """
+    the numbers matching a mask whose wildcards are not all at the end (trailing wildcards are a
+    RangeSpace); the i-th number puts the digits of i in the wildcards, last wildcard first
+    """
+    def __init__(self, mask):
+        self.mask = mask
+        self.base = int(''.join('0' if ch in WILDCARDS else ch for ch in mask))
+        self.weights = [10 ** (len(mask) - 1 - i) for i, ch in enumerate(mask) if ch in WILDCARDS][::-1]
+
+    def __len__(self):
+        return 10 ** len(self.weights)
+
+    def __iter__(self):
+        return map(self.at, range(len(self)))
+
+    def at(self, index):
+        value = self.base
+        for weight in self.weights:
+            index, digit = divmod(index, 10)
+            value += digit * weight
+        return value
+
+
+class Spaces(object):
+    """
+    several spaces read one after the other as a single space
+    """
+    def __init__(self, spaces):
+        self.spaces = [space for space in spaces if len(space)]
+        self.offsets = [0] + list(accumulate(len(space) for space in self.spaces))
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __iter__(self):
+        return chain.from_iterable(self.spaces)
+
+    def at(self, index):
+        i = bisect_right(self.offsets, index) - 1
+        return self.spaces[i].at(index - self.offsets[i])
+
+
+def withAreaCode(text, areaCode):
+    """
+    the same completion as `listReader.normalizer`, applied to a mask or a range end
+    """
+    areaCode = f"{areaCode}"
+    if text.startswith(areaCode):
+        return text
+    if text.startswith('0'):
+        return areaCode + text[1:]
+    return areaCode + text
+
+
+def maskSpace(mask):
+    fixed = mask.rstrip(WILDCARDS)
+    if not any(ch in WILDCARDS for ch in fixed):
+        # wildcards only at the end: a contiguous range
+        size = 10 ** (len(mask) - len(fixed))
+        start = int(fixed or '0') * size
+        return RangeSpace(start, start + size)
+    return MaskSpace(mask)
+
+
+def parseSpec(text, areaCode='', count=None):
+    """
+    the Spaces named by `text`, and the number of them to sample (None for all). A plain number
+    is the first of `count` consecutive numbers, as the generator always did. Raises ValueError
+    for an item that does not name phone numbers.
+    """
+    spaces = []
+    sample = None
+    items = [item for item in SEPARATORS.split(text.strip()) if item]
+    if not items:
+        raise ValueError("empty generation spec")
+    for item in items:
+        match = ITEM.match(item)
+        if match is None:
+            raise ValueError(f"invalid generation item {item}")
+        first = withAreaCode(match.group('first'), areaCode)
+        if DIGITS.fullmatch(first.translate({ord(ch): '0' for ch in WILDCARDS})) is None:
+            raise ValueError(f"{item} is shorter than a phone number")
+        if match.group('last') is not None:
+            if any(ch in WILDCARDS for ch in first):
+                raise ValueError(f"invalid generation item {item}")
+            last = int(withAreaCode(match.group('last'), areaCode))
+            spaces.append(RangeSpace(int(first), last + 1))
+            sample = count
+        elif any(ch in WILDCARDS for ch in first):
+            spaces.append(maskSpace(first))
+            sample = count
+        else:
+            spaces.append(RangeSpace(int(first), int(first) + (count or DEFAULT_COUNT)))
+    spaces = Spaces(spaces)
+    if len(spaces) == 0:
+        raise ValueError(f"{text} names no number")
+    return spaces, sample
+
+
+def permutation(size, seed=None):
+    """
+    every index of range(size) once, in a random order, in constant memory: a Feistel network is
+    a bijection of the smallest even-bit domain holding `size`, the indices falling outside are
+    skipped
+    """
+    rng = random.Random(seed)
+    half = (max(size - 1, 1).bit_length() + 1) // 2
+    mask = (1 << half) - 1
+    keys = [rng.getrandbits(64) for _ in range(ROUNDS)]
+    for index in range(1 << (2 * half)):
+        left, right = index >> half, index & mask
+        for key in keys:
+            left, right = right, left ^ ((((right ^ key) * 0x9E3779B97F4A7C15) >> 29) & mask)
+        value = (left << half) | right
+        if value < size:
+            yield value
+
+
+def generate(spaces, count=None, seed=None):
+    """
+    the numbers of `spaces`, all of them in order, or `count` of them drawn without replacement
+    """
+    size = len(spaces)
+    if count is None or count >= size:
+        return iter(spaces)
+    return map(spaces.at, islice(permutation(size, seed), count))
+
+
+def steer(spaces, index):
+    """
+    `spaces` with the ranges cut in blocks, the dead ones dropped and the best expected rate first
+    (see prefixIndex); spaces are left as they are while the index has no verdict
+    """
+    ranges = [(space.start, space.stop) for space in spaces.spaces if isinstance(space, RangeSpace)]
+    if not ranges or index.verdicts() == 0:
+        return spaces
+    others = [space for space in spaces.spaces if not isinstance(space, RangeSpace)]
+    return Spaces([RangeSpace(start, stop) for start, stop in index.windows(ranges)] + others)
+
+
+class ListGenerator(ListImporter):
+    """
+    ListImporter writing the numbers of a generation spec instead of reading files
+    """
+    def __init__(self, parent=None, spec='', count=None, name='', areaCode='', dbPath='', seed=None):
+        super(ListGenerator, self).__init__(parent, path=spec, name=name, areaCode=areaCode, dbPath=dbPath)
+        self.spec = spec
+        self.total = count
+        self.seed = seed
+
+    def load(self):
+        spaces, sample = parseSpec(self.spec, self.areaCode, self.total)
+        conn = campaignStore.connect(self.dbPath)
+        try:
+            spaces = steer(spaces, PrefixIndex(conn))
+        finally:
+            conn.close()
+        total = max(len(spaces) if sample is None else min(sample, len(spaces)), 1)
+
+        def counted(numbers):
+            for i, num in enumerate(numbers, start=1):
+                yield num
+                if i % PROGRESS_ROWS == 0:
+                    self.report(i / total)
+        return ingestNumbers(self.dbPath, self.name, counted(generate(spaces, sample, self.seed)), source=self.spec,
+                             count=self.count.emit, cancelled=lambda: self.isCancelled)
@@ -0,0 +1,221 @@
+"""
+Bulk ingestion of phone number lists into the GUI database.
+
+Files are read as a stream by listReader (csv through a memory map, xlsx straight from the
+archive, xls row by row) so memory stays flat whatever their size. Cells are normalized with
+patterns compiled once per import and written in parameterized `executemany` batches inside one
+transaction, so a list of half a million numbers loads in seconds, on a `ListImporter` thread
+that reports progress and can be cancelled. Several files, a folder or a glob are parsed in a
+process pool and merged into one campaign, numbers repeated across files are kept once; any
+other iterable of numbers (the generator of numberGenerator) goes through `ingestNumbers`. The
+database is never deleted: WAL mode lets the table view keep its connection open while a new
+list is written.
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from PyQt5.QtCore import pyqtSignal, QThread
+
+import campaignStore
+from appLog import log
+from campaignStore import createCampaign
+# the readers run in the pool processes, they live in a module that imports no Qt
+from listReader import cells, listFiles, normalizer, parseFile
+
+BATCH_SIZE = 5000
+
+FileStats = namedtuple('FileStats', ['path', 'cells', 'numbers', 'added', 'error'])
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class NoListFile(Exception):
+    pass
+
+
+def connect(dbPath):
+    dbi = campaignStore.connect(dbPath)
+    dbi.execute("PRAGMA temp_store=MEMORY")
+    dbi.execute("PRAGMA cache_size=-65536")
+    return dbi
+
+
+INSERT_NUMBER = "INSERT OR IGNORE INTO numbers (campaign, num, status) VALUES (?, ?, '')"
+
+
+def storeNumbers(dbPath, name, numbers, source=''):
+    """
+    write `numbers` into the campaign `name` in one transaction, return how many were added
+    """
+    dbi = connect(dbPath)
+    try:
+        with dbi:
+            dbi.execute("BEGIN")
+            campaign = createCampaign(dbi, name, source)
+            before = dbi.total_changes
+            dbi.executemany(INSERT_NUMBER, ((campaign, num) for num in sorted(numbers)))
+            return dbi.total_changes - before
+    finally:
+        dbi.close()
+
+
+def ingestNumbers(dbPath, name, numbers, source='', count=None, cancelled=None):
+    """
+    stream the iterable `numbers` into the campaign `name`, batch by batch inside one transaction,
+    and return how many were added. Nothing is kept when `cancelled()` turns true.
+    """
+    numbers = iter(numbers)
+    dbi = connect(dbPath)
+    try:
+        with dbi:
+            # the campaign is part of the transaction, a cancelled import leaves nothing behind
+            dbi.execute("BEGIN")
+            campaign = createCampaign(dbi, name, source)
+            before = dbi.total_changes
+            while True:
+                batch = list(islice(numbers, BATCH_SIZE))
+                if not batch:
+                    break
+                if cancelled is not None and cancelled():
+                    raise ImportCancelled(name)
+                # sorted, each batch walks the primary key once even when the numbers come in random order
+                batch.sort()
+                dbi.executemany(INSERT_NUMBER, ((campaign, num) for num in batch))
+                if count is not None:
+                    count(dbi.total_changes - before)
+            return dbi.total_changes - before
+    finally:
+        dbi.close()
+
+
+def ingest(dbPath, name, path, areaCode, progress=None, count=None, cancelled=None):
+    """
+    stream the numbers of the file at `path` into the campaign `name`, see `ingestNumbers`
+    """
+    normalize = normalizer(areaCode)
+    numbers = (num for num in map(normalize, cells(path, progress)) if num is not None)
+    return ingestNumbers(dbPath, name, numbers, path, count, cancelled)
+
+
+def ingestMany(dbPath, name, paths, areaCode, workers=None, progress=None, count=None, fileDone=None,
+               cancelled=None):
+    """
+    parse `paths` in a process pool and merge their numbers into the campaign `name` inside one transaction;
+    the primary key drops the numbers already seen in another file. Returns a FileStats per file,
+    a file that cannot be read is reported and skipped.
+    """
+    stats = []
+    if not paths:
+        return stats
+    if cancelled is not None and cancelled():
+        raise ImportCancelled(name)
+    try:
+        source = os.path.commonpath(paths)
+    except ValueError:
+        # files on different drives have no common folder
+        source = paths[0]
+    dbi = connect(dbPath)
+    pool = ProcessPoolExecutor(max_workers=workers)
+    finished = False
+    try:
+        with dbi:
+            dbi.execute("BEGIN")
+            campaign = createCampaign(dbi, name, source)
+            before = dbi.total_changes
+            futures = {pool.submit(parseFile, path, areaCode): path for path in paths}
+            pending = set(futures)
+            while pending:
+                # a big file takes long to parse, cancellation is checked while waiting for it
+                ready, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in ready:
+                    if cancelled is not None and cancelled():
+                        raise ImportCancelled(name)
+                    path = futures[future]
+                    try:
+                        read, numbers = future.result()
+                    except Exception as e:
+                        log.exception(f"import of {path}")
+                        stat = FileStats(path, 0, 0, 0, f"{e}")
+                    else:
+                        mark = dbi.total_changes
+                        dbi.executemany(INSERT_NUMBER, ((campaign, num) for num in numbers))
+                        stat = FileStats(path, read, len(numbers), dbi.total_changes - mark, '')
+                    stats.append(stat)
+                    if fileDone is not None:
+                        fileDone(stat)
+                    if count is not None:
+                        count(dbi.total_changes - before)
+                    if progress is not None:
+                        progress(len(stats) / len(futures))
+                if cancelled is not None and cancelled():
+                    raise ImportCancelled(name)
+        finished = True
+        return stats
+    finally:
+        # a cancelled or failed import does not wait for the parses still running
+        pool.shutdown(wait=finished, cancel_futures=True)
+        dbi.close()
+
+
+class ListImporter(QThread):
+    progress = pyqtSignal(int)
+    count = pyqtSignal(int)
+    loaded = pyqtSignal(str, int)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal(str)
+    # the path named no list file, nothing was imported
+    empty = pyqtSignal(str)
+    # path, cells read, distinct numbers, numbers not seen in the files before, error
+    fileDone = pyqtSignal(str, int, int, int, str)
+
+    def __init__(self, parent=None, path='', name='', areaCode='', dbPath=''):
+        super(ListImporter, self).__init__(parent)
+        self.path = path
+        self.name = name
+        self.areaCode = areaCode
+        self.dbPath = dbPath
+        self.isCancelled = False
+        self.percent = -1
+
+    def report(self, fraction):
+        percent = int(fraction * 100)
+        if percent != self.percent:
+            self.percent = percent
+            self.progress.emit(percent)
+
+    def load(self):
+        """
+        write the numbers into the campaign, return how many were added
+        """
+        paths = listFiles(self.path)
+        if not paths:
+            raise NoListFile(self.path)
+        if len(paths) == 1:
+            return ingest(self.dbPath, self.name, paths[0], self.areaCode, progress=self.report,
+                          count=self.count.emit, cancelled=lambda: self.isCancelled)
+        stats = ingestMany(self.dbPath, self.name, paths, self.areaCode, progress=self.report,
+                           count=self.count.emit, fileDone=lambda stat: self.fileDone.emit(*stat),
+                           cancelled=lambda: self.isCancelled)
+        return sum(stat.added for stat in stats)
+
+    def run(self):
+        try:
+            added = self.load()
+            self.report(1)
+            self.loaded.emit(self.name, added)
+        except ImportCancelled:
+            log.debug(f"import of {self.path} cancelled")
+            self.cancelled.emit(self.name)
+        except NoListFile:
+            log.debug(f"no list file in {self.path}")
+            self.empty.emit(f"{self.path}")
+        except Exception as e:
+            log.exception(f"import of {self.path}")
+            self.failed.emit(f"{e}")
+
+    def stop(self):
+        self.isCancelled = True
@@ -0,0 +1,125 @@
+"""
+Hit rate of number prefixes, to spend browser time on the ranges that have WhatsApp users.
+
+Every analysis verdict counts as a hit (registered) or a miss (not registered) for each prefix of
+the number, from the empty prefix down to blocks of the last MIN_TAIL digits. The counts are a
+trie flattened into the `prefixes` table (see campaignStore), updated by the result writer in the
+transaction that records the verdicts. The expected rate of a prefix is its own rate smoothed
+toward the rate of its parent, so a prefix seen a few times is neither trusted nor ignored, and a
+prefix with DEAD_MIN misses and no hit is dead. The generator drops dead blocks and the analysis
+queue visits the blocks with the best expected rate first.
+"""
+MIN_TAIL = 3
+BLOCK = 10 ** MIN_TAIL
+# weight of the parent rate, in verdicts
+STRENGTH = 20
+# misses without a single hit after which a prefix is not worth browsing
+DEAD_MIN = 200
+# a range or a campaign split in more blocks than this is ranked by coarser blocks
+MAX_BLOCKS = 20000
+# coarsest bucket tried when ranking the numbers of a campaign
+MAX_BUCKET = 10 ** 9
+BATCH_SIZE = 500
+
+UPSERT = ("INSERT INTO prefixes (prefix, hits, misses) VALUES (?, ?, ?) ON CONFLICT (prefix) DO UPDATE SET "
+          "hits = hits + excluded.hits, misses = misses + excluded.misses")
+
+
+def prefixesOf(num):
+    """
+    the prefixes counted for `num`, shortest first, the empty one included
+    """
+    digits = f"{int(num)}"
+    return [digits[:depth] for depth in range(len(digits) - MIN_TAIL + 1)]
+
+
+def recordVerdicts(conn, verdicts):
+    """
+    add (num, registered) verdicts to the counts, inside the transaction of `conn`
+    """
+    counts = {}
+    for num, registered in verdicts:
+        for prefix in prefixesOf(num):
+            count = counts.setdefault(prefix, [0, 0])
+            count[0 if registered else 1] += 1
+    conn.executemany(UPSERT, ((prefix, hits, misses) for prefix, (hits, misses) in counts.items()))
+
+
+class PrefixIndex(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.stats = {}
+
+    def load(self, prefixes):
+        """
+        read the counts of `prefixes` and of their ancestors not read yet
+        """
+        wanted = set()
+        for prefix in prefixes:
+            wanted.update(prefix[:depth] for depth in range(len(prefix) + 1) if prefix[:depth] not in self.stats)
+        wanted = list(wanted)
+        for start in range(0, len(wanted), BATCH_SIZE):
+            batch = wanted[start:start + BATCH_SIZE]
+            found = {row[0]: (row[1], row[2]) for row in self.conn.execute(
+                f"SELECT prefix, hits, misses FROM prefixes WHERE prefix IN ({','.join('?' * len(batch))})", batch)}
+            for prefix in batch:
+                self.stats[prefix] = found.get(prefix, (0, 0))
+
+    def verdicts(self):
+        self.load([''])
+        return sum(self.stats[''])
+
+    def rate(self, prefix):
+        """
+        expected share of registered numbers under `prefix`
+        """
+        self.load([prefix])
+        rate = 0.0
+        for depth in range(len(prefix) + 1):
+            hits, misses = self.stats[prefix[:depth]]
+            if depth == 0:
+                rate = hits / (hits + misses) if hits + misses else 0.0
+            elif hits + misses:
+                rate = (hits + STRENGTH * rate) / (hits + misses + STRENGTH)
+        return rate
+
+    def dead(self, prefix):
+        """
+        True when `prefix` or one of its ancestors had DEAD_MIN misses and no hit
+        """
+        self.load([prefix])
+        for depth in range(1, len(prefix) + 1):
+            hits, misses = self.stats[prefix[:depth]]
+            if hits == 0 and misses >= DEAD_MIN:
+                return True
+        return False
+
+    def windows(self, ranges):
+        """
+        the live (start, stop) blocks of the (start, stop) `ranges`, best expected rate first
+        """
+        size = BLOCK
+        while sum((stop - 1) // size - start // size + 1 for start, stop in ranges if stop > start) > MAX_BLOCKS:
+            size *= 10
+        blocks = []
+        for start, stop in ranges:
+            first = start
+            while first < stop:
+                last = min((first // size + 1) * size, stop)
+                blocks.append((f"{first // size}", first, last))
+                first = last
+        self.load(prefix for prefix, _, _ in blocks)
+        live = [(prefix, first, last) for prefix, first, last in blocks if not self.dead(prefix)]
+        live.sort(key=lambda block: (-self.rate(block[0]), block[1]))
+        return [(first, last) for _, first, last in live]
+
+    def rankBuckets(self, counts, size=BLOCK):
+        """
+        the buckets (num // `size`) of `counts` {bucket: numbers} whose prefix is live, best expected
+        rate first, and how many numbers the dead ones hold
+        """
+        prefixes = {bucket: f"{bucket}" for bucket in counts}
+        self.load(prefixes.values())
+        live = [bucket for bucket in counts if not self.dead(prefixes[bucket])]
+        live.sort(key=lambda bucket: (-self.rate(prefixes[bucket]), bucket))
+        return live, sum(counts.values()) - sum(counts[bucket] for bucket in live)
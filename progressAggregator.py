@@ -0,0 +1,100 @@
+"""
+Coalesced progress display for the GUI.
+
+Workers emit a counter update and a log line per number; with several accounts that floods the
+event loop and the log view grows without bound. The `ProgressAggregator` only records what it
+receives and refreshes the LCD counters and the log once per timer tick, so the cost of the UI is
+constant per tick whatever the message rate. The log view keeps the last `logLines` lines, and
+the aggregator reports throughput and ETA from a sliding window of the reviewed counter.
+"""
+import time
+from collections import deque
+
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtGui import QTextCursor
+
+# seconds of history used for the throughput, and between two throughput lines in the log
+RATE_WINDOW = 60
+RATE_EVERY = 30
+
+
+class ProgressAggregator(QObject):
+    def __init__(self, parent=None, lcdReviewed=None, lcdWa=None, lcdNwa=None, logBox=None, interval=250,
+                 logLines=1000):
+        super(ProgressAggregator, self).__init__(parent)
+        self.lcds = (lcdReviewed, lcdWa, lcdNwa)
+        self.logBox = logBox
+        self.logLines = logLines
+        if logBox is not None:
+            logBox.setMaximumBlockCount(logLines)
+        self.counters = [0, 0, 0]
+        self.shown = [None, None, None]
+        self.lines = deque(maxlen=logLines)
+        self.samples = deque()
+        self.total = 0
+        self.started = None
+        self.lastRate = 0.0
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.tick)
+
+    def start(self, total=0):
+        """
+        reset the counters for a run over `total` numbers (0 when unknown) and start refreshing
+        """
+        self.counters = [0, 0, 0]
+        self.shown = [None, None, None]
+        self.samples.clear()
+        self.total = total
+        self.started = self.lastRate = time.monotonic()
+        self.timer.start()
+
+    def stop(self):
+        """
+        show what was received and stop refreshing
+        """
+        self.tick()
+        self.timer.stop()
+
+    def reviewed(self, value):
+        self.counters[0] = value
+
+    def found(self, value):
+        self.counters[1] = value
+
+    def notFound(self, value):
+        self.counters[2] = value
+
+    def log(self, text):
+        self.lines.append(text)
+
+    def rate(self, now):
+        """
+        numbers reviewed per second over the last RATE_WINDOW seconds
+        """
+        self.samples.append((now, self.counters[0]))
+        while len(self.samples) > 2 and self.samples[0][0] < now - RATE_WINDOW:
+            self.samples.popleft()
+        (first, done), (last, reached) = self.samples[0], self.samples[-1]
+        return (reached - done) / (last - first) if last > first else 0.0
+
+    def eta(self, rate):
+        if not self.total or rate <= 0:
+            return ''
+        seconds = int(max(self.total - self.counters[0], 0) / rate)
+        return f", ETA {seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+    def tick(self):
+        now = time.monotonic()
+        for i, lcd in enumerate(self.lcds):
+            if lcd is not None and self.counters[i] != self.shown[i]:
+                lcd.display(self.counters[i])
+                self.shown[i] = self.counters[i]
+        rate = self.rate(now) if self.started is not None else 0.0
+        if self.started is not None and now - self.lastRate >= RATE_EVERY:
+            self.lastRate = now
+            self.lines.append(f"-- {rate * 60:.1f} numbers/min{self.eta(rate)} --")
+        if self.lines and self.logBox is not None:
+            self.logBox.appendPlainText('\n'.join(self.lines))
+            self.logBox.moveCursor(QTextCursor.End)
+            self.lines.clear()
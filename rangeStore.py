@@ -0,0 +1,418 @@
+"""
+Compact store for generated campaigns made of contiguous number ranges.
+
+A generated sweep is millions of consecutive numbers; as rows of `numbers` each costs a b-tree
+entry, and the whole range used to be loaded in Python for the workers. Here each range is a
+block, its first number plus a memory-mapped array of 2-bit statuses (pending, registered, not
+registered, sent) under temp/ranges/<campaign>/, so ten million numbers take 2.5 MB on disk and
+nothing in memory but the pages touched. A status is read or written in O(1) from the offset of
+the number, and the next numbers with a given status are found by a regular expression run over
+the map, in C. `RangeQueue` hands them out to the workers like a CampaignQueue does. Every
+number settled is also appended to a journal with the step that settled it, and `sync` copies
+the entries not copied yet into the campaign tables, only when they are needed there (the list
+view, the export) and on a `RangeSyncer` thread.
+"""
+import os
+import mmap
+import re
+import shutil
+import struct
+import threading
+from bisect import bisect_right
+from collections import Counter
+from itertools import islice, repeat
+
+from PyQt5.QtCore import pyqtSignal, QThread
+
+import campaignStore
+from appLog import log
+from campaignQueue import Job
+
+PENDING, REGISTERED, NOT_REGISTERED, SENT = range(4)
+NAMES = ('pending', 'registered', 'not_registered', 'sent')
+# worker results (browserCtrl.Web) turned into statuses
+RESULTS = {'chat': REGISTERED, 'invalid': NOT_REGISTERED, 'sent': SENT, 'unconfirmed': SENT}
+# status mark of the numbers list for the step that settled a number, as browserCtrl.STEP_STATUS
+STEP_MARKS = {'A': '✓', 'M': '✓✓', 'I': '✓✓✓'}
+RANGE_ROOT = r"./temp/ranges"
+# generated campaigns at least this large are kept as ranges instead of rows
+RANGE_MIN = 1000000
+# largest sweep kept as ranges, 25 MB of blocks
+RANGE_MAX = 100000000
+BLOCK_FILE = re.compile(r"^(\d+)-(\d+)\.bits$")
+SYNC_BATCH = 5000
+# settled numbers not copied into the campaign tables yet: number, status, step
+JOURNAL_FILE = 'settled.journal'
+ENTRY = struct.Struct('<qBc')
+# journal offset copied so far and sync generation, the `updated` of the rows it wrote
+SYNCED_FILE = 'settled.synced'
+# bytes of a block copied and scanned at once
+SCAN_CHUNK = 1 << 16
+
+
+_locks = {}
+_locksLock = threading.Lock()
+# one sync at a time, so the generations are committed in order
+_syncLock = threading.Lock()
+
+
+def rangeFolder(name, root=RANGE_ROOT):
+    return os.path.join(root, name)
+
+
+def folderLock(folder):
+    """
+    the lock shared by every RangeStore opened on `folder` in this process
+    """
+    with _locksLock:
+        return _locks.setdefault(os.path.abspath(folder), threading.Lock())
+
+
+def marks(status, step):
+    """
+    status and res marks of the numbers list for a number settled with `status` by `step`
+    """
+    mark = STEP_MARKS.get(step) or ('✓✓' if status == SENT else '✓')
+    return mark, '☒' if status == NOT_REGISTERED else '☑'
+
+
+def statusPattern(statuses):
+    """
+    regular expression matching the bytes holding at least one of `statuses`
+    """
+    values = [value for value in range(256) if any(value >> shift & 3 in statuses for shift in (0, 2, 4, 6))]
+    single = b'[' + b''.join(re.escape(bytes([value])) for value in values) + b']'
+    if len(statuses) == 1:
+        # a run of bytes holding only that status is matched at once
+        return re.compile(re.escape(bytes([statuses[0] * 0x55])) + b'+|' + single)
+    return re.compile(single)
+
+
+def mergeRanges(ranges):
+    """
+    (start, size) ranges sorted, overlapping or touching ones merged
+    """
+    merged = []
+    for start, size in sorted(ranges):
+        if size <= 0:
+            continue
+        if merged and start <= merged[-1][0] + merged[-1][1]:
+            first, length = merged[-1]
+            merged[-1] = (first, max(length, start + size - first))
+        else:
+            merged.append((start, size))
+    return merged
+
+
+class Block(object):
+    """
+    the statuses of the numbers base, base + 1, ..., base + size - 1, four per byte
+    """
+    def __init__(self, path, base, size):
+        self.path = path
+        self.base = base
+        self.size = size
+        self.file = open(path, 'r+b')
+        self.bits = mmap.mmap(self.file.fileno(), 0)
+
+    def get(self, index):
+        return self.bits[index >> 2] >> ((index & 3) << 1) & 3
+
+    def set(self, index, status):
+        offset, shift = index >> 2, (index & 3) << 1
+        self.bits[offset] = self.bits[offset] & ~(3 << shift) & 0xFF | status << shift
+
+    def find(self, pattern, statuses, start=0, stop=None):
+        """
+        (index, status) from `start` to `stop` whose status is one of `statuses`, in order
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        last = (stop + 3) >> 2
+        for first in range(start >> 2, last, SCAN_CHUNK):
+            # a copy is scanned, no view of the map outlives a yield and the store can be closed
+            # while a cursor is still open
+            chunk = self.bits[first:min(first + SCAN_CHUNK, last)]
+            for match in pattern.finditer(chunk):
+                offset, end = match.span()
+                if end - offset > 1:
+                    status = statuses[0]
+                    yield from zip(range(max((first + offset) << 2, start), min((first + end) << 2, stop)),
+                                   repeat(status))
+                    continue
+                value = chunk[offset]
+                for index in range(max((first + offset) << 2, start), min((first + offset + 1) << 2, stop)):
+                    status = value >> ((index & 3) << 1) & 3
+                    if status in statuses:
+                        yield index, status
+
+    def counts(self):
+        counts = [0, 0, 0, 0]
+        for value, count in Counter(self.bits[:]).items():
+            for shift in (0, 2, 4, 6):
+                counts[value >> shift & 3] += count
+        # the last byte pads with pending entries past the end of the block
+        counts[PENDING] -= len(self.bits) * 4 - self.size
+        return counts
+
+    def flush(self):
+        self.bits.flush()
+
+    def close(self):
+        self.bits.close()
+        self.file.close()
+
+
+class RangeStore(object):
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = folderLock(folder)
+        self.blocks = []
+        for name in os.listdir(folder):
+            match = BLOCK_FILE.match(name)
+            if match is not None:
+                self.blocks.append(Block(os.path.join(folder, name), int(match.group(1)), int(match.group(2))))
+        self.blocks.sort(key=lambda block: block.base)
+        self.bases = [block.base for block in self.blocks]
+        # unbuffered appends: every store of the folder writes at the end, the file size is what was written
+        self.journal = open(os.path.join(folder, JOURNAL_FILE), 'ab', buffering=0)
+
+    @classmethod
+    def create(cls, folder, ranges):
+        """
+        a store of pending numbers over the (start, size) `ranges`
+        """
+        os.makedirs(folder, exist_ok=True)
+        for start, size in mergeRanges(ranges):
+            with open(os.path.join(folder, f"{start}-{size}.bits"), 'wb') as file:
+                file.truncate((size + 3) // 4)
+        return cls(folder)
+
+    @staticmethod
+    def exists(folder):
+        return os.path.isdir(folder) and any(BLOCK_FILE.match(name) for name in os.listdir(folder))
+
+    def __len__(self):
+        return sum(block.size for block in self.blocks)
+
+    def locate(self, num):
+        i = bisect_right(self.bases, num) - 1
+        if i >= 0 and num - self.blocks[i].base < self.blocks[i].size:
+            return self.blocks[i], num - self.blocks[i].base
+        raise KeyError(num)
+
+    def __contains__(self, num):
+        try:
+            self.locate(num)
+            return True
+        except KeyError:
+            return False
+
+    def get(self, num):
+        block, index = self.locate(num)
+        return block.get(index)
+
+    def set(self, num, status, step=''):
+        """
+        settle `num` with `status`, journaled with `step` for the next sync
+        """
+        block, index = self.locate(num)
+        with self.lock:
+            block.set(index, status)
+            self.journal.write(ENTRY.pack(num, status, (step or '-').encode('ascii')[:1]))
+
+    def items(self, statuses=(PENDING,), windows=None):
+        """
+        (num, status) of the numbers whose status is one of `statuses`, in order, or window by
+        window for a list of (start, stop) `windows`
+        """
+        statuses = tuple(statuses)
+        pattern = statusPattern(statuses)
+        if windows is None:
+            windows = self.ranges()
+        for start, stop in windows:
+            i = max(bisect_right(self.bases, start) - 1, 0)
+            for block in self.blocks[i:]:
+                if block.base >= stop:
+                    break
+                for index, status in block.find(pattern, statuses, max(start - block.base, 0), stop - block.base):
+                    yield block.base + index, status
+
+    def ranges(self):
+        return [(block.base, block.base + block.size) for block in self.blocks]
+
+    def numbers(self, statuses=(PENDING,), windows=None):
+        return (num for num, _ in self.items(statuses, windows))
+
+    def counts(self):
+        counts = [0, 0, 0, 0]
+        for block in self.blocks:
+            counts = [total + count for total, count in zip(counts, block.counts())]
+        return dict(zip(NAMES, counts))
+
+    def synced(self):
+        """
+        (journal offset, generation) of the last sync
+        """
+        try:
+            with open(os.path.join(self.folder, SYNCED_FILE)) as file:
+                offset, generation = file.read().split()
+            return int(offset), int(generation)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def markSynced(self, offset, generation):
+        path = os.path.join(self.folder, SYNCED_FILE)
+        with open(f"{path}.tmp", 'w') as file:
+            file.write(f"{offset} {generation}")
+        os.replace(f"{path}.tmp", path)
+
+    def entries(self, start, stop):
+        """
+        (num, status, step) of the journal between the offsets `start` and `stop`, in order
+        """
+        with open(os.path.join(self.folder, JOURNAL_FILE), 'rb') as file:
+            file.seek(start)
+            while start < stop:
+                data = file.read(min(SYNC_BATCH * ENTRY.size, stop - start))
+                if len(data) < ENTRY.size:
+                    return
+                data = data[:len(data) - len(data) % ENTRY.size]
+                start += len(data)
+                for num, status, step in ENTRY.iter_unpack(data):
+                    yield num, status, step.decode('ascii')
+
+    def sync(self, conn, campaign):
+        """
+        write the numbers settled since the last sync with their marks into `numbers` of the
+        campaign id `campaign`, return how many; the rows written have the generation of the sync
+        as `updated`, the watermark of the export
+        """
+        with _syncLock:
+            with self.lock:
+                start, generation = self.synced()
+                stop = os.path.getsize(os.path.join(self.folder, JOURNAL_FILE))
+            if stop < start:
+                # the journal was emptied by a sync whose offset was not recorded
+                start = 0
+            if stop == start:
+                return 0
+            generation += 1
+            count = 0
+            with conn:
+                entries = self.entries(start, stop)
+                while True:
+                    batch = [(campaign, num) + marks(status, step) + (generation,)
+                             for num, status, step in islice(entries, SYNC_BATCH)]
+                    if not batch:
+                        break
+                    conn.executemany("INSERT INTO numbers (campaign, num, status, res, updated) "
+                                     "VALUES (?, ?, ?, ?, ?) ON CONFLICT (campaign, num) DO UPDATE SET "
+                                     "status = excluded.status, res = excluded.res, updated = excluded.updated",
+                                     batch)
+                    count += len(batch)
+            with self.lock:
+                if os.path.getsize(os.path.join(self.folder, JOURNAL_FILE)) == stop:
+                    # everything journaled is copied, the journal starts over
+                    self.journal.truncate(0)
+                    stop = 0
+                self.markSynced(stop, generation)
+            return count
+
+    def flush(self):
+        for block in self.blocks:
+            block.flush()
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+        self.blocks = []
+        self.bases = []
+        self.journal.close()
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class RangeQueue(object):
+    """
+    the numbers of a RangeStore with one of `statuses`, handed out to the workers with the
+    interface of CampaignQueue; the status is the state, so a stopped run resumes by itself.
+    With (start, stop) `windows` only those are visited, in their order. `step` is journaled with
+    the numbers settled, for their marks.
+    """
+    def __init__(self, store, statuses=(PENDING,), campaign='', windows=None, step=''):
+        self.store = store
+        self.statuses = tuple(statuses)
+        self.campaign = campaign
+        self.windows = windows
+        self.step = step
+        self.lock = threading.Lock()
+        self.recover()
+
+    def recover(self):
+        with self.lock:
+            self.cursor = self.store.numbers(self.statuses, self.windows)
+
+    def claim(self, size):
+        with self.lock:
+            return [Job(None, num, None, 1) for num in islice(self.cursor, size)]
+
+    def stream(self, size=20):
+        while True:
+            jobs = self.claim(size)
+            if not jobs:
+                return
+            for job in jobs:
+                yield job
+
+    def done(self, key, result=None):
+        status = RESULTS.get(result)
+        if status is not None:
+            self.store.set(int(key), status, self.step)
+
+    def failed(self, key, result=None):
+        # the number keeps its status and is handed out again by the next run
+        pass
+
+    def counts(self):
+        counts = self.store.counts()
+        return {'pending': sum(counts[NAMES[status]] for status in self.statuses)}
+
+    def close(self):
+        with self.lock:
+            self.cursor.close()
+
+
+def syncCampaign(dbPath, name):
+    """
+    copy the numbers of the range campaign `name` settled since the last sync into its list,
+    return how many, None when its numbers are rows
+    """
+    folder = rangeFolder(name)
+    if not RangeStore.exists(folder):
+        return None
+    store = RangeStore(folder)
+    conn = campaignStore.connect(dbPath)
+    try:
+        return store.sync(conn, campaignStore.campaignId(conn, name))
+    finally:
+        conn.close()
+        store.close()
+
+
+class RangeSyncer(QThread):
+    synced = pyqtSignal(str, int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None, dbPath='', name=''):
+        super(RangeSyncer, self).__init__(parent)
+        self.dbPath = dbPath
+        self.name = name
+
+    def run(self):
+        try:
+            self.synced.emit(self.name, syncCampaign(self.dbPath, self.name) or 0)
+        except Exception as e:
+            log.exception(f"sync of {self.name}")
+            self.failed.emit(f"{e}")
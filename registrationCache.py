@@ -0,0 +1,194 @@
+"""
+Persistent cache of WhatsApp registrations, shared by the GUI engine (browserCtrl.Web) and envoie.py.
+
+Each verdict of the browser (the chat opened, or the "invalid number" dialog showed up) is kept per
+normalized number with the time it was checked and the account that checked it. The workers look the
+numbers up here first and only open in the browser those missing or older than the TTL, so a
+campaign over a customer base already analysed does not browse again. A number not on WhatsApp can
+register at any time, so that verdict gets its own, shorter TTL.
+"""
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+from campaignQueue import QUEUE_PATH
+
+DAY = 24 * 3600
+TTL = 30 * DAY
+NEGATIVE_TTL = 7 * DAY
+BATCH_SIZE = 500
+CSV_COLUMNS = ('num', 'registered', 'checked', 'account')
+
+
+def normalize(num):
+    """
+    the digits of `num` as an int ("+90 532 ..." and 90532... are the same key), None when there are none
+    """
+    digits = ''.join(ch for ch in f"{num}" if ch.isdigit())
+    return int(digits) if digits else None
+
+
+class RegistrationCache(object):
+    def __init__(self, path=QUEUE_PATH, ttl=TTL, negativeTtl=NEGATIVE_TTL):
+        """
+        `ttl` and `negativeTtl` are the seconds a registered and a not registered verdict are trusted
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self._local = threading.local()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.create()
+
+    def connect(self):
+        """
+        one connection per thread, so the pool workers can share the cache
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def create(self):
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS registrations (num INTEGER PRIMARY KEY, registered INTEGER NOT NULL, "
+                     "checked REAL NOT NULL, account TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS registrations_checked ON registrations (checked)")
+
+    def fresh(self, registered, checked, now):
+        return now - checked <= (self.ttl if registered else self.negativeTtl)
+
+    def lookup(self, num):
+        """
+        True or False when `num` was checked within the TTL, None when it has to be looked up
+        """
+        return self.lookup_many([num]).get(num)
+
+    def lookup_many(self, numbers):
+        """
+        {num: registered} for the `numbers` checked within the TTL, keyed as given
+        """
+        conn = self.connect()
+        keys = {}
+        for num in numbers:
+            key = normalize(num)
+            if key is not None:
+                keys.setdefault(key, []).append(num)
+        now = time.time()
+        known = {}
+        pending = list(keys)
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = pending[start:start + BATCH_SIZE]
+            rows = conn.execute(f"SELECT num, registered, checked FROM registrations "
+                                f"WHERE num IN ({','.join('?' * len(batch))})", batch)
+            for key, registered, checked in rows:
+                if self.fresh(registered, checked, now):
+                    for num in keys[key]:
+                        known[num] = bool(registered)
+        return known
+
+    def record(self, num, registered, account=None, checked=None):
+        self.record_many([(num, registered)], account, checked)
+
+    def record_many(self, verdicts, account=None, checked=None):
+        """
+        store (num, registered) pairs checked by `account`, replacing older verdicts
+        """
+        checked = time.time() if checked is None else checked
+        rows = [(key, int(bool(registered)), checked, account) for key, registered in
+                ((normalize(num), registered) for num, registered in verdicts) if key is not None]
+        if not rows:
+            return
+        conn = self.connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO registrations (num, registered, checked, account) "
+                             "VALUES (?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+    def forget(self, num):
+        self.connect().execute("DELETE FROM registrations WHERE num = ?", (normalize(num),))
+
+    def purge(self):
+        """
+        drop the expired verdicts, return how many
+        """
+        conn = self.connect()
+        now = time.time()
+        before = conn.total_changes
+        conn.execute("DELETE FROM registrations WHERE (registered AND checked < ?) OR (NOT registered AND checked < ?)",
+                     (now - self.ttl, now - self.negativeTtl))
+        return conn.total_changes - before
+
+    def export_csv(self, path, fresh=True):
+        """
+        write the verdicts (only those within the TTL with `fresh`) to a csv file, return how many
+        """
+        conn = self.connect()
+        rows = conn.execute("SELECT num, registered, checked, account FROM registrations ORDER BY num")
+        now = time.time()
+        count = 0
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(CSV_COLUMNS)
+            for row in rows:
+                if fresh and not self.fresh(row[1], row[2], now):
+                    continue
+                writer.writerow(row)
+                count += 1
+        return count
+
+    def import_csv(self, path):
+        """
+        merge the verdicts of a csv file written by `export_csv`, keeping the most recent verdict of
+        each number, return how many were taken
+        """
+        conn = self.connect()
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            rows = ((normalize(row['num']), int(row['registered']), float(row['checked']), row.get('account') or None)
+                    for row in csv.DictReader(file, delimiter=';'))
+            before = conn.total_changes
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("INSERT INTO registrations (num, registered, checked, account) VALUES (?, ?, ?, ?) "
+                                 "ON CONFLICT (num) DO UPDATE SET registered = excluded.registered, "
+                                 "checked = excluded.checked, account = excluded.account "
+                                 "WHERE excluded.checked > registrations.checked",
+                                 (row for row in rows if row[0] is not None))
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+        return conn.total_changes - before
+
+    def counts(self):
+        """
+        {'registered': n, 'not_registered': n, 'expired': n}
+        """
+        conn = self.connect()
+        now = time.time()
+        counts = {'registered': 0, 'not_registered': 0, 'expired': 0}
+        for registered, expired, count in conn.execute(
+                "SELECT registered, CASE WHEN registered THEN checked < ? ELSE checked < ? END, count(*) "
+                "FROM registrations GROUP BY 1, 2", (now - self.ttl, now - self.negativeTtl)):
+            if expired:
+                counts['expired'] += count
+            else:
+                counts['registered' if registered else 'not_registered'] += count
+        return counts
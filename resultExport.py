@@ -0,0 +1,237 @@
+"""
+Streaming export of campaign results.
+
+Results are read once, in a single pass, from the results of a campaign joined with its
+numbers, and every row goes to one open writer per output format: CSV, JSONL, and an
+XLSX sheet streamed into its archive (no spreadsheet library needed). Each export remembers the
+sequence of the last result it wrote, in commit order, so the next one only carries the results
+committed since. A campaign kept as ranges has no results: its settled numbers are synced from
+the blocks (rangeStore) and exported from its list, by sync generation.
+"""
+import csv
+import json
+import os
+import time
+import zipfile
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from PyQt5.QtCore import pyqtSignal, QThread
+
+import campaignStore
+from appLog import log
+from rangeStore import STEP_MARKS, syncCampaign
+
+FORMATS = ('csv', 'xlsx', 'jsonl')
+COLUMNS = ('number', 'mark', 'result', 'step', 'state', 'reason', 'attempts', 'updated')
+BATCH_ROWS = 10000
+
+RESULTS_QUERY = ("SELECT r.num, n.status, n.res, r.step, r.state, r.outcome, r.attempts, r.updated, r.seq "
+                 "FROM results AS r JOIN numbers AS n ON n.campaign = r.campaign AND n.num = r.num "
+                 "WHERE r.campaign = ? AND r.seq > ? ORDER BY r.seq")
+# the rows of a range campaign, written by its syncs: the step from the mark, no attempts nor time
+RANGES_QUERY = ("SELECT n.num, n.status, n.res, CASE n.status " +
+                " ".join(f"WHEN '{mark}' THEN '{step}'" for step, mark in STEP_MARKS.items()) +
+                " END, 'done', CASE WHEN n.res = '☒' THEN 'invalid' WHEN n.status = '✓' THEN 'chat' "
+                "ELSE 'sent' END, NULL, NULL, n.updated FROM numbers AS n "
+                "WHERE n.campaign = ? AND n.status != '' AND n.updated > ?")
+
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Results" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>',
+}
+
+
+def desktopDir():
+    """
+    the user's Desktop folder, the home folder when there is none
+    """
+    home = os.path.expanduser('~')
+    desktop = os.path.join(home, 'Desktop')
+    return desktop if os.path.isdir(desktop) else home
+
+
+@lru_cache(maxsize=4096)
+def stampText(second):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+
+
+@lru_cache(maxsize=4096)
+def jsonText(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+class CsvOutput(object):
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        # byte order mark, so Excel opens the file as UTF-8
+        self.file.write('\ufeff')
+        self.writer = csv.writer(self.file, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL,
+                                 lineterminator='\n')
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlOutput(object):
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.line = '{' + ', '.join(f'"{name}": %s' for name in COLUMNS) + '}\n'
+
+    def write(self, rows):
+        line = self.line
+        self.file.write(''.join(line % tuple(value if type(value) is int else jsonText(value) for value in row)
+                                for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxOutput(object):
+    """
+    one sheet written row by row straight into the archive, numbers as numbers, text inline
+    """
+    def __init__(self, path):
+        self.book = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        for name, part in XLSX_PARTS.items():
+            self.book.writestr(name, part)
+        self.sheet = self.book.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self.sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+        self.write([COLUMNS])
+
+    def write(self, rows):
+        cell = self.cell
+        self.sheet.write(''.join(f"<row>{''.join(map(cell, row))}</row>" for row in rows).encode('utf-8'))
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def text(value):
+        return f'<c t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+
+    def cell(self, value):
+        if value is None or value == '':
+            return '<c/>'
+        if isinstance(value, (int, float)):
+            return f'<c><v>{value}</v></c>'
+        return self.text(str(value))
+
+    def close(self):
+        self.sheet.write(b'</sheetData></worksheet>')
+        self.sheet.close()
+        self.book.close()
+
+
+OUTPUTS = {'csv': CsvOutput, 'xlsx': XlsxOutput, 'jsonl': JsonlOutput}
+
+
+def exportResults(dbPath, name, folder, formats=FORMATS, incremental=True, progress=None, cancelled=None):
+    """
+    write the results of the campaign `name` into `folder`, one file per format, and return the
+    paths written. With `incremental`, only the results settled since the last export of the
+    campaign are written; nothing is written when there are none.
+    """
+    # the numbers of a range campaign settled since its last sync are copied into its list first
+    ranges = syncCampaign(dbPath, name) is not None
+    conn = campaignStore.connect(dbPath)
+    try:
+        since = 0
+        if incremental:
+            row = conn.execute("SELECT watermark FROM exports WHERE name = ?", (name,)).fetchone()
+            since = row[0] if row else 0
+        campaign = campaignStore.campaignId(conn, name)
+        rows = conn.execute(RANGES_QUERY if ranges else RESULTS_QUERY, (campaign, since))
+        stamp = time.strftime('%Y%m%d%H%M%S')
+        paths = [os.path.join(folder, f"{name}-{stamp}.{kind}") for kind in formats]
+        outputs = []
+        watermark = since
+        count = 0
+        try:
+            for batch in iter(lambda: rows.fetchmany(BATCH_ROWS), []):
+                if not outputs:
+                    os.makedirs(folder, exist_ok=True)
+                    outputs = [OUTPUTS[kind](path) for kind, path in zip(formats, paths)]
+                watermark = max(watermark, max(row[8] for row in batch))
+                batch = [row[:7] + (stampText(int(row[7])) if row[7] is not None else '',) for row in batch]
+                for output in outputs:
+                    output.write(batch)
+                count += len(batch)
+                if cancelled is not None and cancelled():
+                    raise InterruptedError(name)
+                if progress is not None:
+                    progress(count)
+        except BaseException:
+            for output in outputs:
+                output.close()
+            for path in paths if outputs else ():
+                os.remove(path)
+            raise
+        for output in outputs:
+            output.close()
+        if progress is not None:
+            progress(count)
+        if not outputs:
+            return []
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO exports (name, watermark) VALUES (?, ?)", (name, watermark))
+        return paths
+    finally:
+        conn.close()
+
+
+class ResultExporter(QThread):
+    progress = pyqtSignal(int)
+    exported = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None, dbPath='', name='', folder='', formats=FORMATS, incremental=True):
+        super(ResultExporter, self).__init__(parent)
+        self.dbPath = dbPath
+        self.name = name
+        self.folder = folder
+        self.formats = formats
+        self.incremental = incremental
+        self.isCancelled = False
+
+    def run(self):
+        try:
+            paths = exportResults(self.dbPath, self.name, self.folder, self.formats, self.incremental,
+                                  progress=self.progress.emit, cancelled=lambda: self.isCancelled)
+            self.exported.emit(paths)
+        except InterruptedError:
+            log.debug(f"export of {self.name} cancelled")
+        except Exception as e:
+            log.exception(f"export of {self.name}")
+            self.failed.emit(f"{e}")
+
+    def stop(self):
+        self.isCancelled = True
@@ -0,0 +1,135 @@
+"""
+Background writer for campaign results.
+
+Workers hand their results to a `ResultWriter` queue instead of having the GUI thread run one
+UPDATE per number. The writer coalesces them into one transaction every `batchSize` results or
+`interval` milliseconds, whichever comes first, marking the numbers of the campaign, recording
+the results and attempts and settling the campaign queue jobs together, then publishes the
+committed rows so the view repaints only those. Analysis verdicts also update the prefix hit
+rates (prefixIndex) in the same transaction. The status written comes with the result, from
+the step that produced it. For a campaign kept as ranges (rangeStore) the status is only in the
+blocks and nothing is written per number.
+"""
+import queue
+import time
+from collections import namedtuple
+
+from PyQt5.QtCore import pyqtSignal, QThread
+
+import campaignStore
+from appLog import log
+from campaignQueue import QUEUE_PATH, DONE
+from prefixIndex import recordVerdicts
+
+# job: campaign queue job id (None when the worker has no queue)
+# step: 'A', 'M' or 'I', the worker step that produced the result
+# status, res: marks for the numbers list ('' leaves the row as it is)
+# state, outcome: campaign queue state and result text
+# cached: the verdict came from the RegistrationCache, it is already counted in the prefix rates
+Result = namedtuple('Result', ['job', 'num', 'step', 'status', 'res', 'state', 'outcome', 'started', 'finished',
+                               'cached'], defaults=[False])
+
+STOP = object()
+
+
+class ResultWriter(QThread):
+    # [(num, status, res), ...] rows of the numbers list written by the last transaction
+    committed = pyqtSignal(list)
+
+    def __init__(self, parent=None, dbPath=QUEUE_PATH, campaign='', batchSize=200, interval=250, ranges=False):
+        super(ResultWriter, self).__init__(parent)
+        self.dbPath = dbPath
+        self.campaign = campaign
+        # the numbers are a RangeStore sweep: their status lives in its blocks, rows per number
+        # would undo it, only the prefix hit rates are written
+        self.ranges = ranges
+        self.batchSize = batchSize
+        self.interval = interval / 1000
+        self.results = queue.Queue()
+        self.written = 0
+
+    def put(self, result):
+        """
+        queue `result` for the next transaction, safe to call from any thread
+        """
+        self.results.put(result)
+
+    def stop(self):
+        """
+        write what is queued and end the thread
+        """
+        self.results.put(STOP)
+
+    def collect(self):
+        """
+        block for a first result, then gather more until the batch is full or the interval ends
+        """
+        batch = [self.results.get()]
+        deadline = time.monotonic() + self.interval
+        while batch[-1] is not STOP and len(batch) < self.batchSize:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.results.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, conn, campaign, batch):
+        rows = [(result.status, result.res, result.finished, campaign, int(result.num)) for result in batch
+                if result.status]
+        jobs = [(result.state, result.outcome, result.finished, result.job) for result in batch
+                if result.job is not None]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if campaign is not None and not self.ranges:
+                conn.executemany("UPDATE numbers SET status = ?, res = ?, updated = ? WHERE campaign = ? AND num = ?",
+                                 rows)
+                # numbered after every result committed before, under the write lock: an export never
+                # misses a result committed after it, whatever its time
+                seq = conn.execute("SELECT coalesce(max(seq), 0) FROM results WHERE campaign = ?",
+                                   (campaign,)).fetchone()[0]
+                conn.executemany("INSERT INTO results (campaign, num, step, state, outcome, updated, seq) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (campaign, num, step) DO UPDATE SET "
+                                 "state = excluded.state, outcome = excluded.outcome, "
+                                 "attempts = attempts + 1, updated = excluded.updated, seq = excluded.seq",
+                                 ((campaign, int(result.num), result.step, result.state, result.outcome,
+                                   result.finished, seq + i) for i, result in enumerate(batch, start=1)))
+                conn.executemany("INSERT INTO attempts (campaign, num, step, outcome, started, finished) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)",
+                                 ((campaign, int(result.num), result.step, result.outcome, result.started,
+                                   result.finished) for result in batch))
+            # fresh analysis verdicts feed the hit rate of their prefixes
+            recordVerdicts(conn, ((int(result.num), result.outcome == 'chat') for result in batch
+                                  if result.step == 'A' and result.state == DONE and not result.cached and
+                                  result.outcome in ('chat', 'invalid')))
+            if jobs:
+                conn.executemany("UPDATE jobs SET state = ?, result = ?, updated = ? WHERE id = ?", jobs)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        self.written += len(batch)
+        if rows and campaign is not None and not self.ranges:
+            self.committed.emit([(num, status, res) for status, res, _, _, num in rows])
+
+    def run(self):
+        conn = campaignStore.connect(self.dbPath, isolation_level=None)
+        campaign = campaignStore.campaignId(conn, self.campaign)
+        try:
+            while True:
+                batch = self.collect()
+                stopping = batch[-1] is STOP
+                if stopping:
+                    batch.pop()
+                if batch:
+                    try:
+                        self.write(conn, campaign, batch)
+                    except Exception:
+                        log.exception(f"writing {len(batch)} results")
+                if stopping:
+                    break
+        finally:
+            conn.close()
+        log.debug(f"result writer wrote {self.written} results")